@@ -35,12 +35,8 @@ def get_symbol_id(symbols: list[str]) -> list[int]:
     Returns:
         list[int]: A list of unique identifiers corresponding to the provided symbols.
     """
-    symbol_ids = []
-    for symbol in symbols:
-        symbol_id = Database.get_symbol_id(symbol)
-        if symbol_id:
-            symbol_ids.append(symbol_id)
-    return symbol_ids
+    mapping = Database.get_symbol_ids(symbols)
+    return [mapping[symbol] for symbol in symbols if symbol in mapping]
 
 
 def get_candles(
@@ -64,29 +60,13 @@ def get_candles(
         pd.DataFrame: A DataFrame containing the candlestick data with a MultiIndex for columns.
     """
 
-    all_dataframes = []
-
     if feed == "db":
-        for symbol_id in symbol_ids:
-            symbol = Database.get_market(symbol_id)
-
-            if symbol is None:
-                raise ValueError(f"symbol_id {symbol_id} does not exist!")
-
-            candles = Database.get_candles(
-                symbol_id, timeframe, start_date, end_date)
-            df = pd.DataFrame(data=candles, columns=[
-                              'timestamp', 'open', 'high', 'low', 'close', 'volume'])
-
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
-            df.set_index('timestamp', inplace=True)
+        df = Database.get_aligned_candles(
+            symbol_ids, timeframe, start_date, end_date, join='outer')
 
-            df.columns = pd.MultiIndex.from_product([df.columns, [symbol[0]]])
+        if df is None:
+            raise ValueError(f"Could not load candles for symbol_ids {symbol_ids}!")
 
-            all_dataframes.append(df)
-
-        combined_df = pd.concat(all_dataframes, axis=1)
-
-        return combined_df
+        return df
     else:
         raise ValueError(f"Feed '{feed}' is not supported.")
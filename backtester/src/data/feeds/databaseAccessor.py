@@ -2,10 +2,23 @@ import requests
 import logging
 from decouple import config
 from typing import Optional
+import io
 import json
 
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
 log = logging.getLogger(__name__)
 
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+NPZ = 'application/x-npz'
+CANDLE_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
 
 class Database:
     """Database client that uses the database accessor API instead of direct database connections."""
@@ -69,6 +82,33 @@ class Database:
             log.error(f"Error getting symbol_id: {e}")
             return None
 
+    @staticmethod
+    def get_symbol_ids(symbols: list[str], exchange: Optional[str] = None) -> dict[str, int]:
+        """Get the symbol_ids of many symbols in one lookup. Unknown symbols are left out."""
+        try:
+            params = {'symbols': ','.join(symbols)}
+            if exchange:
+                params['exchange'] = exchange
+            response = Database._make_request('GET', '/markets/lookup', params=params)
+            markets = response.json()['markets']
+            return {symbol: market['symbol_id'] for symbol, market in markets.items()}
+        except Exception as e:
+            log.error(f"Error getting symbol_ids: {e}")
+            return {}
+
+    @staticmethod
+    def _candle_params(timeframe, start_date, end_date, limit) -> dict:
+        params: dict[str, object] = {
+            'timeframe': timeframe
+        }
+        if start_date:
+            params['start_date'] = start_date
+        if end_date:
+            params['end_date'] = end_date
+        if limit:
+            params['limit'] = limit
+        return params
+
     @staticmethod
     def get_candles(symbol_id: int,
                     timeframe: int,
@@ -78,20 +118,10 @@ class Database:
                     ) -> list:
         """Get aggregated candles from the database."""
         try:
-            params: dict[str, object] = {
-                'timeframe': timeframe
-            }
-            if start_date:
-                params['start_date'] = start_date
-            if end_date:
-                params['end_date'] = end_date
-            if limit:
-                params['limit'] = limit
-
             response = Database._make_request(
                 'GET',
                 f'/candles/{symbol_id}',
-                params=params,
+                params=Database._candle_params(timeframe, start_date, end_date, limit),
             )
             candles = response.json()
 
@@ -111,3 +141,118 @@ class Database:
         except Exception as e:
             log.error(f"Error getting candles: {e}")
             return []
+
+    @staticmethod
+    def get_candles_frame(symbol_id: int,
+                          timeframe: int,
+                          start_date: Optional[str] = None,
+                          end_date: Optional[str] = None,
+                          limit: Optional[int] = None,
+                          ) -> pd.DataFrame:
+        """Get aggregated candles as a timestamp indexed DataFrame.
+
+        Asks the API for binary columns (Arrow or npz) so that large ranges
+        are decoded without parsing one JSON object per candle.
+        """
+        accept = [f'{NPZ};q=0.9', 'application/json;q=0.5']
+        if pa is not None:
+            accept.insert(0, ARROW_STREAM)
+        try:
+            response = Database._make_request(
+                'GET',
+                f'/candles/{symbol_id}',
+                params=Database._candle_params(timeframe, start_date, end_date, limit),
+                headers={'Accept': ', '.join(accept)},
+            )
+            content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+
+            if content_type == ARROW_STREAM and pa is not None:
+                table = pa.ipc.open_stream(response.content).read_all()
+                df = table.to_pandas(split_blocks=True, self_destruct=True)
+            elif content_type == NPZ:
+                with np.load(io.BytesIO(response.content)) as arrays:
+                    columns = {name: arrays[name] for name in arrays.files}
+                columns['timestamp'] = pd.to_datetime(columns['timestamp'], unit='ms')
+                df = pd.DataFrame(columns, copy=False)
+            else:
+                candles = response.json()
+                if not isinstance(candles, list):
+                    raise ValueError(candles)
+                df = pd.DataFrame(candles, columns=CANDLE_COLUMNS)
+                df['timestamp'] = pd.to_datetime(df['timestamp'])
+
+            return df.set_index('timestamp')[CANDLE_COLUMNS[1:]]
+
+        except Exception as e:
+            log.error(f"Error getting candles: {e}")
+            return pd.DataFrame(columns=CANDLE_COLUMNS).set_index('timestamp')
+
+    @staticmethod
+    def get_bars(symbol_id: int,
+                 bar_type: str,
+                 size: Optional[float] = None,
+                 timeframe: str = 'M1',
+                 start_date: Optional[str] = None,
+                 end_date: Optional[str] = None,
+                 limit: Optional[int] = None,
+                 price: str = 'bid',
+                 ) -> pd.DataFrame:
+        """Get volume, range, renko, heikin_ashi or tick bars built by the API.
+
+        Indexed by the bar's first timestamp, with the bar's last timestamp
+        as column 'end'.
+        """
+        columns = CANDLE_COLUMNS + ['end']
+        try:
+            params = Database._candle_params(timeframe, start_date, end_date, limit)
+            params['type'] = bar_type
+            params['price'] = price
+            if size is not None:
+                params['size'] = size
+            response = Database._make_request('GET', f'/bars/{symbol_id}', params=params)
+            response.raise_for_status()
+            df = pd.DataFrame(response.json()['bars'], columns=columns)
+            df['timestamp'] = pd.to_datetime(df['timestamp'])
+            df['end'] = pd.to_datetime(df['end'])
+            return df.set_index('timestamp')
+
+        except Exception as e:
+            log.error(f"Error getting bars: {e}")
+            return pd.DataFrame(columns=columns).set_index('timestamp')
+
+    @staticmethod
+    def get_aligned_candles(symbol_ids: list[int],
+                            timeframe: int,
+                            start_date: Optional[str] = None,
+                            end_date: Optional[str] = None,
+                            limit: Optional[int] = None,
+                            join: str = 'outer',
+                            ) -> pd.DataFrame | None:
+        """Get candles of several symbols aligned on one timestamp axis.
+
+        All symbols are fetched with a single request. Columns are a
+        MultiIndex of (field, symbol); returns None if the request fails,
+        e.g. because a symbol_id does not exist.
+        """
+        try:
+            params = Database._candle_params(timeframe, start_date, end_date, limit)
+            params['symbol_ids'] = ','.join(str(symbol_id) for symbol_id in symbol_ids)
+            params['join'] = join
+
+            response = Database._make_request('GET', '/candles', params=params)
+            response.raise_for_status()
+            data = response.json()
+
+            index = pd.DatetimeIndex(pd.to_datetime(data['timestamp']), name='timestamp')
+            frames = {
+                (field, market['symbol']): market[field]
+                for field in CANDLE_COLUMNS[1:]
+                for market in data['symbols']
+            }
+            df = pd.DataFrame(frames, index=index, dtype=float)
+            df.columns = pd.MultiIndex.from_tuples(df.columns)
+            return df
+
+        except Exception as e:
+            log.error(f"Error getting aligned candles: {e}")
+            return None
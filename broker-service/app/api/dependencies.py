@@ -2,6 +2,7 @@ from fastapi import Depends, Header, HTTPException, Request
 
 from app.application.services import (
     AccountService,
+    BackfillService,
     MarketDataService,
     OrderService,
     PositionService,
@@ -49,3 +50,9 @@ def get_market_data_service(
     container: ServiceContainer = Depends(get_container),
 ) -> MarketDataService:
     return container.market_data_service
+
+
+def get_backfill_service(
+    container: ServiceContainer = Depends(get_container),
+) -> BackfillService:
+    return container.backfill_service
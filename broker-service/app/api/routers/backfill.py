@@ -0,0 +1,76 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.api.dependencies import get_account_id, get_backfill_service
+from app.api.schemas import BackfillRequest, BackfillStatusResponse
+from app.application.services import BackfillService
+from app.domain.value_objects import AccountId, BackfillStatus, Timeframe
+
+router = APIRouter(
+    prefix="/symbols",
+    tags=["backfill"]
+)
+
+
+def _serialize_status(status: BackfillStatus) -> BackfillStatusResponse:
+    return BackfillStatusResponse(
+        running=status.running,
+        fromTs=status.from_ts,
+        toTs=status.to_ts,
+        watermark=status.watermark,
+        windowsTotal=status.windows_total,
+        windowsDone=status.windows_done,
+        barsFetched=status.bars_fetched,
+        barsWritten=status.bars_written,
+        startedAt=status.started_at,
+        finishedAt=status.finished_at,
+        error=status.error,
+    )
+
+
+@router.post("/{symbol}/backfill", response_model=BackfillStatusResponse)
+async def start_backfill(
+    symbol: str,
+    payload: BackfillRequest,
+    account_id: AccountId = Depends(get_account_id),
+    service: BackfillService = Depends(get_backfill_service),
+):
+    try:
+        status = await service.start_backfill(
+            account_id,
+            symbol.upper(),
+            payload.timeframe,
+            payload.from_ts,
+            payload.to_ts,
+            payload.resume,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return _serialize_status(status)
+
+
+@router.post("/{symbol}/backfill/stop", response_model=BackfillStatusResponse)
+async def stop_backfill(
+    symbol: str,
+    timeframe: Timeframe = Query(
+        default=Timeframe.M1,
+        description="Timeframe enum, e.g. M1"
+    ),
+    account_id: AccountId = Depends(get_account_id),
+    service: BackfillService = Depends(get_backfill_service),
+):
+    status = await service.stop_backfill(account_id, symbol.upper(), timeframe)
+    return _serialize_status(status)
+
+
+@router.get("/{symbol}/backfill/status", response_model=BackfillStatusResponse)
+async def backfill_status(
+    symbol: str,
+    timeframe: Timeframe = Query(
+        default=Timeframe.M1,
+        description="Timeframe enum, e.g. M1"
+    ),
+    account_id: AccountId = Depends(get_account_id),
+    service: BackfillService = Depends(get_backfill_service),
+):
+    status = await service.backfill_status(account_id, symbol.upper(), timeframe)
+    return _serialize_status(status)
@@ -6,6 +6,7 @@ from app.domain.models import Symbol
 from app.domain.value_objects import (
     OrderType,
     TickStreamOptions,
+    Timeframe,
     TradeSide,
 )
 
@@ -145,3 +146,39 @@ class TrendbarResponse(BaseModel):
     model_config = {
         "json_encoders": {Decimal: float},
     }
+
+
+class BackfillRequest(BaseModel):
+    timeframe: Timeframe = Field(default=Timeframe.M1, description="Timeframe enum, e.g. M1")
+    from_ts: int = Field(..., alias="fromTs", ge=0, description="From timestamp (epoch millis)")
+    to_ts: int | None = Field(
+        default=None,
+        alias="toTs",
+        description="To timestamp (epoch millis, exclusive), defaults to now",
+    )
+    resume: bool = Field(
+        default=True,
+        description="Continue a saved backfill of this range at its watermark",
+    )
+
+    model_config = {
+        "populate_by_name": True,
+    }
+
+
+class BackfillStatusResponse(BaseModel):
+    running: bool
+    from_ts: int | None = Field(default=None, alias="fromTs")
+    to_ts: int | None = Field(default=None, alias="toTs")
+    watermark: int | None = None
+    windows_total: int = Field(default=0, alias="windowsTotal")
+    windows_done: int = Field(default=0, alias="windowsDone")
+    bars_fetched: int = Field(default=0, alias="barsFetched")
+    bars_written: int = Field(default=0, alias="barsWritten")
+    started_at: float | None = Field(default=None, alias="startedAt")
+    finished_at: float | None = Field(default=None, alias="finishedAt")
+    error: str | None = None
+
+    model_config = {
+        "populate_by_name": True,
+    }
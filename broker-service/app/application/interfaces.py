@@ -4,6 +4,7 @@ from typing import Protocol
 from app.domain.models import Account, Deal, Order, Position, Symbol, Tick, Trendbar
 from app.domain.value_objects import (
     AccountId,
+    BackfillStatus,
     OrderId,
     PositionId,
     SymbolDescriptor,
@@ -139,3 +140,39 @@ class TrendbarStreamRegistryPort(Protocol):
         symbol: str,
         timeframe: Timeframe,
     ) -> TrendbarStreamStatus: ...
+
+
+class CandleSinkPort(Protocol):
+    """Bulk destination of historical candles."""
+
+    @abstractmethod
+    def supports(self, timeframe: Timeframe) -> bool: ...
+
+    @abstractmethod
+    async def write_candles(
+        self,
+        symbol: str,
+        timeframe: Timeframe,
+        candles: list[Trendbar],
+    ) -> int: ...
+
+
+class BackfillStatePort(Protocol):
+    """Persistent backfill progress, so interrupted backfills can resume."""
+
+    @abstractmethod
+    async def load_status(
+        self,
+        account_id: AccountId,
+        symbol: str,
+        timeframe: Timeframe,
+    ) -> BackfillStatus | None: ...
+
+    @abstractmethod
+    async def save_status(
+        self,
+        account_id: AccountId,
+        symbol: str,
+        timeframe: Timeframe,
+        status: BackfillStatus,
+    ) -> None: ...
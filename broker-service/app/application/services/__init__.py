@@ -1,10 +1,12 @@
 from .account_service import AccountService
+from .backfill_service import BackfillService
 from .market_data_service import MarketDataService
 from .order_service import OrderService
 from .trade_service import PositionService
 
 __all__ = [
     "AccountService",
+    "BackfillService",
     "MarketDataService",
     "OrderService",
     "PositionService",
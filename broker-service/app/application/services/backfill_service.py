@@ -0,0 +1,261 @@
+"""Historical backfill of broker candles into the candle database.
+
+A backfill request for (symbol, timeframe, from_ts, to_ts) is split into
+windows of at most ``window_bars`` bars. Windows are fetched by a few
+concurrent workers, every broker request waits for the shared rate limiter,
+and each fetched window is written to the sink right away.
+
+Windows can finish out of order, so progress is kept as a watermark: the end
+of the contiguous prefix of windows already written. The watermark is saved
+after every advance, and a new backfill starting inside a saved range resumes
+from it instead of refetching what is already stored.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from tenacity import AsyncRetrying, stop_after_attempt, wait_exponential
+
+from app.application.interfaces import BackfillStatePort, CandleSinkPort, MarketDataPort
+from app.domain.models import Trendbar
+from app.domain.value_objects import AccountId, BackfillStatus, Timeframe
+
+logger = logging.getLogger(__name__)
+
+# Upper bound of a bar's length, months are counted as 31 days so a window
+# never spans more than window_bars bars
+TIMEFRAME_MINUTES: dict[Timeframe, int] = {
+    Timeframe.M1: 1,
+    Timeframe.M2: 2,
+    Timeframe.M3: 3,
+    Timeframe.M4: 4,
+    Timeframe.M5: 5,
+    Timeframe.M10: 10,
+    Timeframe.M15: 15,
+    Timeframe.M30: 30,
+    Timeframe.H1: 60,
+    Timeframe.H4: 240,
+    Timeframe.H12: 720,
+    Timeframe.D1: 1440,
+    Timeframe.W1: 10080,
+    Timeframe.MN1: 44640,
+}
+
+BackfillKey = tuple[AccountId, str, Timeframe]
+
+
+def plan_windows(
+    timeframe: Timeframe,
+    from_ts: int,
+    to_ts: int,
+    window_bars: int,
+) -> list[tuple[int, int]]:
+    """Split [from_ts, to_ts) into windows of at most window_bars bars."""
+    span = TIMEFRAME_MINUTES[timeframe] * 60_000 * window_bars
+    return [(start, min(start + span, to_ts)) for start in range(from_ts, to_ts, span)]
+
+
+class RateLimiter:
+    """Spaces calls at least 1 / rate seconds apart, shared by all workers."""
+
+    def __init__(self, rate: float) -> None:
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_at - now
+            self._next_at = max(now, self._next_at) + self._interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class BackfillService:
+    def __init__(
+        self,
+        market_data_port: MarketDataPort,
+        sink: CandleSinkPort,
+        state: BackfillStatePort,
+        window_bars: int = 1000,
+        max_concurrency: int = 4,
+        requests_per_second: float = 5.0,
+        max_attempts: int = 3,
+    ) -> None:
+        self._market_data_port = market_data_port
+        self._sink = sink
+        self._state = state
+        self._window_bars = window_bars
+        self._max_concurrency = max(max_concurrency, 1)
+        self._max_attempts = max_attempts
+        self._requests = asyncio.Semaphore(self._max_concurrency)
+        self._rate_limiter = RateLimiter(requests_per_second)
+        self._statuses: dict[BackfillKey, BackfillStatus] = {}
+        self._tasks: dict[BackfillKey, asyncio.Task] = {}
+
+    async def start_backfill(
+        self,
+        account_id: AccountId,
+        symbol: str,
+        timeframe: Timeframe,
+        from_ts: int,
+        to_ts: int | None = None,
+        resume: bool = True,
+    ) -> BackfillStatus:
+        """Start a backfill in the background, or return the one already running.
+
+        With resume, a saved backfill whose written range contains from_ts
+        continues at its watermark.
+        """
+        key = (account_id, symbol, timeframe)
+        task = self._tasks.get(key)
+        if task is not None and not task.done():
+            return self._statuses[key]
+
+        if not self._sink.supports(timeframe):
+            raise ValueError(f"Candle sink does not store {timeframe.value} candles")
+        to_ts = to_ts or int(time.time() * 1000)
+        if from_ts >= to_ts:
+            raise ValueError("fromTs must be before toTs")
+
+        start = from_ts
+        if resume:
+            saved = await self._state.load_status(account_id, symbol, timeframe)
+            if saved is not None and saved.from_ts is not None and saved.watermark is not None \
+                    and saved.from_ts <= from_ts < saved.watermark:
+                from_ts = saved.from_ts
+                start = min(saved.watermark, to_ts)
+
+        windows = plan_windows(timeframe, start, to_ts, self._window_bars)
+        status = BackfillStatus(
+            running=bool(windows),
+            from_ts=from_ts,
+            to_ts=to_ts,
+            watermark=start,
+            windows_total=len(windows),
+            started_at=time.time(),
+        )
+        self._statuses[key] = status
+        await self._state.save_status(account_id, symbol, timeframe, status)
+        if not windows:
+            status.finished_at = status.started_at
+            return status
+
+        self._tasks[key] = asyncio.create_task(
+            self._run(key, status, windows),
+            name=f"backfill:{account_id}:{symbol}:{timeframe.value}",
+        )
+        return status
+
+    async def stop_backfill(
+        self,
+        account_id: AccountId,
+        symbol: str,
+        timeframe: Timeframe,
+    ) -> BackfillStatus:
+        key = (account_id, symbol, timeframe)
+        task = self._tasks.get(key)
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        return await self.backfill_status(account_id, symbol, timeframe)
+
+    async def backfill_status(
+        self,
+        account_id: AccountId,
+        symbol: str,
+        timeframe: Timeframe,
+    ) -> BackfillStatus:
+        status = self._statuses.get((account_id, symbol, timeframe))
+        if status is None:
+            status = await self._state.load_status(account_id, symbol, timeframe)
+        return status or BackfillStatus(running=False)
+
+    async def shutdown(self) -> None:
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _run(
+        self,
+        key: BackfillKey,
+        status: BackfillStatus,
+        windows: list[tuple[int, int]],
+    ) -> None:
+        account_id, symbol, timeframe = key
+        pending = iter(enumerate(windows))
+        written: set[int] = set()
+        frontier = 0
+        save_lock = asyncio.Lock()
+
+        async def advance(index: int) -> None:
+            nonlocal frontier
+            written.add(index)
+            if index != frontier:
+                return
+            while frontier in written:
+                frontier += 1
+            status.watermark = windows[frontier - 1][1]
+            async with save_lock:
+                await self._state.save_status(account_id, symbol, timeframe, status)
+
+        async def worker() -> None:
+            # Workers share one iterator, so every window is taken exactly once
+            for index, (start, end) in pending:
+                bars = await self._fetch_window(account_id, symbol, timeframe, start, end)
+                status.bars_fetched += len(bars)
+                if bars:
+                    status.bars_written += await self._sink.write_candles(
+                        symbol, timeframe, bars)
+                status.windows_done += 1
+                await advance(index)
+
+        workers = [
+            asyncio.create_task(worker())
+            for _ in range(min(self._max_concurrency, len(windows)))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        except asyncio.CancelledError:
+            logger.info("Backfill of %s %s stopped at %s", symbol, timeframe.value,
+                        status.watermark)
+            raise
+        except Exception as exc:
+            logger.exception("Backfill of %s %s failed", symbol, timeframe.value)
+            status.error = str(exc)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            status.running = False
+            status.finished_at = time.time()
+            await self._state.save_status(account_id, symbol, timeframe, status)
+
+    async def _fetch_window(
+        self,
+        account_id: AccountId,
+        symbol: str,
+        timeframe: Timeframe,
+        start: int,
+        end: int,
+    ) -> list[Trendbar]:
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(self._max_attempts),
+            wait=wait_exponential(multiplier=0.5, max=10),
+            reraise=True,
+        ):
+            with attempt:
+                async with self._requests:
+                    await self._rate_limiter.wait()
+                    # The broker includes bars starting at toTimestamp and counts
+                    # back from it, so ask for the window without its end bar
+                    bars = await self._market_data_port.get_trendbars(
+                        account_id, symbol, timeframe, start, end - 1, self._window_bars)
+        # The end bar belongs to the next window
+        return [bar for bar in bars if start <= bar.t < end]
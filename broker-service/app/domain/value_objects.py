@@ -88,3 +88,20 @@ class TrendbarStreamStatus:
     last_bar_at: float | None
     uptime_seconds: float | None
     error: str | None = None
+
+
+@dataclass(slots=True)
+class BackfillStatus:
+    """Progress of a historical backfill of one symbol and timeframe."""
+    running: bool
+    from_ts: int | None = None
+    to_ts: int | None = None
+    watermark: int | None = None
+    """End (epoch millis) of the contiguous range already written, resume point."""
+    windows_total: int = 0
+    windows_done: int = 0
+    bars_fetched: int = 0
+    bars_written: int = 0
+    started_at: float | None = None
+    finished_at: float | None = None
+    error: str | None = None
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+import httpx
+
+from app.application.interfaces import CandleSinkPort
+from app.domain.models import Trendbar
+from app.domain.value_objects import Timeframe
+from app.settings import Settings
+
+
+class AccessorCandleSink(CandleSinkPort):
+    """Writes candles to database-accessor-api through its bulk COPY ingest.
+
+    The accessor stores 1 minute candles and aggregates higher timeframes
+    itself, so only M1 bars are accepted. Symbols are resolved to accessor
+    symbol_ids once per process.
+    """
+
+    def __init__(self, settings: Settings) -> None:
+        self._exchange = settings.accessor_exchange
+        self._client = httpx.AsyncClient(
+            base_url=settings.accessor_url,
+            timeout=settings.accessor_timeout_seconds,
+        )
+        self._symbol_ids: dict[str, int] = {}
+
+    def supports(self, timeframe: Timeframe) -> bool:
+        return timeframe is Timeframe.M1
+
+    async def write_candles(
+        self,
+        symbol: str,
+        timeframe: Timeframe,
+        candles: list[Trendbar],
+    ) -> int:
+        if not self.supports(timeframe):
+            raise ValueError(f"Database accessor does not store {timeframe.value} candles")
+        payload = {
+            "symbol_id": await self._symbol_id(symbol),
+            "candles": [
+                {
+                    "timestamp": datetime.fromtimestamp(bar.t / 1000, tz=timezone.utc)
+                    .replace(tzinfo=None).isoformat(),
+                    "open": float(bar.o),
+                    "high": float(bar.h),
+                    "low": float(bar.l),
+                    "close": float(bar.c),
+                    "volume": bar.v,
+                }
+                for bar in candles
+            ],
+        }
+        response = await self._client.post("/candles", params={"mode": "copy"}, json=payload)
+        response.raise_for_status()
+        return int(response.json().get("added_candles", len(candles)))
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    async def _symbol_id(self, symbol: str) -> int:
+        symbol_id = self._symbol_ids.get(symbol)
+        if symbol_id is not None:
+            return symbol_id
+        params = {"symbols": symbol}
+        if self._exchange:
+            params["exchange"] = self._exchange
+        response = await self._client.get("/markets/lookup", params=params)
+        response.raise_for_status()
+        market = response.json()["markets"].get(symbol)
+        if market is None:
+            raise LookupError(f"Market {symbol} is not registered in the database accessor")
+        self._symbol_ids[symbol] = int(market["symbol_id"])
+        return self._symbol_ids[symbol]
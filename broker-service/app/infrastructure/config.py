@@ -4,11 +4,14 @@ from redis.asyncio import Redis
 
 from app.application.services import (
     AccountService,
+    BackfillService,
     MarketDataService,
     OrderService,
     PositionService,
 )
+from app.infrastructure.accessor_candle_sink import AccessorCandleSink
 from app.infrastructure.ctrader_client import CtraderClient
+from app.infrastructure.redis_backfill_state import RedisBackfillState
 from app.infrastructure.redis_streams_publisher import RedisStreamsPublisher
 from app.infrastructure.stream_registry import StreamRegistry
 from app.infrastructure.trendbar_stream_registry import TrendbarStreamRegistry
@@ -54,6 +57,15 @@ class ServiceContainer:
             self.stream_registry,
             self.trendbar_stream_registry,
         )
+        self.candle_sink = AccessorCandleSink(settings)
+        self.backfill_service = BackfillService(
+            self.broker_client,
+            self.candle_sink,
+            RedisBackfillState(self.redis),
+            window_bars=settings.backfill_window_bars,
+            max_concurrency=settings.backfill_max_concurrency,
+            requests_per_second=settings.backfill_requests_per_second,
+        )
 
     async def startup(self) -> None:
         await self.broker_client.connect()
@@ -63,9 +75,11 @@ class ServiceContainer:
             logger.exception("Unable to ping Redis during startup")
 
     async def shutdown(self) -> None:
+        await self.backfill_service.shutdown()
         await self.stream_registry.shutdown()
         await self.trendbar_stream_registry.shutdown()
         await self.broker_client.disconnect()
+        await self.candle_sink.close()
         await self.redis_publisher.close()
 
     @property
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import json
+from dataclasses import asdict
+
+from redis.asyncio import Redis
+
+from app.application.interfaces import BackfillStatePort
+from app.domain.value_objects import AccountId, BackfillStatus, Timeframe
+
+
+class RedisBackfillState(BackfillStatePort):
+    """Backfill progress stored as one JSON value per account, symbol and timeframe."""
+
+    def __init__(self, redis: Redis) -> None:
+        self._redis = redis
+
+    @staticmethod
+    def _key(account_id: AccountId, symbol: str, timeframe: Timeframe) -> str:
+        return f"backfill:{account_id}:{symbol}:{timeframe.value}"
+
+    async def load_status(
+        self,
+        account_id: AccountId,
+        symbol: str,
+        timeframe: Timeframe,
+    ) -> BackfillStatus | None:
+        raw = await self._redis.get(self._key(account_id, symbol, timeframe))
+        if raw is None:
+            return None
+        status = BackfillStatus(**json.loads(raw))
+        # A saved backfill is not running in this process, it was interrupted
+        status.running = False
+        return status
+
+    async def save_status(
+        self,
+        account_id: AccountId,
+        symbol: str,
+        timeframe: Timeframe,
+        status: BackfillStatus,
+    ) -> None:
+        await self._redis.set(
+            self._key(account_id, symbol, timeframe),
+            json.dumps(asdict(status)),
+        )
@@ -6,6 +6,7 @@ from fastapi import FastAPI
 
 from app.api.routers import (
     accounts,
+    backfill,
     deals,
     market_data,
     meta,
@@ -38,6 +39,7 @@ def create_app(settings: Settings | None = None) -> FastAPI:
     app.include_router(positions.router)
     app.include_router(deals.router)
     app.include_router(market_data.router)
+    app.include_router(backfill.router)
 
     return app
 
@@ -31,6 +31,12 @@ class Settings(BaseSettings):
     broker_max_trendbar_streams: int = 10
     log_level: str = "INFO"
     ctrader_request_timeout_seconds: float = 20.0
+    accessor_url: str = "http://localhost:8000"
+    accessor_exchange: str | None = None
+    accessor_timeout_seconds: float = 60.0
+    backfill_window_bars: int = 1000
+    backfill_max_concurrency: int = 4
+    backfill_requests_per_second: float = 5.0
 
     model_config = SettingsConfigDict(
         env_file=".env",
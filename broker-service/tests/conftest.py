@@ -0,0 +1,7 @@
+import os
+
+# The app package builds its settings on import, tests never reach the broker
+os.environ.setdefault("CTRADER_CLIENT_ID", "test-client-id")
+os.environ.setdefault("CTRADER_SECRET", "test-secret")
+os.environ.setdefault("CTRADER_ACCESS_TOKEN", "test-access-token")
+os.environ.setdefault("CTRADER_HOST_TYPE", "demo")
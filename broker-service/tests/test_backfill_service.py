@@ -0,0 +1,142 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+from app.application.services.backfill_service import BackfillService, plan_windows
+from app.domain.models import Trendbar
+from app.domain.value_objects import AccountId, BackfillStatus, Timeframe
+
+MINUTE = 60_000
+ACCOUNT = AccountId(1)
+
+
+def bar(t: int) -> Trendbar:
+    return Trendbar(o=Decimal(1), h=Decimal(1), l=Decimal(1), c=Decimal(1), v=1, t=t)
+
+
+class FakeMarketData:
+    """M1 broker history, answering like cTrader: bars from from_ts up to and
+    including to_ts, the newest count of them."""
+
+    def __init__(self, first: int, last: int) -> None:
+        self.history = list(range(first, last, MINUTE))
+        self.requests: list[tuple[int, int, int]] = []
+        self.gates: dict[int, asyncio.Event] = {}
+
+    async def get_trendbars(self, account_id, symbol, timeframe, from_ts, to_ts, limit):
+        self.requests.append((from_ts, to_ts, limit))
+        gate = self.gates.get(from_ts)
+        if gate is not None:
+            await gate.wait()
+        stamps = [t for t in self.history if from_ts <= t <= to_ts]
+        return [bar(t) for t in stamps[-limit:]]
+
+
+class FakeSink:
+    def __init__(self) -> None:
+        self.written: list[int] = []
+
+    def supports(self, timeframe: Timeframe) -> bool:
+        return True
+
+    async def write_candles(self, symbol, timeframe, candles) -> int:
+        self.written.extend(candle.t for candle in candles)
+        return len(candles)
+
+
+class FakeState:
+    def __init__(self, saved: BackfillStatus | None = None) -> None:
+        self.saved = saved
+        self.watermarks: list[int | None] = []
+
+    async def load_status(self, account_id, symbol, timeframe):
+        return self.saved
+
+    async def save_status(self, account_id, symbol, timeframe, status) -> None:
+        self.watermarks.append(status.watermark)
+
+
+def service(market_data, sink, state, **kwargs) -> BackfillService:
+    kwargs.setdefault("requests_per_second", 0)
+    return BackfillService(market_data, sink, state, **kwargs)
+
+
+async def finish(backfill: BackfillService) -> None:
+    await asyncio.gather(*backfill._tasks.values())
+
+
+def test_plan_windows_cover_range():
+    windows = plan_windows(Timeframe.M1, 0, 25 * MINUTE, 10)
+    assert windows == [(0, 10 * MINUTE), (10 * MINUTE, 20 * MINUTE), (20 * MINUTE, 25 * MINUTE)]
+
+
+def test_plan_windows_empty_range():
+    assert plan_windows(Timeframe.H1, 5, 5, 10) == []
+
+
+@pytest.mark.asyncio
+async def test_windows_keep_edge_bars():
+    market_data = FakeMarketData(0, 40 * MINUTE)
+    sink = FakeSink()
+    backfill = service(market_data, sink, FakeState(), window_bars=10)
+
+    status = await backfill.start_backfill(ACCOUNT, "EURUSD", Timeframe.M1, 0, 30 * MINUTE)
+    await finish(backfill)
+
+    # Every bar of the range once, neither the start nor the end of a window is lost
+    assert sorted(sink.written) == list(range(0, 30 * MINUTE, MINUTE))
+    assert status.bars_written == 30
+    assert status.watermark == 30 * MINUTE
+    assert all(to_ts == from_ts + 10 * MINUTE - 1 for from_ts, to_ts, _ in market_data.requests)
+
+
+@pytest.mark.asyncio
+async def test_watermark_waits_for_earlier_windows():
+    market_data = FakeMarketData(0, 30 * MINUTE)
+    first, second = asyncio.Event(), asyncio.Event()
+    market_data.gates = {0: first, 10 * MINUTE: second}
+    state = FakeState()
+    backfill = service(market_data, FakeSink(), state, window_bars=10, max_concurrency=2)
+
+    status = await backfill.start_backfill(ACCOUNT, "EURUSD", Timeframe.M1, 0, 20 * MINUTE)
+    second.set()
+    while status.windows_done < 1:
+        await asyncio.sleep(0)
+    # The second window is written but the first is not, the watermark stays
+    assert status.watermark == 0
+
+    first.set()
+    await finish(backfill)
+    assert status.watermark == 20 * MINUTE
+    assert 10 * MINUTE not in state.watermarks
+
+
+@pytest.mark.asyncio
+async def test_resume_from_saved_watermark():
+    market_data = FakeMarketData(0, 40 * MINUTE)
+    sink = FakeSink()
+    saved = BackfillStatus(running=False, from_ts=0, to_ts=30 * MINUTE, watermark=20 * MINUTE)
+    backfill = service(market_data, sink, FakeState(saved), window_bars=10)
+
+    status = await backfill.start_backfill(
+        ACCOUNT, "EURUSD", Timeframe.M1, 5 * MINUTE, 30 * MINUTE)
+    await finish(backfill)
+
+    assert status.from_ts == 0
+    assert [request[0] for request in market_data.requests] == [20 * MINUTE]
+    assert sorted(sink.written) == list(range(20 * MINUTE, 30 * MINUTE, MINUTE))
+
+
+@pytest.mark.asyncio
+async def test_no_resume_outside_saved_range():
+    market_data = FakeMarketData(0, 40 * MINUTE)
+    saved = BackfillStatus(running=False, from_ts=0, to_ts=30 * MINUTE, watermark=20 * MINUTE)
+    backfill = service(market_data, FakeSink(), FakeState(saved), window_bars=10)
+
+    status = await backfill.start_backfill(
+        ACCOUNT, "EURUSD", Timeframe.M1, 25 * MINUTE, 30 * MINUTE, resume=True)
+    await finish(backfill)
+
+    assert status.from_ts == 25 * MINUTE
+    assert [request[0] for request in market_data.requests] == [25 * MINUTE]
@@ -0,0 +1,174 @@
+# app/aggregates.py
+"""
+Continuous aggregates of candles for standard timeframes.
+
+Every configured timeframe gets a real-time continuous aggregate
+(``materialized_only = false``): TimescaleDB serves the materialized buckets
+and aggregates raw rows only for the tail that the refresh policy has not
+materialized yet. Candle queries are routed to the coarsest aggregate whose
+bucket evenly divides the requested timeframe.
+"""
+import logging
+from dataclasses import dataclass
+
+from sqlalchemy import text
+
+from app import settings
+from app.database import engine
+from app.timeframes import Timeframe
+from app.timescale import CANDLES_TABLE, is_hypertable, sync_interval_policy
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CandleSource:
+    relation: str
+    minutes: int
+
+
+RAW_SOURCE = CandleSource(CANDLES_TABLE, 1)
+
+# Aggregates that exist in the database, keyed by bucket size in minutes
+_available: dict[int, CandleSource] = {}
+
+
+def timeframe_label(minutes: int) -> str:
+    """
+    Format a timeframe in minutes like the broker does, e.g. M15, H4, D1
+
+    :param minutes: Timeframe in minutes
+
+    :rtype: str
+    """
+    if minutes % 1440 == 0:
+        return f"D{minutes // 1440}"
+    if minutes % 60 == 0:
+        return f"H{minutes // 60}"
+    return f"M{minutes}"
+
+
+def view_name(minutes: int) -> str:
+    return f"{CANDLES_TABLE}_{timeframe_label(minutes).lower()}"
+
+
+def _schedule_interval(minutes: int) -> str:
+    return f"{min(minutes, 60)} minutes"
+
+
+async def setup_continuous_aggregates() -> list[str]:
+    """
+    Create the configured continuous aggregates and their refresh policies
+
+    The refresh policies have no start offset so that historical backfills
+    are materialized as well; only invalidated ranges are recomputed. With a
+    raw CANDLES_RETENTION the refresh window starts at the retention age
+    instead, so buckets whose raw candles were dropped are kept.
+
+    :return: Names of the configured aggregates
+    :rtype: list[str]
+    """
+    created = []
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        if not await is_hypertable(conn):
+            log.warning("candles is not a hypertable, skipping continuous aggregates")
+            return created
+
+        for minutes in sorted(set(settings.CANDLES_AGGREGATE_TIMEFRAMES)):
+            if minutes <= 1:
+                continue
+            view = view_name(minutes)
+            bucket = f"INTERVAL '{minutes} minutes'"
+            await conn.execute(text(f"""
+                CREATE MATERIALIZED VIEW IF NOT EXISTS {view}
+                WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+                SELECT
+                    symbol_id,
+                    time_bucket({bucket}, timestamp) AS timestamp,
+                    first(open, timestamp) AS open,
+                    max(high) AS high,
+                    min(low) AS low,
+                    last(close, timestamp) AS close,
+                    sum(volume) AS volume
+                FROM {CANDLES_TABLE}
+                GROUP BY symbol_id, time_bucket({bucket}, timestamp)
+                WITH NO DATA
+            """))
+            await conn.execute(text(
+                f"ALTER MATERIALIZED VIEW {view} SET (timescaledb.materialized_only = false)"))
+
+            result = await conn.execute(text("""
+                SELECT materialization_hypertable_name
+                FROM timescaledb_information.continuous_aggregates
+                WHERE view_name = :view
+            """), {"view": view})
+            await sync_interval_policy(
+                conn, "policy_refresh_continuous_aggregate", result.scalar_one(),
+                {
+                    "start_offset": settings.CANDLES_RETENTION or None,
+                    "end_offset": f"{minutes} minutes",
+                },
+                add_sql=f"""
+                    SELECT add_continuous_aggregate_policy(
+                        '{view}',
+                        start_offset => CAST(:start_offset AS TEXT)::interval,
+                        end_offset => CAST(:end_offset AS TEXT)::interval,
+                        schedule_interval => INTERVAL '{_schedule_interval(minutes)}'
+                    )
+                """,
+                remove_sql=(
+                    f"SELECT remove_continuous_aggregate_policy('{view}', if_exists => true)"
+                ),
+            )
+            created.append(view)
+
+    return created
+
+
+async def load_available_aggregates() -> dict[int, CandleSource]:
+    """
+    Load the configured continuous aggregates that exist in the database
+
+    :return: Available aggregates keyed by bucket size in minutes
+    :rtype: dict[int, CandleSource]
+    """
+    configured = {view_name(m): m for m in settings.CANDLES_AGGREGATE_TIMEFRAMES if m > 1}
+    async with engine.connect() as conn:
+        result = await conn.execute(text("""
+            SELECT view_name FROM timescaledb_information.continuous_aggregates
+            WHERE hypertable_name = :table
+        """), {"table": CANDLES_TABLE})
+        existing = set(result.scalars().all())
+
+    _available.clear()
+    _available.update({
+        minutes: CandleSource(view, minutes)
+        for view, minutes in configured.items() if view in existing
+    })
+    log.info("Continuous aggregates available: %s", sorted(_available))
+    return _available
+
+
+def available_sources() -> list[CandleSource]:
+    """Continuous aggregates loaded by load_available_aggregates, finest first."""
+    return [_available[minutes] for minutes in sorted(_available)]
+
+
+def select_source(timeframe: Timeframe, offset: int = 0) -> CandleSource:
+    """
+    Pick the coarsest continuous aggregate that evenly divides the timeframe
+
+    :param timeframe: Requested timeframe
+    :param offset: Session offset in minutes, must be a multiple of the aggregate bucket
+
+    :return: The aggregate to read from, or the raw candles table
+    :rtype: CandleSource
+    """
+    candidates = [
+        minutes for minutes in _available
+        if timeframe.divides(minutes) and offset % minutes == 0
+    ]
+    if not candidates:
+        return RAW_SOURCE
+    return _available[max(candidates)]
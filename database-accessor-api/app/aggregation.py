@@ -0,0 +1,353 @@
+# app/aggregation.py
+"""
+Single pass candle aggregation on time_bucket / first / last.
+
+Buckets are anchored like TimescaleDB's time_bucket: fixed width buckets and
+weeks start at Monday 2000-01-03 00:00, months at the first of the month.
+An optional session offset shifts every bucket boundary.
+
+Volumes are summed as float8: with the compact integer layout (see
+app/compact.py) a sum over bigint volumes would come back as numeric.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import text
+
+from app.aggregates import CandleSource
+from app.timeframes import Timeframe
+
+# Origin of fixed width buckets (a Monday, so weeks start on Mondays)
+BUCKET_ORIGIN = datetime(2000, 1, 3)
+
+
+def bucket_expression(timeframe: Timeframe, offset: int = 0, column: str = "timestamp") -> str:
+    """
+    Build the time_bucket expression for a timeframe
+
+    :param timeframe: Bucket width
+    :param offset: Session offset in minutes
+    :param column: Timestamp column to bucket
+
+    :rtype: str
+    """
+    if offset:
+        return (
+            f"time_bucket(INTERVAL '{timeframe.interval}', {column}, "
+            f"\"offset\" => INTERVAL '{int(offset)} minutes')"
+        )
+    return f"time_bucket(INTERVAL '{timeframe.interval}', {column})"
+
+
+def bucket_start(timeframe: Timeframe, timestamp: datetime, offset: int = 0) -> datetime:
+    """
+    Start of the bucket containing a timestamp, like time_bucket in SQL
+
+    :param timeframe: Bucket width
+    :param timestamp: Naive UTC timestamp
+    :param offset: Session offset in minutes
+
+    :rtype: datetime
+    """
+    shifted = timestamp - timedelta(minutes=offset)
+    if timeframe.minutes is None:
+        months = (shifted.year - 2000) * 12 + shifted.month - 1
+        months -= months % timeframe.amount
+        start = datetime(2000 + months // 12, months % 12 + 1, 1)
+    else:
+        width = timedelta(minutes=timeframe.minutes)
+        start = shifted - (shifted - BUCKET_ORIGIN) % width
+    return start + timedelta(minutes=offset)
+
+
+def next_bucket(timeframe: Timeframe, start: datetime, offset: int = 0) -> datetime:
+    """Start of the bucket following the bucket starting at start."""
+    if timeframe.minutes is None:
+        shifted = start - timedelta(minutes=offset)
+        months = (shifted.year - 2000) * 12 + shifted.month - 1 + timeframe.amount
+        return datetime(2000 + months // 12, months % 12 + 1, 1) + timedelta(minutes=offset)
+    return start + timedelta(minutes=timeframe.minutes)
+
+
+def epoch_ms_expression(expression: str) -> str:
+    return f"(EXTRACT(EPOCH FROM {expression}) * 1000)::bigint"
+
+
+def time_conditions(start_date: Optional[datetime], end_date: Optional[datetime]) -> str:
+    """
+    Build the optional time range conditions, using :start_date and :end_date
+
+    Only the bounds that are given end up in the statement so that chunk
+    exclusion also works with generic plans.
+
+    :rtype: str
+    """
+    conditions = ""
+    if start_date is not None:
+        conditions += " AND timestamp >= :start_date"
+    if end_date is not None:
+        conditions += " AND timestamp < :end_date"
+    return conditions
+
+
+def candles_query(
+    timeframe: Timeframe,
+    source: CandleSource,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    epoch_ms: bool = False,
+):
+    """
+    Build the aggregation query for one symbol
+
+    Binds :symbol_id, and :start_date, :end_date and :limit when given. Rows are
+    ordered by timestamp, newest first when a limit is given.
+
+    :param timeframe: Requested timeframe
+    :param source: Relation to aggregate, raw candles or a continuous aggregate
+    :param start_date: Inclusive lower bound (optional)
+    :param end_date: Exclusive upper bound (optional)
+    :param limit: Maximum number of buckets (optional)
+    :param offset: Session offset in minutes
+    :param epoch_ms: Return timestamps as epoch milliseconds instead of timestamps
+
+    :return: SQLAlchemy text clause
+    """
+    bucket = bucket_expression(timeframe, offset)
+    if epoch_ms:
+        bucket = epoch_ms_expression(bucket)
+    return text(f"""
+        SELECT
+            {bucket} AS timestamp,
+            first(open, timestamp) AS open,
+            max(high) AS high,
+            min(low) AS low,
+            last(close, timestamp) AS close,
+            sum(volume)::float8 AS volume
+        FROM {source.relation}
+        WHERE symbol_id = :symbol_id{time_conditions(start_date, end_date)}
+        GROUP BY 1
+        ORDER BY 1 {"DESC" if limit else "ASC"}
+        {"LIMIT :limit" if limit else ""}
+    """)
+
+
+def tail_query(
+    timeframe: Timeframe,
+    source: CandleSource,
+    end_date: Optional[datetime] = None,
+    offset: int = 0,
+    epoch_ms: bool = False,
+):
+    """
+    Build the query for the newest :limit buckets of one symbol
+
+    Like candles_query with a limit and no start date, but the scanned range
+    starts at the source row :scan_rows rows before the newest, found with a
+    backward index scan and widened to a whole bucket, so only the rows of
+    the returned buckets are aggregated. Binds :symbol_id, :scan_rows, :limit
+    and :end_date when given. Rows are ordered newest first.
+
+    :param timeframe: Requested timeframe
+    :param source: Relation to aggregate, raw candles or a continuous aggregate
+    :param end_date: Exclusive upper bound (optional)
+    :param offset: Session offset in minutes
+    :param epoch_ms: Return timestamps as epoch milliseconds instead of timestamps
+
+    :return: SQLAlchemy text clause
+    """
+    bucket = bucket_expression(timeframe, offset)
+    output = epoch_ms_expression(bucket) if epoch_ms else bucket
+    conditions = time_conditions(None, end_date)
+    return text(f"""
+        WITH edge AS (
+            SELECT timestamp
+            FROM {source.relation}
+            WHERE symbol_id = :symbol_id{conditions}
+            ORDER BY timestamp DESC
+            OFFSET :scan_rows
+            LIMIT 1
+        )
+        SELECT
+            {output} AS timestamp,
+            first(open, timestamp) AS open,
+            max(high) AS high,
+            min(low) AS low,
+            last(close, timestamp) AS close,
+            sum(volume)::float8 AS volume
+        FROM {source.relation}
+        WHERE symbol_id = :symbol_id{conditions}
+            AND timestamp >= COALESCE((SELECT {bucket} FROM edge), '-infinity')
+        GROUP BY 1
+        ORDER BY 1 DESC
+        LIMIT :limit
+    """)
+
+
+def tail_scan_rows(timeframe: Timeframe, source: CandleSource, limit: int) -> int:
+    """
+    Source rows to step back from the newest for limit buckets of a tail query
+
+    A bucket holds at most max_minutes // source.minutes rows, so that many
+    rows per bucket always span at least limit buckets, gaps included.
+
+    :rtype: int
+    """
+    return max(limit, 1) * (timeframe.max_minutes // source.minutes)
+
+
+def oldest_first(query):
+    """
+    Wrap a candles query so its rows come back in ascending time order
+
+    Queries with a limit select the newest buckets first; wrapping them lets
+    a cursor stream the result without reversing it in memory.
+
+    :return: SQLAlchemy text clause
+    """
+    return text(f"SELECT * FROM ({query.text}) AS latest ORDER BY timestamp ASC")
+
+
+def page_query(timeframe: Timeframe, source: CandleSource, direction: str,
+               after_bucket: bool, offset: int = 0):
+    """
+    Build the keyset page query for one symbol
+
+    The scanned range is bounded by the source row :scan_rows rows away from
+    the page boundary, found with an index scan, and widened to whole
+    buckets. A page therefore reads O(page size) rows whatever the history
+    depth. Binds :symbol_id, :scan_rows, :limit and :boundary when after_bucket
+    is set.
+
+    :param timeframe: Requested timeframe
+    :param source: Relation to aggregate, raw candles or a continuous aggregate
+    :param direction: "backward" for buckets before :boundary, newest first,
+        or "forward" for buckets after the bucket at :boundary, oldest first
+    :param after_bucket: Whether the page is bounded by :boundary
+    :param offset: Session offset in minutes
+
+    :return: SQLAlchemy text clause
+    """
+    bucket = bucket_expression(timeframe, offset)
+    if direction == "backward":
+        boundary = " AND timestamp < :boundary" if after_bucket else ""
+        order = "DESC"
+        edge = f"timestamp >= COALESCE((SELECT {bucket} FROM edge), '-infinity')"
+    else:
+        boundary = (
+            f" AND timestamp >= CAST(:boundary AS TIMESTAMP) + INTERVAL '{timeframe.interval}'"
+            if after_bucket else ""
+        )
+        order = "ASC"
+        edge = f"timestamp < COALESCE((SELECT {bucket} FROM edge), 'infinity')"
+
+    return text(f"""
+        WITH edge AS (
+            SELECT timestamp
+            FROM {source.relation}
+            WHERE symbol_id = :symbol_id{boundary}
+            ORDER BY timestamp {order}
+            OFFSET :scan_rows
+            LIMIT 1
+        )
+        SELECT
+            {bucket} AS timestamp,
+            first(open, timestamp) AS open,
+            max(high) AS high,
+            min(low) AS low,
+            last(close, timestamp) AS close,
+            sum(volume)::float8 AS volume
+        FROM {source.relation}
+        WHERE symbol_id = :symbol_id{boundary}
+            AND {edge}
+        GROUP BY 1
+        ORDER BY 1 {order}
+        LIMIT :limit
+    """)
+
+
+def aligned_candles_query(timeframe: Timeframe, source: CandleSource, join: str,
+                          start_date: Optional[datetime] = None,
+                          end_date: Optional[datetime] = None,
+                          limit: Optional[int] = None, offset: int = 0):
+    """
+    Build the aggregation query for several symbols on a shared timestamp axis
+
+    Binds :symbol_ids (in output order), :symbol_count, and :start_date,
+    :end_date and :limit when given. Every symbol gets one row per axis
+    timestamp, ordered by symbol position and then timestamp:
+
+    - inner: only timestamps where every symbol has a candle
+    - outer: timestamps where any symbol has a candle, missing candles are NULL
+    - ffill: like outer, missing candles repeat the previous close with zero volume
+
+    :param timeframe: Requested timeframe
+    :param source: Relation to aggregate, raw candles or a continuous aggregate
+    :param join: One of inner, outer, ffill
+    :param start_date: Inclusive lower bound (optional)
+    :param end_date: Exclusive upper bound (optional)
+    :param limit: Keep only the latest timestamps of the axis (optional)
+    :param offset: Session offset in minutes
+
+    :return: SQLAlchemy text clause
+    """
+    having = "HAVING count(*) = :symbol_count" if join == "inner" else ""
+    limit_clause = "ORDER BY timestamp DESC LIMIT :limit" if limit else ""
+    if join == "ffill":
+        columns = """
+            COALESCE(open, fill_close) AS open,
+            COALESCE(high, fill_close) AS high,
+            COALESCE(low, fill_close) AS low,
+            COALESCE(close, fill_close) AS close,
+            COALESCE(volume, 0) AS volume"""
+    else:
+        columns = "open, high, low, close, volume"
+
+    return text(f"""
+        WITH bars AS (
+            SELECT
+                symbol_id,
+                {bucket_expression(timeframe, offset)} AS timestamp,
+                first(open, timestamp) AS open,
+                max(high) AS high,
+                min(low) AS low,
+                last(close, timestamp) AS close,
+                sum(volume)::float8 AS volume
+            FROM {source.relation}
+            WHERE symbol_id = ANY(:symbol_ids){time_conditions(start_date, end_date)}
+            GROUP BY 1, 2
+        ),
+        axis AS (
+            SELECT timestamp FROM bars
+            GROUP BY timestamp
+            {having}
+            {limit_clause}
+        ),
+        grid AS (
+            SELECT
+                s.position,
+                s.symbol_id,
+                a.timestamp,
+                b.open, b.high, b.low, b.close, b.volume,
+                count(b.close) OVER (
+                    PARTITION BY s.position ORDER BY a.timestamp
+                ) AS fill_group
+            FROM axis a
+            CROSS JOIN unnest(CAST(:symbol_ids AS INTEGER[]))
+                WITH ORDINALITY AS s(symbol_id, position)
+            LEFT JOIN bars b ON b.symbol_id = s.symbol_id AND b.timestamp = a.timestamp
+        ),
+        filled AS (
+            SELECT
+                *,
+                first_value(close) OVER (
+                    PARTITION BY position, fill_group ORDER BY timestamp
+                ) AS fill_close
+            FROM grid
+        )
+        SELECT symbol_id, timestamp, {columns}
+        FROM filled
+        ORDER BY position, timestamp
+    """)
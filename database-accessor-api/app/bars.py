@@ -0,0 +1,317 @@
+# app/bars.py
+"""
+Non-time bars built server-side in one pass over the stored data.
+
+- ``volume``: source candles are merged until their volume reaches size
+- ``range``: source candles are merged until the bar's high - low reaches size
+- ``renko``: bricks of size on the close of the source candles, a reversal
+  needs a move of two bricks
+- ``heikin_ashi``: Heikin-Ashi candles of the source candles
+- ``tick``: every size ticks of the ticks table (see app/ticks.py) on the bid,
+  the ask or the mid price, with the number of ticks as volume
+
+Source candles are the aggregated candles of the requested timeframe (M1 by
+default), streamed from a server-side cursor like GET /candles?stream=true, so
+only the bars are held in memory. Bars are timestamped at their first source
+row and carry the timestamp of their last one as ``end``. The last volume,
+range or tick bar is usually still open and is flagged with ``partial``.
+
+Bar boundaries depend on where the series starts, so the bars of the whole
+requested range are built even when only the newest few are returned: a
+request without start_date reads the full history of the timeframe, bound it
+with start_date. Results are cached per (symbol, bar spec, range) in an
+in-process LRU of at most BARS_CACHE_SIZE entries and BARS_CACHE_MAX_BARS bars
+in total, and reused while the symbol's data version is unchanged. Results
+larger than BARS_CACHE_MAX_BARS are not cached. Tick bars are not cached as
+ticks are not versioned.
+"""
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app import crud, settings, versions
+from app.cache import EPOCH
+from app.ticks import PRICE_SCALE, stream_tick_rows
+from app.timeframes import Timeframe, parse_timeframe
+
+log = logging.getLogger(__name__)
+
+BAR_TYPES = ("volume", "range", "renko", "heikin_ashi", "tick")
+TICK_PRICES = ("bid", "ask", "mid")
+
+
+@dataclass(frozen=True)
+class BarSpec:
+    type: str
+    size: Optional[float]
+    timeframe: Timeframe
+    price: str = "bid"
+
+    @property
+    def key(self) -> tuple:
+        return self.type, self.size, self.timeframe.label, self.price
+
+
+def parse_bar_spec(bar_type: str, size: Optional[float] = None, timeframe: str = "M1",
+                   price: str = "bid") -> BarSpec:
+    """
+    Validate a bar specification
+
+    :param bar_type: One of BAR_TYPES
+    :param size: Volume, price range, brick size or number of ticks per bar,
+        not used by heikin_ashi
+    :param timeframe: Timeframe of the source candles
+    :param price: Price of tick bars: bid, ask or mid
+
+    :rtype: BarSpec
+
+    :raises ValueError: If the type, size, timeframe or price is invalid
+    """
+    if bar_type not in BAR_TYPES:
+        raise ValueError(f"Unknown bar type: {bar_type}, expected one of {', '.join(BAR_TYPES)}")
+    if bar_type == "heikin_ashi":
+        size = None
+    elif size is None or size <= 0:
+        raise ValueError(f"{bar_type} bars need a positive size")
+    elif bar_type == "tick" and size != int(size):
+        raise ValueError("Tick bars need a whole number of ticks")
+    if price not in TICK_PRICES:
+        raise ValueError(f"Unknown price: {price}")
+    return BarSpec(bar_type, size, parse_timeframe(timeframe),
+                   price if bar_type == "tick" else "bid")
+
+
+class BarBuilder(ABC):
+    """Turns source rows into bars."""
+
+    def __init__(self, size: Optional[float]):
+        self.size = size
+        self.bars: list[dict] = []
+
+    @abstractmethod
+    def add(self, timestamp: datetime, open_: float, high: float, low: float, close: float,
+            volume: float): ...
+
+    def finish(self) -> bool:
+        """End the series, return whether an open bar was appended."""
+        return False
+
+
+class MergedBars(BarBuilder):
+    """Merges source rows into bars, subclasses decide where a bar ends."""
+
+    def __init__(self, size: Optional[float]):
+        super().__init__(size)
+        self._bar: Optional[dict] = None
+
+    def add(self, timestamp: datetime, open_: float, high: float, low: float, close: float,
+            volume: float):
+        bar = self._bar
+        if bar is None:
+            self._bar = {"timestamp": timestamp, "open": open_, "high": high, "low": low,
+                         "close": close, "volume": volume, "end": timestamp}
+        else:
+            bar["high"] = max(bar["high"], high)
+            bar["low"] = min(bar["low"], low)
+            bar["close"] = close
+            bar["volume"] += volume
+            bar["end"] = timestamp
+        if self.complete(self._bar):
+            self.bars.append(self._bar)
+            self._bar = None
+
+    @abstractmethod
+    def complete(self, bar: dict) -> bool: ...
+
+    def finish(self) -> bool:
+        if self._bar is None:
+            return False
+        self.bars.append(self._bar)
+        self._bar = None
+        return True
+
+
+class VolumeBars(MergedBars):
+    def complete(self, bar: dict) -> bool:
+        return bar["volume"] >= self.size
+
+
+class RangeBars(MergedBars):
+    def complete(self, bar: dict) -> bool:
+        return bar["high"] - bar["low"] >= self.size
+
+
+class TickBars(MergedBars):
+    # Ticks are added with a volume of 1, so volume counts the ticks
+    def complete(self, bar: dict) -> bool:
+        return bar["volume"] >= self.size
+
+
+class RenkoBars(BarBuilder):
+    def __init__(self, size: float):
+        super().__init__(size)
+        # Brick edges are the first close plus a whole number of bricks, kept
+        # as numbers of bricks so repeated additions do not drift
+        self._anchor: Optional[float] = None
+        self._low = self._high = 0
+        self._volume = 0.0
+        self._start: Optional[datetime] = None
+
+    def add(self, timestamp: datetime, open_: float, high: float, low: float, close: float,
+            volume: float):
+        if self._anchor is None:
+            self._anchor = close
+        if self._start is None:
+            self._start = timestamp
+        self._volume += volume
+        while close >= self._price(self._high + 1):
+            self._brick(self._high, self._high + 1, timestamp)
+        while close <= self._price(self._low - 1):
+            self._brick(self._low, self._low - 1, timestamp)
+
+    def _price(self, bricks: int) -> float:
+        return round(self._anchor + bricks * self.size, 10)
+
+    def _brick(self, open_: int, close: int, timestamp: datetime):
+        # The volume traded since the last brick goes to the first brick formed
+        self.bars.append({
+            "timestamp": self._start, "open": self._price(open_),
+            "high": self._price(max(open_, close)), "low": self._price(min(open_, close)),
+            "close": self._price(close), "volume": self._volume, "end": timestamp,
+        })
+        self._low, self._high = min(open_, close), max(open_, close)
+        self._volume = 0.0
+        self._start = timestamp
+
+
+class HeikinAshiBars(BarBuilder):
+    def add(self, timestamp: datetime, open_: float, high: float, low: float, close: float,
+            volume: float):
+        ha_close = (open_ + high + low + close) / 4
+        if self.bars:
+            previous = self.bars[-1]
+            ha_open = (previous["open"] + previous["close"]) / 2
+        else:
+            ha_open = (open_ + close) / 2
+        self.bars.append({
+            "timestamp": timestamp, "open": ha_open, "high": max(high, ha_open, ha_close),
+            "low": min(low, ha_open, ha_close), "close": ha_close, "volume": volume,
+            "end": timestamp,
+        })
+
+
+BUILDERS = {
+    "volume": VolumeBars,
+    "range": RangeBars,
+    "renko": RenkoBars,
+    "heikin_ashi": HeikinAshiBars,
+    "tick": TickBars,
+}
+
+
+async def build_bars(
+    session, symbol_id: int, spec: BarSpec, start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None
+) -> dict:
+    """
+    Build bars in one pass over the source candles or ticks
+
+    :param session: SQLAlchemy session
+    :param symbol_id: Market symbol_id
+    :param spec: Bar specification
+    :param start_date: Inclusive start of the source range (optional)
+    :param end_date: Exclusive end of the source range (optional)
+
+    :return: Bars oldest first, the number of source rows and whether the last bar is open
+    :rtype: dict
+    """
+    builder = BUILDERS[spec.type](spec.size)
+    rows = 0
+    if spec.type == "tick":
+        async for batch in stream_tick_rows(
+                session, symbol_id, start_date, end_date, settings.CANDLES_STREAM_BATCH_ROWS):
+            for ts, bid, ask in batch:
+                price = (bid if spec.price == "bid" else ask if spec.price == "ask"
+                         else (bid + ask) / 2) / PRICE_SCALE
+                builder.add(EPOCH + timedelta(milliseconds=ts), price, price, price, price, 1)
+            rows += len(batch)
+    else:
+        batches = crud.stream_candle_rows(
+            session, symbol_id, spec.timeframe,
+            start_date.isoformat() if start_date else None,
+            end_date.isoformat() if end_date else None,
+            batch_rows=settings.CANDLES_STREAM_BATCH_ROWS)
+        async for batch in batches:
+            for row in batch:
+                builder.add(*row)
+            rows += len(batch)
+    partial = builder.finish()
+    return {"bars": builder.bars, "source_rows": rows, "partial": partial}
+
+
+class BarCache:
+    def __init__(self, max_entries: int, max_bars: int):
+        self.max_entries = max_entries
+        self.max_bars = max_bars
+        self.bars = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.oversized = 0
+        self._entries: OrderedDict[tuple, tuple[int, dict]] = OrderedDict()
+
+    async def get_bars(
+        self, session, symbol_id: int, spec: BarSpec, start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None, version: Optional[int] = None
+    ) -> dict:
+        """
+        Bars of build_bars, from the cache while the data version is unchanged
+
+        :param version: Data version of the symbol, read when omitted
+        """
+        if spec.type == "tick" or self.max_entries <= 0:
+            return await build_bars(session, symbol_id, spec, start_date, end_date)
+        if version is None:
+            current = await versions.get_version(session, symbol_id)
+            version = current[0] if current else None
+
+        key = (symbol_id, spec.key, start_date, end_date)
+        cached = self._entries.get(key)
+        if cached is not None and version is not None and cached[0] == version:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        result = await build_bars(session, symbol_id, spec, start_date, end_date)
+        if version is not None:
+            self._put(key, version, result)
+        return result
+
+    def _put(self, key: tuple, version: int, result: dict):
+        self._discard(key)
+        if len(result["bars"]) > self.max_bars:
+            self.oversized += 1
+            return
+        self._entries[key] = (version, result)
+        self.bars += len(result["bars"])
+        while len(self._entries) > self.max_entries or self.bars > self.max_bars:
+            self._discard(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _discard(self, key: tuple):
+        cached = self._entries.pop(key, None)
+        if cached is not None:
+            self.bars -= len(cached[1]["bars"])
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "max_entries": self.max_entries,
+                "bars": self.bars, "max_bars": self.max_bars, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions,
+                "oversized": self.oversized}
+
+
+bar_cache = BarCache(settings.BARS_CACHE_SIZE, settings.BARS_CACHE_MAX_BARS)
@@ -0,0 +1,355 @@
+# app/cache.py
+"""
+Cache of aggregated candle blocks.
+
+Aggregated candles are cached in blocks of CANDLE_CACHE_BLOCK_BUCKETS buckets
+per (symbol_id, timeframe, session offset). Blocks are aligned to the
+time_bucket origin so every block holds whole buckets, and only closed blocks
+(ending before now) are stored. Writes invalidate the blocks overlapping the
+written time range of the symbol.
+
+Rows are stored as tuples of epoch millisecond timestamp, open, high, low,
+close and volume. The backend is an in-process LRU bounded by the number of
+cached rows, or Redis (CANDLE_CACHE_BACKEND=redis) shared by all workers.
+
+A load racing a write could store blocks read before the write's commit
+after its invalidation. The backend therefore keeps a generation per symbol,
+bumped on every invalidation, and a loaded block is only stored while the
+generation is the one read before the load. With Redis the generation is a
+counter in Redis compared in the same script that stores the block, so
+invalidations of every worker count.
+"""
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from app import settings
+from app.aggregation import BUCKET_ORIGIN
+from app.timeframes import Timeframe
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - optional dependency
+    aioredis = None
+
+log = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+
+Loader = Callable[[datetime, datetime], Awaitable[list]]
+
+
+def to_epoch_ms(timestamp: datetime) -> int:
+    return (timestamp - EPOCH) // timedelta(milliseconds=1)
+
+
+def from_epoch_ms(value: int) -> datetime:
+    return EPOCH + timedelta(milliseconds=value)
+
+
+class MemoryBackend:
+    name = "memory"
+
+    def __init__(self, max_rows: int):
+        self.max_rows = max_rows
+        self.rows = 0
+        self.evictions = 0
+        self._blocks: OrderedDict[tuple, tuple] = OrderedDict()
+        self._by_symbol: dict[int, set[tuple]] = {}
+        self._generations: dict[int, int] = {}
+
+    async def get(self, key: tuple) -> Optional[tuple]:
+        rows = self._blocks.get(key)
+        if rows is not None:
+            self._blocks.move_to_end(key)
+        return rows
+
+    async def generation(self, symbol_id: int) -> int:
+        return self._generations.get(symbol_id, 0)
+
+    async def put(self, key: tuple, rows: tuple, generation: int):
+        if len(rows) > self.max_rows or self._generations.get(key[0], 0) != generation:
+            return
+        self._discard(key)
+        self._blocks[key] = rows
+        self._by_symbol.setdefault(key[0], set()).add(key)
+        self.rows += len(rows)
+        while self.rows > self.max_rows:
+            self._discard(next(iter(self._blocks)))
+            self.evictions += 1
+
+    async def invalidate(self, symbol_id: int,
+                         start_ms: Optional[int], end_ms: Optional[int]) -> int:
+        self._generations[symbol_id] = self._generations.get(symbol_id, 0) + 1
+        # Keys end with the block's start and end in epoch milliseconds
+        keys = [
+            key for key in self._by_symbol.get(symbol_id, ())
+            if _overlaps(key[-2], key[-1], start_ms, end_ms)
+        ]
+        for key in keys:
+            self._discard(key)
+        return len(keys)
+
+    def _discard(self, key: tuple):
+        rows = self._blocks.pop(key, None)
+        if rows is None:
+            return
+        self.rows -= len(rows)
+        keys = self._by_symbol[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._by_symbol[key[0]]
+
+    def stats(self) -> dict:
+        return {"blocks": len(self._blocks), "rows": self.rows, "max_rows": self.max_rows,
+                "evictions": self.evictions}
+
+
+class RedisBackend:
+    """
+    Blocks stored as JSON under candle-cache:{symbol_id}:{timeframe}:{offset}:{start}:{end}
+
+    A set per symbol indexes its blocks for invalidation, and a counter per
+    symbol holds its generation. Eviction is left to the key TTL and the
+    server's maxmemory-policy.
+    """
+    name = "redis"
+    prefix = "candle-cache"
+    # Store a block and index it, unless the generation changed since the load
+    PUT_SCRIPT = """
+        if (redis.call('GET', KEYS[1]) or '0') ~= ARGV[1] then
+            return 0
+        end
+        redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+        redis.call('SADD', KEYS[3], KEYS[2])
+        redis.call('EXPIRE', KEYS[3], ARGV[3])
+        return 1
+    """
+
+    def __init__(self, url: str, ttl: int):
+        self.ttl = ttl
+        self._redis = aioredis.from_url(url)
+        self._put = self._redis.register_script(self.PUT_SCRIPT)
+
+    def _key(self, key: tuple) -> str:
+        return f"{self.prefix}:{':'.join(str(part) for part in key)}"
+
+    def _index(self, symbol_id: int) -> str:
+        return f"{self.prefix}:index:{symbol_id}"
+
+    def _generation(self, symbol_id: int) -> str:
+        return f"{self.prefix}:generation:{symbol_id}"
+
+    async def get(self, key: tuple) -> Optional[tuple]:
+        value = await self._redis.get(self._key(key))
+        if value is None:
+            return None
+        return tuple(tuple(row) for row in json.loads(value))
+
+    async def generation(self, symbol_id: int) -> int:
+        return int(await self._redis.get(self._generation(symbol_id)) or 0)
+
+    async def put(self, key: tuple, rows: tuple, generation: int):
+        await self._put(
+            keys=[self._generation(key[0]), self._key(key), self._index(key[0])],
+            args=[generation, json.dumps(rows), self.ttl])
+
+    async def invalidate(self, symbol_id: int,
+                         start_ms: Optional[int], end_ms: Optional[int]) -> int:
+        # Bumped before the blocks are deleted, loads that started earlier
+        # are not stored anymore
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.incr(self._generation(symbol_id))
+            pipe.expire(self._generation(symbol_id), self.ttl)
+            await pipe.execute()
+        index = self._index(symbol_id)
+        names = [name.decode() for name in await self._redis.smembers(index)]
+        stale = []
+        for name in names:
+            block_start, block_end = (int(part) for part in name.rsplit(":", 2)[1:])
+            if _overlaps(block_start, block_end, start_ms, end_ms):
+                stale.append(name)
+        if stale:
+            await self._redis.delete(*stale)
+            await self._redis.srem(index, *stale)
+        return len(stale)
+
+    def stats(self) -> dict:
+        return {"ttl": self.ttl}
+
+
+def _overlaps(block_start: int, block_end: int,
+              start_ms: Optional[int], end_ms: Optional[int]) -> bool:
+    if start_ms is not None and block_end <= start_ms:
+        return False
+    if end_ms is not None and block_start > end_ms:
+        return False
+    return True
+
+
+class CandleCache:
+    def __init__(self, backend=None, block_buckets: int = 1000):
+        self.backend = backend
+        self.block_buckets = block_buckets
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.invalidated = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def cacheable(self, timeframe: Timeframe, offset: int,
+                  start_date: Optional[datetime], end_date: Optional[datetime]) -> bool:
+        """Whether a range can be served from blocks: a fixed width timeframe
+        and both bounds on bucket boundaries."""
+        if not self.enabled or timeframe.minutes is None:
+            return False
+        if start_date is None or end_date is None or start_date >= end_date:
+            return False
+        width = timedelta(minutes=timeframe.minutes)
+        origin = BUCKET_ORIGIN + timedelta(minutes=offset)
+        return (start_date - origin) % width == timedelta(0) \
+            and (end_date - origin) % width == timedelta(0)
+
+    async def get_rows(self, symbol_id: int, timeframe: Timeframe, offset: int,
+                       start_date: datetime, end_date: datetime, load: Loader) -> list:
+        """
+        Get the aggregated rows of a cacheable range, loading missing blocks
+
+        :param symbol_id: Market symbol_id
+        :param timeframe: Fixed width timeframe
+        :param offset: Session offset in minutes
+        :param start_date: Inclusive lower bound on a bucket boundary
+        :param end_date: Exclusive upper bound on a bucket boundary
+        :param load: Coroutine loading the rows of a [start, end) range
+
+        :return: Rows as (epoch ms, open, high, low, close, volume) oldest first
+        :rtype: list[tuple]
+        """
+        span = timeframe.minutes * self.block_buckets * 60_000
+        origin = to_epoch_ms(BUCKET_ORIGIN) + offset * 60_000
+        start_ms, end_ms = to_epoch_ms(start_date), to_epoch_ms(end_date)
+        first_block = (start_ms - origin) // span
+        last_block = (end_ms - 1 - origin) // span
+        closed_before = to_epoch_ms(datetime.now(timezone.utc).replace(tzinfo=None))
+
+        blocks: dict[int, tuple] = {}
+        missing = []
+        for index in range(first_block, last_block + 1):
+            block_start = origin + index * span
+            rows = await self._get(
+                self._key(symbol_id, timeframe, offset, block_start, block_start + span))
+            if rows is None:
+                missing.append(index)
+                self.misses += 1
+            else:
+                blocks[index] = rows
+                self.hits += 1
+
+        for run_start, run_end in _runs(missing):
+            generation = await self._generation(symbol_id)
+            loaded = await load(from_epoch_ms(origin + run_start * span),
+                                from_epoch_ms(origin + (run_end + 1) * span))
+            split = {index: [] for index in range(run_start, run_end + 1)}
+            for row in loaded:
+                split[(row[0] - origin) // span].append(tuple(row))
+            for index, rows in split.items():
+                blocks[index] = tuple(rows)
+                block_start = origin + index * span
+                block_end = block_start + span
+                if block_end <= closed_before and generation is not None:
+                    await self._put(
+                        self._key(symbol_id, timeframe, offset, block_start, block_end),
+                        blocks[index], generation)
+
+        return [
+            row
+            for index in range(first_block, last_block + 1)
+            for row in blocks[index]
+            if start_ms <= row[0] < end_ms
+        ]
+
+    async def _get(self, key: tuple) -> Optional[tuple]:
+        try:
+            return await self.backend.get(key)
+        except Exception as exc:
+            log.warning("Candle cache lookup failed: %s", exc)
+            return None
+
+    async def _generation(self, symbol_id: int) -> Optional[int]:
+        """Generation of a symbol's blocks, None if unknown so nothing is stored."""
+        try:
+            return await self.backend.generation(symbol_id)
+        except Exception as exc:
+            log.warning("Candle cache generation lookup failed: %s", exc)
+            return None
+
+    async def _put(self, key: tuple, rows: tuple, generation: int):
+        try:
+            await self.backend.put(key, rows, generation)
+        except Exception as exc:
+            log.warning("Candle cache store failed: %s", exc)
+
+    async def invalidate(self, symbol_id: int, start_date: Optional[datetime] = None,
+                         end_date: Optional[datetime] = None):
+        """
+        Drop the cached blocks of a symbol overlapping a time range
+
+        :param symbol_id: Market symbol_id
+        :param start_date: First written timestamp, None for unbounded
+        :param end_date: Last written timestamp (inclusive), None for unbounded
+        """
+        if not self.enabled:
+            return
+        start_ms = to_epoch_ms(start_date) if start_date is not None else None
+        end_ms = to_epoch_ms(end_date) if end_date is not None else None
+        try:
+            self.invalidated += await self.backend.invalidate(symbol_id, start_ms, end_ms)
+        except Exception as exc:
+            log.warning("Failed to invalidate cached candles of %s: %s", symbol_id, exc)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name if self.enabled else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "bypassed": self.bypassed,
+            "invalidated_blocks": self.invalidated,
+            **(self.backend.stats() if self.enabled else {}),
+        }
+
+    @staticmethod
+    def _key(symbol_id: int, timeframe: Timeframe, offset: int,
+             block_start: int, block_end: int) -> tuple:
+        return (symbol_id, timeframe.label, offset, block_start, block_end)
+
+
+def _runs(indexes: list[int]):
+    """Group sorted block indexes into (first, last) runs of consecutive blocks."""
+    runs = []
+    for index in indexes:
+        if runs and runs[-1][1] == index - 1:
+            runs[-1][1] = index
+        else:
+            runs.append([index, index])
+    return runs
+
+
+def _create_backend():
+    if settings.CANDLE_CACHE_BACKEND == "memory":
+        return MemoryBackend(settings.CANDLE_CACHE_MAX_ROWS)
+    if settings.CANDLE_CACHE_BACKEND == "redis":
+        if aioredis is None:
+            log.warning("redis is not installed, candle cache disabled")
+            return None
+        return RedisBackend(settings.CANDLE_CACHE_REDIS_URL, settings.CANDLE_CACHE_REDIS_TTL)
+    return None
+
+
+candle_cache = CandleCache(_create_backend(), settings.CANDLE_CACHE_BLOCK_BUCKETS)
@@ -0,0 +1,115 @@
+# app/catalog.py
+"""
+In-memory catalog of markets.
+
+The markets table is small and read on almost every client call, so it is
+kept in memory with lookups by symbol_id, by symbol and by (symbol, exchange).
+The catalog is loaded at startup, reloaded after insert_market/delete_market
+and refreshed every MARKET_CATALOG_REFRESH seconds to pick up changes made by
+other workers. Its version increases whenever the loaded content changes.
+"""
+import asyncio
+import logging
+import re
+from typing import Optional
+
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal
+from app.models import markets
+
+log = logging.getLogger(__name__)
+
+
+def _like(pattern: str, value: str) -> bool:
+    """Match a value against a SQL LIKE pattern."""
+    regex = "".join(
+        ".*" if char == "%" else "." if char == "_" else re.escape(char)
+        for char in pattern
+    )
+    return re.fullmatch(regex, value, re.DOTALL) is not None
+
+
+class MarketCatalog:
+    def __init__(self):
+        self.version = 0
+        self.loaded = False
+        self._markets: tuple[dict, ...] = ()
+        self._by_id: dict[int, dict] = {}
+        self._by_symbol: dict[str, list[dict]] = {}
+        self._by_symbol_exchange: dict[tuple[str, str], dict] = {}
+
+    async def load(self, session=None) -> int:
+        """
+        Load all markets, replacing the catalog in one step
+
+        :param session: SQLAlchemy session, a new one is opened when omitted
+
+        :return: Catalog version
+        :rtype: int
+        """
+        if session is None:
+            async with AsyncSessionLocal() as session:
+                return await self.load(session)
+
+        result = await session.execute(select(markets).order_by(markets.c.symbol_id))
+        rows = tuple(dict(row._mapping) for row in result)
+
+        by_symbol: dict[str, list[dict]] = {}
+        for market in rows:
+            by_symbol.setdefault(market["symbol"], []).append(market)
+
+        if rows != self._markets or not self.loaded:
+            self._by_id = {market["symbol_id"]: market for market in rows}
+            self._by_symbol = by_symbol
+            self._by_symbol_exchange = {
+                (market["symbol"], market["exchange"]): market for market in reversed(rows)
+            }
+            self._markets = rows
+            self.version += 1
+            self.loaded = True
+        return self.version
+
+    def by_id(self, symbol_id: int) -> Optional[dict]:
+        return self._by_id.get(symbol_id)
+
+    def by_symbol(self, symbol: str, exchange: Optional[str] = None) -> Optional[dict]:
+        """
+        Market of a symbol, on an exchange if given
+
+        Without an exchange the market with the lowest symbol_id is returned.
+        The exchange may be a LIKE pattern.
+
+        :rtype: Optional[dict]
+        """
+        if exchange is None:
+            candidates = self._by_symbol.get(symbol)
+            return candidates[0] if candidates else None
+        market = self._by_symbol_exchange.get((symbol, exchange))
+        if market is None and ("%" in exchange or "_" in exchange):
+            market = next(
+                (m for m in self._by_symbol.get(symbol, ()) if _like(exchange, m["exchange"])),
+                None,
+            )
+        return market
+
+    def filter(self, symbol: Optional[str] = None, exchange: Optional[str] = None) -> list[dict]:
+        if symbol:
+            candidates = self._by_symbol.get(symbol, [])
+        else:
+            candidates = self._markets
+        if exchange:
+            candidates = [market for market in candidates if market["exchange"] == exchange]
+        return list(candidates)
+
+    async def run_refresh(self, interval: int):
+        """Reload the catalog every interval seconds until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load()
+            except Exception as exc:
+                log.warning("Failed to refresh market catalog: %s", exc)
+
+
+market_catalog = MarketCatalog()
@@ -0,0 +1,517 @@
+# app/compact.py
+"""
+Compact integer storage of candle prices.
+
+In the compact layout the candles table stores open, high, low and close as
+integer multiples of the market's min_move, and volume as an integer. Integer
+columns compress better than float8 ones (delta encoding instead of Gorilla),
+are half their size with --integer, and keep the cached blocks and tail buffer
+small, as those hold the stored values.
+
+Conversion happens at the crud boundary: writes are encoded with the market's
+min_move. Candles that would not convert losslessly, with prices off the
+min_move grid, fractional volumes or values beyond the column type, are
+rejected with an EncodingError counting them, nothing is rounded. Reads are
+decoded after the cache, the tail buffer or the database served them, by
+multiplying with min_move and rounding to its decimals, so the API returns the
+same floats as the float layout.
+
+The layout is chosen by migrating the candles table. Columns are BIGINT, or
+INTEGER with --integer when the stored values fit, which leaves no room for
+new markets or higher prices beyond 2^31 - 1 steps:
+
+    python -m app.compact report
+    python -m app.compact migrate [--round] [--integer] [--compress-now] [--drop-legacy]
+
+Reads do not depend on the detected layout: stored prices are decoded when
+they come back as integers (see stored_steps), from the database as well as
+from cached blocks and the tail buffer, so readers are right straight after
+a migration. Workers detect the layout for writes on startup and recheck it
+every MARKET_CATALOG_REFRESH seconds, clearing their caches when it changes.
+Until then, writes of workers still on the float layout fail and are
+rejected rather than stored truncated. min_move must not change once candles are
+stored in the compact layout.
+"""
+import argparse
+import asyncio
+import json
+import logging
+from decimal import Decimal
+from functools import lru_cache
+
+from sqlalchemy import select, text
+
+from app import aggregates, settings
+from app.cache import candle_cache
+from app.catalog import market_catalog
+from app.database import engine
+from app.models import markets
+from app.tail import tail_buffer
+from app.timescale import (
+    CANDLES_TABLE, apply_storage_settings, chunk_interval_step, compress_chunks,
+    create_candles_hypertable, is_hypertable, measure_query_latency, sample_queries,
+    storage_report
+)
+
+log = logging.getLogger(__name__)
+
+COMPACT_TABLE = "candles_compact"
+FLOAT_TABLE = "candles_float"
+INTEGER_TYPES = ("integer", "bigint")
+INT4_MAX = 2 ** 31 - 1
+INT8_MAX = 2 ** 63 - 1
+# Prices further than this fraction of min_move from the grid are off the grid
+GRID_TOLERANCE = 1e-6
+
+
+@lru_cache(maxsize=None)
+def price_decimals(min_move: float) -> int:
+    """
+    Number of decimals of a min_move, e.g. 5 for 0.00001 and 2 for 0.25
+
+    :rtype: int
+    """
+    exponent = Decimal(repr(min_move)).normalize().as_tuple().exponent
+    return max(-exponent, 0)
+
+
+def decode_price(value, min_move: float):
+    """Price of a number of min_move steps, None stays None."""
+    if value is None:
+        return None
+    return round(value * min_move, price_decimals(min_move))
+
+
+def stored_steps(value) -> bool:
+    """
+    Whether a stored price is a number of min_move steps
+
+    Reads tell the layouts apart by the type of the values, float8 prices come
+    back as floats and integer ones as ints, so they are decoded right even
+    before load() noticed a migration, and cached rows of either layout mix.
+    """
+    return isinstance(value, int)
+
+
+def decode_volume(value):
+    return float(value) if value is not None else None
+
+
+class EncodingError(ValueError):
+    """Candles that do not convert losslessly to the compact layout."""
+
+    def __init__(self, report: dict):
+        reasons = ", ".join(f"{count} {reason.replace('_', ' ')}"
+                            for reason, count in report.items() if count)
+        super().__init__(f"Candles do not fit the compact layout: {reasons}")
+        self.report = report
+
+
+class CandleLayout:
+    def __init__(self):
+        self.compact = False
+        self.loaded = False
+        # Largest stored value of the price and volume columns
+        self.price_max = INT8_MAX
+        self.volume_max = INT8_MAX
+
+    async def load(self) -> bool:
+        """
+        Detect the layout of the candles table from the type of its price columns
+
+        Caches and the tail buffer are cleared when the layout changed.
+
+        :return: Whether candles are stored in the compact layout
+        :rtype: bool
+        """
+        async with engine.connect() as conn:
+            result = await conn.execute(text("""
+                SELECT column_name, data_type FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = :table
+                    AND column_name IN ('open', 'volume')
+            """), {"table": CANDLES_TABLE})
+            types = dict(result.all())
+            compact = types.get("open") in INTEGER_TYPES
+
+        self.price_max = INT4_MAX if types.get("open") == "integer" else INT8_MAX
+        self.volume_max = INT4_MAX if types.get("volume") == "integer" else INT8_MAX
+        if self.loaded and compact != self.compact:
+            log.info("Candle layout changed to %s, clearing caches",
+                     "compact" if compact else "float")
+            for market in market_catalog.filter():
+                await candle_cache.invalidate(market["symbol_id"])
+                tail_buffer.discard(market["symbol_id"])
+        self.compact = compact
+        self.loaded = True
+        return compact
+
+    async def run_refresh(self, interval: int):
+        """Recheck the layout every interval seconds until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load()
+            except Exception as exc:
+                log.warning("Failed to check the candle layout: %s", exc)
+
+    async def min_move(self, session, symbol_id: int) -> float:
+        """
+        min_move of a market, from the catalog when loaded
+
+        :raises LookupError: If the market does not exist
+        """
+        market = market_catalog.by_id(symbol_id)
+        if market is not None:
+            return market["min_move"]
+        result = await session.execute(
+            select(markets.c.min_move).where(markets.c.symbol_id == symbol_id))
+        min_move = result.scalar()
+        if min_move is None:
+            raise LookupError(f"Unknown symbol_id: {symbol_id}")
+        return min_move
+
+    async def encode_records(self, session, records: list[tuple]) -> list[tuple]:
+        """
+        Encode candle records ordered like CANDLE_COLUMNS for storage
+
+        :param session: SQLAlchemy session
+        :param records: Tuples of symbol_id, timestamp, open, high, low, close, volume
+
+        :rtype: list[tuple]
+
+        :raises EncodingError: If prices are off the min_move grid, volumes are
+            fractional or values do not fit the columns
+        """
+        if not self.compact:
+            return records
+        steps = {}
+        encoded = []
+        report = {"off_grid": 0, "fractional_volumes": 0, "out_of_range": 0}
+        for symbol_id, timestamp, open_, high, low, close, volume in records:
+            if symbol_id not in steps:
+                steps[symbol_id] = await self.min_move(session, symbol_id)
+            step = steps[symbol_id]
+            prices = [price / step for price in (open_, high, low, close)]
+            rounded = [round(price) for price in prices]
+            if any(abs(price - whole) > GRID_TOLERANCE for price, whole in zip(prices, rounded)):
+                report["off_grid"] += 1
+            if volume != round(volume):
+                report["fractional_volumes"] += 1
+            if max(abs(value) for value in rounded) > self.price_max \
+                    or abs(volume) > self.volume_max:
+                report["out_of_range"] += 1
+            encoded.append((symbol_id, timestamp, *rounded, round(volume)))
+        if any(report.values()):
+            raise EncodingError(report)
+        return encoded
+
+    async def encode_values(self, session, values: list[dict]) -> list[dict]:
+        """Encode candles given as dicts with symbol_id like encode_records."""
+        if not self.compact:
+            return values
+        records = await self.encode_records(session, [
+            (value["symbol_id"], value["timestamp"], value["open"], value["high"],
+             value["low"], value["close"], value["volume"])
+            for value in values
+        ])
+        return [
+            dict(zip(("symbol_id", "timestamp", "open", "high", "low", "close", "volume"),
+                     record))
+            for record in records
+        ]
+
+    async def decode_rows(self, session, symbol_id: int, rows):
+        """
+        Decode stored candle rows of one market
+
+        Rows are decoded when their close is an integer, see stored_steps.
+
+        :param session: SQLAlchemy session
+        :param symbol_id: Market symbol_id
+        :param rows: Rows of timestamp, open, high, low, close, volume
+
+        :return: Rows as tuples with prices and volume as floats
+        """
+        if not any(stored_steps(row[4]) for row in rows):
+            return rows
+        step = await self.min_move(session, symbol_id)
+        digits = price_decimals(step)
+        return [
+            (timestamp, round(open_ * step, digits), round(high * step, digits),
+             round(low * step, digits), round(close * step, digits), float(volume))
+            if stored_steps(close) else (timestamp, open_, high, low, close, volume)
+            for timestamp, open_, high, low, close, volume in rows
+        ]
+
+    async def decode_candles(self, session, symbol_id: int, candles: list[dict]) -> list[dict]:
+        """Decode stored candles of one market given as dicts, in place."""
+        if not any(stored_steps(candle["close"]) for candle in candles):
+            return candles
+        step = await self.min_move(session, symbol_id)
+        for candle in candles:
+            if not stored_steps(candle["close"]):
+                continue
+            for name in ("open", "high", "low", "close"):
+                candle[name] = decode_price(candle[name], step)
+            candle["volume"] = decode_volume(candle["volume"])
+        return candles
+
+    def decode_columns(self, min_move: float, columns: dict) -> dict:
+        """Decode open/high/low/close/volume column lists, None where missing, in place."""
+        if not any(stored_steps(value) for value in columns["close"]):
+            return columns
+        for name in ("open", "high", "low", "close"):
+            columns[name] = [decode_price(value, min_move) if stored_steps(value) else value
+                             for value in columns[name]]
+        columns["volume"] = [decode_volume(value) for value in columns["volume"]]
+        return columns
+
+
+candle_layout = CandleLayout()
+
+
+async def analyze_candles(integer: bool = False) -> dict:
+    """
+    Check whether the stored candles fit the compact layout
+
+    :param integer: Use INTEGER columns where the stored values fit, BIGINT otherwise
+
+    :return: Per market the number of off-grid candles, fractional volumes and
+        the largest values, and the column types to use
+    :rtype: dict
+    """
+    async with engine.connect() as conn:
+        result = await conn.execute(text("""
+            SELECT data_type FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = :table
+                AND column_name = 'open'
+        """), {"table": CANDLES_TABLE})
+        if result.scalar() in INTEGER_TYPES:
+            return {"layout": "compact"}
+
+        off_grid = " OR ".join(
+            f"abs(c.{column} / m.min_move - round(c.{column} / m.min_move)) > :tolerance"
+            for column in ("open", "high", "low", "close")
+        )
+        result = await conn.execute(text(f"""
+            SELECT
+                c.symbol_id,
+                m.min_move,
+                count(*) AS candles,
+                count(*) FILTER (WHERE {off_grid}) AS off_grid,
+                count(*) FILTER (WHERE c.volume <> round(c.volume)) AS fractional_volumes,
+                max(greatest(abs(c.high), abs(c.low)) / m.min_move) AS max_steps,
+                max(abs(c.volume)) AS max_volume
+            FROM {CANDLES_TABLE} c JOIN markets m USING (symbol_id)
+            GROUP BY c.symbol_id, m.min_move
+            ORDER BY c.symbol_id
+        """), {"tolerance": GRID_TOLERANCE})
+        symbols = [dict(row._mapping) for row in result]
+
+    max_steps = max((symbol["max_steps"] for symbol in symbols), default=0)
+    max_volume = max((symbol["max_volume"] for symbol in symbols), default=0)
+    return {
+        "layout": "float",
+        "price_type": "INTEGER" if integer and round(max_steps) <= INT4_MAX else "BIGINT",
+        "volume_type": "INTEGER" if integer and round(max_volume) <= INT4_MAX else "BIGINT",
+        "off_grid": sum(symbol["off_grid"] for symbol in symbols),
+        "fractional_volumes": sum(symbol["fractional_volumes"] for symbol in symbols),
+        "symbols": symbols,
+    }
+
+
+async def _drop_continuous_aggregates(conn) -> list[str]:
+    result = await conn.execute(text("""
+        SELECT view_name FROM timescaledb_information.continuous_aggregates
+        WHERE hypertable_name = :table
+    """), {"table": CANDLES_TABLE})
+    views = result.scalars().all()
+    for view in views:
+        await conn.execute(text(f"DROP MATERIALIZED VIEW {view}"))
+    return views
+
+
+async def migrate_candles(
+    round_values: bool = False, drop_legacy: bool = False, compress_now: bool = False,
+    samples: int = 3, integer: bool = False
+) -> dict:
+    """
+    Convert the candles table to the compact layout online
+
+    Works like the hypertable migration of app/timescale.py: rows are encoded
+    with the min_move of their market and copied chunk by chunk into a new
+    hypertable while the old table keeps serving reads and writes, then the
+    last window is caught up and the tables are swapped under a lock. The
+    continuous aggregates are dropped in the swap and recreated on the new
+    table, real-time aggregation serves them until they are materialized.
+    The old table is kept as candles_float until dropped.
+
+    :param round_values: Round off-grid prices and fractional volumes instead of refusing
+    :param drop_legacy: Drop the old table after the swap
+    :param compress_now: Compress all chunks older than the compression threshold
+    :param samples: Number of markets to use for the latency comparison
+    :param integer: Use INTEGER columns where the stored values fit, BIGINT otherwise
+
+    :return: Migration report with column types, rows copied, storage and latency changes
+    :rtype: dict
+    """
+    analysis = await analyze_candles(integer)
+    if analysis["layout"] == "compact":
+        return {"status": "already_compact", "storage": await storage_report()}
+    if (analysis["off_grid"] or analysis["fractional_volumes"]) and not round_values:
+        return {"status": "refused", "reason": "values would be rounded, see --round",
+                **analysis}
+
+    async with engine.connect() as conn:
+        size = "hypertable_size" if await is_hypertable(conn) else "pg_total_relation_size"
+        result = await conn.execute(text(f"SELECT {size}('{CANDLES_TABLE}')"))
+        before_bytes = result.scalar()
+        result = await conn.execute(
+            text(f"SELECT min(timestamp), max(timestamp) FROM {CANDLES_TABLE}"))
+        first_ts, last_ts = result.one()
+        step = await chunk_interval_step(conn)
+        result = await conn.execute(text("SELECT to_regclass(:table) IS NOT NULL"),
+                                    {"table": COMPACT_TABLE})
+        resume = bool(result.scalar())
+
+    queries = await sample_queries(samples)
+    before_latency = await measure_query_latency(queries)
+
+    async with engine.begin() as conn:
+        if resume:
+            result = await conn.execute(text(f"SELECT max(timestamp) FROM {COMPACT_TABLE}"))
+            resume_ts = result.scalar()
+            if resume_ts is not None and first_ts is not None:
+                first_ts = max(first_ts, resume_ts - step)
+            log.info("Resuming compact candles migration from %s", first_ts)
+        else:
+            price_type, volume_type = analysis["price_type"], analysis["volume_type"]
+            await conn.execute(text(f"""
+                CREATE TABLE {COMPACT_TABLE} (
+                    symbol_id INTEGER NOT NULL REFERENCES markets (symbol_id),
+                    timestamp TIMESTAMP NOT NULL,
+                    open {price_type} NOT NULL,
+                    high {price_type} NOT NULL,
+                    low {price_type} NOT NULL,
+                    close {price_type} NOT NULL,
+                    volume {volume_type} NOT NULL,
+                    PRIMARY KEY (symbol_id, timestamp)
+                )
+            """))
+            await create_candles_hypertable(conn, COMPACT_TABLE)
+
+    encode_sql = f"""
+        INSERT INTO {COMPACT_TABLE}
+        SELECT
+            c.symbol_id, c.timestamp,
+            round(c.open / m.min_move), round(c.high / m.min_move),
+            round(c.low / m.min_move), round(c.close / m.min_move),
+            round(c.volume)
+        FROM {CANDLES_TABLE} c JOIN markets m USING (symbol_id)
+    """
+    copy_sql = text(f"""
+        {encode_sql}
+        WHERE c.timestamp >= :lower AND c.timestamp < :upper
+        ON CONFLICT DO NOTHING
+    """)
+    rows_copied = 0
+    window_start = first_ts
+    while first_ts is not None and window_start <= last_ts:
+        window_end = window_start + step
+        async with engine.begin() as conn:
+            result = await conn.execute(copy_sql, {"lower": window_start, "upper": window_end})
+            rows_copied += result.rowcount
+        log.info("Copied candles up to %s (%d rows)", window_end, rows_copied)
+        window_start = window_end
+
+    async with engine.begin() as conn:
+        await conn.execute(text(f"LOCK TABLE {CANDLES_TABLE} IN SHARE ROW EXCLUSIVE MODE"))
+        catch_up_from = (window_start - step) if first_ts is not None else None
+        result = await conn.execute(text(f"""
+            {encode_sql}
+            WHERE c.timestamp >= :lower OR CAST(:lower AS TIMESTAMP) IS NULL
+            ON CONFLICT DO NOTHING
+        """), {"lower": catch_up_from})
+        rows_copied += result.rowcount
+        dropped_views = await _drop_continuous_aggregates(conn)
+        await conn.execute(text(f"ALTER TABLE {CANDLES_TABLE} RENAME TO {FLOAT_TABLE}"))
+        await conn.execute(text(f"ALTER TABLE {COMPACT_TABLE} RENAME TO {CANDLES_TABLE}"))
+        await apply_storage_settings(conn, CANDLES_TABLE)
+
+    await aggregates.setup_continuous_aggregates()
+    await aggregates.load_available_aggregates()
+    await market_catalog.load()
+    await candle_layout.load()
+    # Cached blocks of other workers hold float values
+    for market in market_catalog.filter():
+        await candle_cache.invalidate(market["symbol_id"])
+
+    compressed_chunks = await compress_chunks() if compress_now else 0
+
+    if drop_legacy:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP TABLE {FLOAT_TABLE}"))
+
+    storage = await storage_report()
+    after_latency = await measure_query_latency(queries)
+    return {
+        "status": "migrated",
+        "price_type": analysis["price_type"],
+        "volume_type": analysis["volume_type"],
+        "rounded": {"off_grid": analysis["off_grid"],
+                    "fractional_volumes": analysis["fractional_volumes"]},
+        "rows_copied": rows_copied,
+        "legacy_table": None if drop_legacy else FLOAT_TABLE,
+        "continuous_aggregates": dropped_views,
+        "compressed_chunks": compressed_chunks,
+        "storage": {
+            "before_bytes": before_bytes,
+            "after_bytes": storage["total_bytes"],
+            "saved_bytes": before_bytes - storage["total_bytes"],
+            "compression": storage.get("compression"),
+        },
+        "latency_ms": {
+            query: {"before": before_latency[query], "after": after_latency.get(query)}
+            for query in before_latency
+        },
+    }
+
+
+async def _run(args) -> dict:
+    try:
+        if args.command == "migrate":
+            return await migrate_candles(
+                round_values=args.round,
+                drop_legacy=args.drop_legacy,
+                compress_now=args.compress_now,
+                samples=args.samples,
+                integer=args.integer,
+            )
+        return await analyze_candles()
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the compact candle layout")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("report", help="Check whether the candles fit the compact layout")
+    migrate = commands.add_parser("migrate", help="Convert candles to the compact layout online")
+    migrate.add_argument("--round", action="store_true",
+                         help="Round off-grid prices and fractional volumes")
+    migrate.add_argument("--integer", action="store_true",
+                         help="Use INTEGER columns where the stored values fit instead of BIGINT")
+    migrate.add_argument("--drop-legacy", action="store_true",
+                         help="Drop the old table after the swap")
+    migrate.add_argument("--compress-now", action="store_true",
+                         help="Compress eligible chunks right after the swap")
+    migrate.add_argument("--samples", type=int, default=3,
+                         help="Number of markets used to compare query latency")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=settings.LOG_LEVEL)
+    print(json.dumps(asyncio.run(_run(args)), indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+# app/coverage.py
+"""
+Coverage index of candle histories.
+
+candle_coverage holds the contiguous ranges of every symbol's 1 minute
+candles: the first and last timestamp of each run of candles at most
+CANDLES_COVERAGE_TOLERANCE minutes apart, and its row count. First/last
+timestamps, row counts and gaps of a history are answered from it without
+touching the candles table.
+
+Inserts merge the ranges of the newly added rows into the index in the
+writing transaction. Deletes and retention rebuild the affected ranges from
+the candles table. A full rebuild (POST /coverage/rebuild) indexes existing
+histories. Writers of a symbol serialize on an advisory lock while they
+update its ranges.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import text
+
+from app import settings
+from app.database import AsyncSessionLocal, engine
+from app.timescale import CANDLES_TABLE
+
+log = logging.getLogger(__name__)
+
+COVERAGE_TABLE = "candle_coverage"
+
+# First key of the advisory locks taken on symbol_ids while their ranges change
+COVERAGE_LOCK = 0x636f76
+
+# Resolution of the candles table
+CANDLE_STEP = timedelta(minutes=1)
+
+
+def tolerance() -> timedelta:
+    return timedelta(minutes=max(settings.CANDLES_COVERAGE_TOLERANCE, 1))
+
+
+def islands_sql(points: str) -> str:
+    """
+    Build the SELECT grouping (symbol_id, timestamp) rows into coverage ranges
+
+    :param points: Relation or CTE name with symbol_id and timestamp columns;
+        the statement binds :tolerance
+
+    :rtype: str
+    """
+    return f"""
+        SELECT symbol_id, min(timestamp) AS range_start, max(timestamp) AS range_end,
+            count(*) AS row_count
+        FROM (
+            SELECT symbol_id, timestamp,
+                sum(new_range) OVER (PARTITION BY symbol_id ORDER BY timestamp) AS range_id
+            FROM (
+                SELECT symbol_id, timestamp,
+                    CASE WHEN timestamp - lag(timestamp) OVER (
+                        PARTITION BY symbol_id ORDER BY timestamp
+                    ) <= :tolerance THEN 0 ELSE 1 END AS new_range
+                FROM {points}
+            ) flagged
+        ) numbered
+        GROUP BY symbol_id, range_id
+    """
+
+
+async def setup_coverage() -> bool:
+    """
+    Create the coverage table
+
+    :return: Whether the table was created, and has to be filled with rebuild
+    :rtype: bool
+    """
+    async with engine.begin() as conn:
+        result = await conn.execute(text("SELECT to_regclass(:table) IS NULL"),
+                                    {"table": COVERAGE_TABLE})
+        created = bool(result.scalar())
+        await conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {COVERAGE_TABLE} (
+                symbol_id INTEGER NOT NULL REFERENCES markets (symbol_id) ON DELETE CASCADE,
+                range_start TIMESTAMP NOT NULL,
+                range_end TIMESTAMP NOT NULL,
+                row_count BIGINT NOT NULL,
+                PRIMARY KEY (symbol_id, range_start)
+            )
+        """))
+    return created
+
+
+def ranges_of(points) -> dict[int, list[tuple[datetime, datetime, int]]]:
+    """
+    Group (symbol_id, timestamp) rows, e.g. returned by an insert, into ranges
+
+    :rtype: dict[int, list[tuple[datetime, datetime, int]]]
+    """
+    by_symbol: dict[int, list] = {}
+    for symbol_id, timestamp in points:
+        by_symbol.setdefault(symbol_id, []).append((timestamp, timestamp, 1))
+    return {symbol_id: merge(ranges, tolerance()) for symbol_id, ranges in by_symbol.items()}
+
+
+def merge(ranges: list, gap: timedelta) -> list[tuple[datetime, datetime, int]]:
+    """
+    Merge (start, end, rows) ranges that overlap or are at most gap apart
+
+    :rtype: list[tuple[datetime, datetime, int]]
+    """
+    merged = []
+    for start, end, rows in sorted(ranges):
+        if merged and start - merged[-1][1] <= gap:
+            previous = merged[-1]
+            merged[-1] = (previous[0], max(previous[1], end), previous[2] + rows)
+        else:
+            merged.append((start, end, rows))
+    return merged
+
+
+async def _lock(session, symbol_id: int):
+    await session.execute(text("SELECT pg_advisory_xact_lock(:key, :symbol_id)"),
+                          {"key": COVERAGE_LOCK, "symbol_id": symbol_id})
+
+
+async def add_ranges(session, ranges: dict):
+    """
+    Merge the ranges of newly inserted candles into the index, to be called
+    inside the writing transaction
+
+    :param session: SQLAlchemy session
+    :param ranges: symbol_id to a list of (start, end, rows) ranges of the
+        inserted rows, e.g. from islands_sql over the inserted rows
+    """
+    gap = tolerance()
+    for symbol_id in sorted(ranges):
+        added = ranges[symbol_id]
+        if not added:
+            continue
+        await _lock(session, symbol_id)
+        result = await session.execute(text(f"""
+            DELETE FROM {COVERAGE_TABLE}
+            WHERE symbol_id = :symbol_id AND range_end >= :lower AND range_start <= :upper
+            RETURNING range_start, range_end, row_count
+        """), {
+            "symbol_id": symbol_id,
+            "lower": min(start for start, _, _ in added) - gap,
+            "upper": max(end for _, end, _ in added) + gap,
+        })
+        existing = [tuple(row) for row in result.fetchall()]
+        await _insert(session, symbol_id, merge(existing + list(added), gap))
+
+
+async def rebuild_ranges(session, symbol_id: int, start_date: Optional[datetime] = None,
+                         end_date: Optional[datetime] = None) -> int:
+    """
+    Rebuild the ranges of a symbol overlapping a time range from its candles,
+    to be called inside the writing transaction after a delete
+
+    :param session: SQLAlchemy session
+    :param symbol_id: Market symbol_id
+    :param start_date: First changed timestamp, None for unbounded
+    :param end_date: Last changed timestamp (inclusive), None for unbounded
+
+    :return: Number of ranges rebuilt
+    :rtype: int
+    """
+    await _lock(session, symbol_id)
+    result = await session.execute(text(f"""
+        DELETE FROM {COVERAGE_TABLE}
+        WHERE symbol_id = :symbol_id
+            AND (range_end >= :start_date OR CAST(:start_date AS TIMESTAMP) IS NULL)
+            AND (range_start <= :end_date OR CAST(:end_date AS TIMESTAMP) IS NULL)
+        RETURNING range_start, range_end
+    """), {"symbol_id": symbol_id, "start_date": start_date, "end_date": end_date})
+    removed = result.fetchall()
+
+    # Rows of the removed ranges outside the changed range have to be re-indexed too
+    lower = upper = None
+    if start_date is not None:
+        lower = min([row.range_start for row in removed] + [start_date])
+    if end_date is not None:
+        upper = max([row.range_end for row in removed] + [end_date])
+    conditions = ""
+    if lower is not None:
+        conditions += " AND timestamp >= :lower"
+    if upper is not None:
+        conditions += " AND timestamp <= :upper"
+
+    result = await session.execute(text(f"""
+        WITH points AS (
+            SELECT symbol_id, timestamp FROM {CANDLES_TABLE}
+            WHERE symbol_id = :symbol_id{conditions}
+        )
+        {islands_sql("points")}
+    """), {"symbol_id": symbol_id, "lower": lower, "upper": upper, "tolerance": tolerance()})
+    ranges = [(row.range_start, row.range_end, row.row_count) for row in result]
+    await _insert(session, symbol_id, ranges)
+    return len(ranges)
+
+
+async def _insert(session, symbol_id: int, ranges: list):
+    if not ranges:
+        return
+    await session.execute(text(f"""
+        INSERT INTO {COVERAGE_TABLE} (symbol_id, range_start, range_end, row_count)
+        VALUES (:symbol_id, :range_start, :range_end, :rows)
+    """), [
+        {"symbol_id": symbol_id, "range_start": start, "range_end": end, "rows": rows}
+        for start, end, rows in ranges
+    ])
+
+
+async def drop_before(session, cutoff: datetime) -> int:
+    """
+    Update the index after all candles before cutoff were dropped, to be
+    called inside the dropping transaction
+
+    :return: Number of symbols whose ranges were rebuilt
+    :rtype: int
+    """
+    await session.execute(text(f"DELETE FROM {COVERAGE_TABLE} WHERE range_end < :cutoff"),
+                          {"cutoff": cutoff})
+    result = await session.execute(text(f"""
+        SELECT DISTINCT symbol_id FROM {COVERAGE_TABLE} WHERE range_start < :cutoff
+    """), {"cutoff": cutoff})
+    symbol_ids = result.scalars().all()
+    for symbol_id in symbol_ids:
+        await rebuild_ranges(session, symbol_id, cutoff, cutoff)
+    return len(symbol_ids)
+
+
+async def get_coverage(session, symbol_id: int, start_date: Optional[datetime] = None,
+                       end_date: Optional[datetime] = None) -> dict:
+    """
+    Get the coverage summary and ranges of a symbol
+
+    :param session: SQLAlchemy session
+    :param symbol_id: Market symbol_id
+    :param start_date: Only ranges ending at or after this time (optional)
+    :param end_date: Only ranges starting before this time (optional)
+
+    :return: First and last timestamp and row count of the whole history,
+        and the ranges overlapping the requested window
+    :rtype: dict
+    """
+    result = await session.execute(text(f"""
+        SELECT min(range_start) AS first, max(range_end) AS last,
+            COALESCE(sum(row_count), 0) AS rows, count(*) AS ranges
+        FROM {COVERAGE_TABLE}
+        WHERE symbol_id = :symbol_id
+    """), {"symbol_id": symbol_id})
+    summary = dict(result.one()._mapping)
+
+    result = await session.execute(text(f"""
+        SELECT range_start AS start, range_end AS end, row_count AS rows
+        FROM {COVERAGE_TABLE}
+        WHERE symbol_id = :symbol_id{_window_conditions(start_date, end_date)}
+        ORDER BY range_start
+    """), {"symbol_id": symbol_id, "start_date": start_date, "end_date": end_date})
+    return {
+        "symbol_id": symbol_id,
+        **summary,
+        "tolerance_minutes": tolerance() // CANDLE_STEP,
+        "ranges": [dict(row._mapping) for row in result],
+    }
+
+
+async def get_gaps(session, symbol_id: int, min_gap: timedelta,
+                   start_date: Optional[datetime] = None,
+                   end_date: Optional[datetime] = None) -> dict:
+    """
+    Get the gaps of a symbol's history of at least min_gap
+
+    Gaps are the missing minutes between ranges, and with start_date or
+    end_date also those between the window bounds and the first or last range
+    inside the window.
+
+    :param session: SQLAlchemy session
+    :param symbol_id: Market symbol_id
+    :param min_gap: Shortest gap reported
+    :param start_date: Inclusive start of the window (optional)
+    :param end_date: Exclusive end of the window (optional)
+
+    :return: Gaps as [start, end) time ranges oldest first, and the missing minutes
+    :rtype: dict
+    """
+    params = {
+        "symbol_id": symbol_id,
+        "start_date": start_date,
+        "end_date": end_date,
+        "min_gap": min_gap,
+    }
+    conditions = _window_conditions(start_date, end_date)
+    result = await session.execute(text(f"""
+        WITH ranges AS (
+            SELECT range_start, range_end,
+                lag(range_end) OVER (ORDER BY range_start) AS previous_end
+            FROM {COVERAGE_TABLE}
+            WHERE symbol_id = :symbol_id{conditions}
+        )
+        SELECT previous_end + INTERVAL '1 minute' AS start, range_start AS end
+        FROM ranges
+        WHERE range_start - previous_end - INTERVAL '1 minute' >= :min_gap
+        ORDER BY range_start
+    """), params)
+    gaps = [(row.start, row.end) for row in result]
+
+    result = await session.execute(text(f"""
+        SELECT min(range_start) AS first, max(range_end) AS last
+        FROM {COVERAGE_TABLE}
+        WHERE symbol_id = :symbol_id{conditions}
+    """), params)
+    first, last = result.one()
+    if start_date is not None:
+        gap_end = first if first is not None else end_date
+        if gap_end is None or gap_end > start_date:
+            gaps.insert(0, (start_date, gap_end))
+    if end_date is not None and last is not None and last + CANDLE_STEP < end_date:
+        gaps.append((last + CANDLE_STEP, end_date))
+
+    gaps = [
+        {"start": start, "end": end,
+         "minutes": (end - start) // CANDLE_STEP if end is not None else None}
+        for start, end in gaps
+        if end is None or end - start >= min_gap
+    ]
+    return {
+        "symbol_id": symbol_id,
+        "min_gap_minutes": min_gap // CANDLE_STEP,
+        "missing_minutes": sum(gap["minutes"] or 0 for gap in gaps),
+        "gaps": gaps,
+    }
+
+
+async def get_summaries(session) -> list[dict]:
+    """
+    Get first and last timestamp, row and range count of every indexed symbol
+
+    :rtype: list[dict]
+    """
+    result = await session.execute(text(f"""
+        SELECT symbol_id, min(range_start) AS first, max(range_end) AS last,
+            sum(row_count) AS rows, count(*) AS ranges
+        FROM {COVERAGE_TABLE}
+        GROUP BY symbol_id
+        ORDER BY symbol_id
+    """))
+    return [dict(row._mapping) for row in result]
+
+
+def _window_conditions(start_date: Optional[datetime], end_date: Optional[datetime]) -> str:
+    conditions = ""
+    if start_date is not None:
+        conditions += " AND range_end >= :start_date"
+    if end_date is not None:
+        conditions += " AND range_start < :end_date"
+    return conditions
+
+
+async def rebuild(symbol_ids: Optional[list[int]] = None, job=None) -> dict:
+    """
+    Rebuild the index of symbols from their candles, one symbol per transaction
+
+    :param symbol_ids: Symbols to rebuild, all markets when omitted
+    :param job: Job to report progress on (optional)
+
+    :return: Symbols rebuilt and their range count
+    :rtype: dict
+    """
+    async with AsyncSessionLocal() as session:
+        if symbol_ids is None:
+            result = await session.execute(
+                text("SELECT symbol_id FROM markets ORDER BY symbol_id"))
+            symbol_ids = result.scalars().all()
+
+    ranges = {}
+    for symbol_id in symbol_ids:
+        async with AsyncSessionLocal() as session:
+            ranges[symbol_id] = await rebuild_ranges(session, symbol_id)
+            await session.commit()
+        if job is not None:
+            job.progress.update(symbols_done=len(ranges), symbols_total=len(symbol_ids))
+        log.info("Rebuilt coverage of %s: %s ranges", symbol_id, ranges[symbol_id])
+    return {"symbols": len(ranges), "ranges": ranges}
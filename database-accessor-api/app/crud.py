@@ -1,8 +1,29 @@
-from sqlalchemy import select, insert, delete, text
+from sqlalchemy import select, insert, delete, literal_column, or_, text
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from app.models import markets, candles
-from typing import Optional
-from datetime import datetime
+from app import aggregates, coverage, versions
+from app.cache import candle_cache, from_epoch_ms
+from app.catalog import market_catalog
+from app.compact import candle_layout
+from app.tail import tail_buffer
+from app.aggregation import (
+    aligned_candles_query, bucket_start, candles_query, next_bucket, oldest_first, page_query,
+    tail_query, tail_scan_rows, time_conditions
+)
+from app.profiling import stage
+from app.pagination import Direction, PageCursor, encode_cursor
+from app.timeframes import Timeframe, parse_timeframe
+from typing import Optional, Union
+from datetime import datetime, timezone
+import time
+import uuid
+
+import numpy as np
+
+CANDLE_COLUMNS = ["symbol_id", "timestamp", "open", "high", "low", "close", "volume"]
+CANDLE_FIELDS = CANDLE_COLUMNS[1:]
+# Candles per upsert statement, statements are limited to 32767 parameters
+UPSERT_ROWS = 32767 // len(CANDLE_COLUMNS)
 
 
 async def get_market_by_id(session, symbol_id: int):
@@ -15,6 +36,11 @@ async def get_market_by_id(session, symbol_id: int):
     :return: Market data as a dictionary
     :rtype: dict or None
     """
+    if market_catalog.loaded:
+        market = market_catalog.by_id(symbol_id)
+        if market is not None:
+            return dict(market)
+
     stmt = select(markets).where(markets.c.symbol_id == symbol_id)
     result = await session.execute(stmt)
     row = result.fetchone()
@@ -34,7 +60,9 @@ async def insert_market(session, market_data: dict):
     stmt = insert(markets).values(**market_data).returning(markets.c.symbol_id)
     result = await session.execute(stmt)
     await session.commit()
-    return result.scalar_one()
+    symbol_id = result.scalar_one()
+    await market_catalog.load(session)
+    return symbol_id
 
 
 async def delete_market(session, symbol_id: int):
@@ -54,6 +82,9 @@ async def delete_market(session, symbol_id: int):
     market_result = await session.execute(stmt)
 
     await session.commit()
+    await candle_cache.invalidate(symbol_id)
+    tail_buffer.discard(symbol_id)
+    await market_catalog.load(session)
 
     return {
         "market_deleted": bool(market_result.rowcount),
@@ -69,6 +100,11 @@ async def get_markets(session, symbol: Optional[str] = None, exchange: Optional[
 
     :return: List of markets as dictionaries
     """
+    if market_catalog.loaded:
+        found = market_catalog.filter(symbol, exchange)
+        if found:
+            return [dict(market) for market in found]
+
     stmt = select(markets)
     if symbol:
         stmt = stmt.where(markets.c.symbol == symbol)
@@ -100,6 +136,11 @@ async def get_symbol_id(session, symbol: str, exchange: str):
     if not isinstance(symbol, str) or not isinstance(exchange, str):
         raise TypeError("Symbol and exchange must be strings")
 
+    if market_catalog.loaded:
+        market = market_catalog.by_symbol(symbol, exchange)
+        if market is not None:
+            return market["symbol_id"]
+
     query = text("""
         SELECT symbol_id FROM markets WHERE symbol = :symbol AND exchange LIKE :exchange
     """)
@@ -108,6 +149,30 @@ async def get_symbol_id(session, symbol: str, exchange: str):
     return row[0] if row else None
 
 
+async def lookup_markets(session, symbols: list[str], exchange: Optional[str] = None):
+    """
+    Resolve many symbols from the market catalog
+
+    :param session: SQLAlchemy session, used to load the catalog if needed
+    :param symbols: Market symbols
+    :param exchange: Market exchange, may be a LIKE pattern (optional)
+
+    :return: Markets found by symbol, and the symbols not found
+    :rtype: dict
+    """
+    if not market_catalog.loaded:
+        await market_catalog.load(session)
+
+    found, missing = {}, []
+    for symbol in dict.fromkeys(symbols):
+        market = market_catalog.by_symbol(symbol, exchange)
+        if market is None:
+            missing.append(symbol)
+        else:
+            found[symbol] = dict(market)
+    return {"version": market_catalog.version, "markets": found, "missing": missing}
+
+
 async def insert_candles(session, symbol_id: int, candles_data: list[dict]):
     """
     Insert candles into the database
@@ -119,95 +184,539 @@ async def insert_candles(session, symbol_id: int, candles_data: list[dict]):
     :return: Number of candles added
     :rtype: int
     """
-    values = [
+    return await insert_candle_records(session, [
         {
             "symbol_id": symbol_id,
             **candle
         }
         for candle in candles_data
-    ]
+    ])
+
 
-    stmt = pg_insert(candles).values(values)
+async def insert_candle_records(session, values: list[dict]):
+    """
+    Insert candles of any number of markets in a single statement
+
+    Candles already stored are skipped. Statements are limited to 32767
+    parameters, so at most 4681 candles can be inserted per call. Prices are
+    encoded for the compact layout when it is used (see app/compact.py).
+
+    :param session: SQLAlchemy session
+    :param values: Candles with symbol_id, timestamp, open, high, low, close and volume
+
+    :return: Number of candles added
+    :rtype: int
+
+    :raises EncodingError: If candles do not fit the compact layout
+    """
+    stmt = pg_insert(candles).values(await candle_layout.encode_values(session, values))
     stmt = stmt.on_conflict_do_nothing(
         index_elements=["symbol_id", "timestamp"])
+    stmt = stmt.returning(candles.c.symbol_id, candles.c.timestamp)
     result = await session.execute(stmt)
+    inserted = result.fetchall()
+    changes = _record_ranges(
+        (value["symbol_id"], naive_utc(value["timestamp"])) for value in values)
+    if inserted and changes:
+        await versions.record_changes(session, changes)
+        await coverage.add_ranges(session, coverage.ranges_of(inserted))
     await session.commit()
 
-    added = result.rowcount if result.rowcount is not None else len(values)
-    return added
+    for symbol_id, (first, last) in changes.items():
+        await candle_cache.invalidate(symbol_id, first, last)
+    await tail_buffer.warm(session, changes)
+
+    return len(inserted)
+
+
+async def upsert_candle_records(session, values: list[dict]) -> tuple[int, int]:
+    """
+    Insert candles of any number of markets, replacing stored candles that differ
+
+    For bars that are published again while they form: a later, more complete
+    version of a stored candle replaces it. Values are written in statements
+    of at most UPSERT_ROWS candles, all in one transaction.
+
+    :param session: SQLAlchemy session
+    :param values: Candles with symbol_id, timestamp, open, high, low, close and volume,
+        at most one per market and timestamp
+
+    :return: Number of candles added and number of stored candles updated
+    :rtype: tuple[int, int]
+
+    :raises EncodingError: If candles do not fit the compact layout
+    """
+    encoded = await candle_layout.encode_values(session, values)
+    written = []
+    for first in range(0, len(encoded), UPSERT_ROWS):
+        stmt = pg_insert(candles).values(encoded[first:first + UPSERT_ROWS])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["symbol_id", "timestamp"],
+            set_={name: stmt.excluded[name] for name in CANDLE_FIELDS[1:]},
+            where=or_(*(candles.c[name] != stmt.excluded[name] for name in CANDLE_FIELDS[1:])),
+        )
+        # xmax is 0 for rows inserted by the statement, set for updated ones
+        stmt = stmt.returning(candles.c.symbol_id, candles.c.timestamp,
+                              literal_column("xmax = 0").label("inserted"))
+        result = await session.execute(stmt)
+        written.extend(result.fetchall())
+
+    changes = _record_ranges(written)
+    inserted = [(row.symbol_id, row.timestamp) for row in written if row.inserted]
+    if changes:
+        await versions.record_changes(session, changes)
+    if inserted:
+        await coverage.add_ranges(session, coverage.ranges_of(inserted))
+    await session.commit()
+
+    for symbol_id, (first, last) in changes.items():
+        await candle_cache.invalidate(symbol_id, first, last)
+    await tail_buffer.warm(session, changes)
+
+    return len(inserted), len(written) - len(inserted)
+
+
+def naive_utc(timestamp: datetime) -> datetime:
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+async def copy_candles(session, symbol_id: int, candles_data: list[dict]):
+    """
+    Bulk load candles with COPY into an unlogged staging table and merge them
+
+    :param session: SQLAlchemy session
+    :param symbol_id: Market symbol_id
+    :param candles_data: List of candles to insert
+
+    :return: Ingest report with rows copied, added, duplicates skipped and throughput
+    :rtype: dict
+    """
+    records = [
+        (
+            symbol_id,
+            naive_utc(candle["timestamp"]),
+            candle["open"],
+            candle["high"],
+            candle["low"],
+            candle["close"],
+            candle["volume"],
+        )
+        for candle in candles_data
+    ]
+    return await copy_candle_records(session, records)
+
+
+async def copy_candle_records(session, records: list[tuple]):
+    """
+    Bulk load candle records in a single transaction
+
+    The records are copied into a private unlogged staging table with asyncpg's
+    binary COPY, merged into candles with ON CONFLICT DO NOTHING and the staging
+    table is dropped again before the commit. Prices are encoded for the
+    compact layout when it is used (see app/compact.py).
+
+    :param session: SQLAlchemy session
+    :param records: Tuples ordered like CANDLE_COLUMNS, timestamps as naive UTC
+
+    :return: Ingest report with rows copied, added, duplicates skipped and throughput
+    :rtype: dict
+
+    :raises EncodingError: If candles do not fit the compact layout
+    """
+    started = time.perf_counter()
+    staging = f"candles_staging_{uuid.uuid4().hex}"
+    encoded = await candle_layout.encode_records(session, records)
+
+    await session.execute(text(
+        f"CREATE UNLOGGED TABLE {staging} (LIKE candles INCLUDING DEFAULTS)"))
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        staging, records=encoded,
+        columns=CANDLE_COLUMNS)
+
+    result = await session.execute(text(f"""
+        WITH inserted AS (
+            INSERT INTO candles ({", ".join(CANDLE_COLUMNS)})
+            SELECT {", ".join(CANDLE_COLUMNS)} FROM {staging}
+            ON CONFLICT (symbol_id, timestamp) DO NOTHING
+            RETURNING symbol_id, timestamp
+        )
+        {coverage.islands_sql("inserted")}
+    """), {"tolerance": coverage.tolerance()})
+    added_ranges: dict[int, list] = {}
+    for row in result:
+        added_ranges.setdefault(row.symbol_id, []).append(
+            (row.range_start, row.range_end, row.row_count))
+    added = sum(rows for ranges in added_ranges.values() for _, _, rows in ranges)
+    await session.execute(text(f"DROP TABLE {staging}"))
+    changes = _record_ranges(records)
+    if added:
+        await versions.record_changes(session, changes)
+        await coverage.add_ranges(session, added_ranges)
+    await session.commit()
+
+    for symbol_id, (first, last) in changes.items():
+        await candle_cache.invalidate(symbol_id, first, last)
+    await tail_buffer.warm(session, changes)
+
+    elapsed = time.perf_counter() - started
+    return {
+        "rows_copied": len(records),
+        "added_candles": added,
+        "duplicates_skipped": len(records) - added,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(len(records) / elapsed) if elapsed else None,
+    }
+
+
+def _record_ranges(records) -> dict[int, tuple[datetime, datetime]]:
+    """First and last timestamp per symbol of records starting with (symbol_id, timestamp)."""
+    ranges: dict[int, tuple[datetime, datetime]] = {}
+    for symbol_id, timestamp, *_ in records:
+        first, last = ranges.get(symbol_id, (timestamp, timestamp))
+        ranges[symbol_id] = (min(first, timestamp), max(last, timestamp))
+    return ranges
 
 
 async def get_candles(
-    session, symbol_id: int, timeframe: int,
+    session, symbol_id: int, timeframe: Union[int, str, Timeframe],
     _start_date: Optional[str] = None, _end_date: Optional[str] = None,
-    limit: Optional[int] = None
+    limit: Optional[int] = None, offset: int = 0
 ):
     """
     Get candles from the database
 
     :param session: SQLAlchemy session
     :param symbol_id: Market symbol_id
-    :param timeframe: Timeframe in minutes
+    :param timeframe: Timeframe in minutes or as a label such as H4, W1 or MN1
     :param start_date: Start date in ISO format (optional)
     :param end_date: End date in ISO format (optional)
     :param limit: Maximum number of candles to return (optional)
+    :param offset: Session offset in minutes (optional)
 
     :return: List of candles as dictionaries
     :rtype: list[dict]
+
+    :raises ValueError: If the timeframe cannot be parsed
     """
+    rows = await _fetch_candle_rows(
+        session, symbol_id, timeframe, _start_date, _end_date, limit, offset)
+    with stage("rows"):
+        return [dict(zip(CANDLE_FIELDS, row)) for row in rows]
 
-    sql = text("""
-        WITH RoundedCandles AS (
-            SELECT
-                date_trunc('day', timestamp) + INTERVAL '1 minute' * (
-                    ((EXTRACT(HOUR FROM timestamp)::integer * 60) + EXTRACT(MINUTE FROM timestamp)::integer) - 
-                    ((EXTRACT(HOUR FROM timestamp)::integer * 60 + EXTRACT(MINUTE FROM timestamp)::integer) % :timeframe)
-                ) AS rounded_timestamp,
-                open,
-                high,
-                low,
-                close,
-                volume,
-                ROW_NUMBER() OVER (
-                    PARTITION BY symbol_id, date_trunc('day', timestamp) + INTERVAL '1 minute' * (
-                        ((EXTRACT(HOUR FROM timestamp)::integer * 60) + EXTRACT(MINUTE FROM timestamp)::integer) - 
-                        ((EXTRACT(HOUR FROM timestamp)::integer * 60 + EXTRACT(MINUTE FROM timestamp)::integer) % :timeframe)
-                    )
-                    ORDER BY timestamp ASC
-                ) AS rn_asc,
-                ROW_NUMBER() OVER (
-                    PARTITION BY symbol_id, date_trunc('day', timestamp) + INTERVAL '1 minute' * (
-                        ((EXTRACT(HOUR FROM timestamp)::integer * 60) + EXTRACT(MINUTE FROM timestamp)::integer) - 
-                        ((EXTRACT(HOUR FROM timestamp)::integer * 60 + EXTRACT(MINUTE FROM timestamp)::integer) % :timeframe)
-                    )
-                    ORDER BY timestamp DESC
-                ) AS rn_desc
-            FROM candles
-            WHERE symbol_id = :symbol_id
-            AND (timestamp >= :start_date OR :start_date IS NULL)
-            AND (timestamp < :end_date OR :end_date IS NULL)
-        )
-        SELECT
-            rounded_timestamp AS timestamp,
-            MAX(open) FILTER (WHERE rn_asc = 1) AS open,
-            MAX(high) AS high,
-            MIN(low) AS low,
-            MAX(close) FILTER (WHERE rn_desc = 1) AS close,
-            SUM(volume) AS volume
-        FROM RoundedCandles
-        GROUP BY timestamp
-        ORDER BY timestamp {order_direction}
-        {limit_clause}
-    """.format(
-        order_direction="DESC" if limit else "ASC",
-        limit_clause="LIMIT :limit" if limit else ""
-    ))
 
+async def get_candle_columns(
+    session, symbol_id: int, timeframe: Union[int, str, Timeframe],
+    _start_date: Optional[str] = None, _end_date: Optional[str] = None,
+    limit: Optional[int] = None, offset: int = 0
+):
+    """
+    Get candles from the database as column arrays
+
+    Same parameters as get_candles. Timestamps are returned as epoch
+    milliseconds so the columns can be encoded without per-row objects.
+
+    :return: Column name to numpy array
+    :rtype: dict[str, numpy.ndarray]
+
+    :raises ValueError: If the timeframe cannot be parsed
+    """
+    rows = await _fetch_candle_rows(
+        session, symbol_id, timeframe, _start_date, _end_date, limit, offset, epoch_ms=True)
+    with stage("rows"):
+        return rows_to_columns(rows)
+
+
+def rows_to_columns(rows) -> dict:
+    """
+    Transpose candle rows with epoch millisecond timestamps into numpy columns
+
+    :rtype: dict[str, numpy.ndarray]
+    """
+    columns = list(zip(*rows)) or [()] * len(CANDLE_FIELDS)
+    return {
+        name: np.array(values, dtype=np.int64 if name == "timestamp" else np.float64)
+        for name, values in zip(CANDLE_FIELDS, columns)
+    }
+
+
+async def get_aligned_candles(
+    session, symbol_ids: list[int], timeframe: Union[int, str, Timeframe],
+    join: str = "outer", _start_date: Optional[str] = None, _end_date: Optional[str] = None,
+    limit: Optional[int] = None, offset: int = 0
+):
+    """
+    Get candles of several symbols aligned on a shared timestamp axis
+
+    All symbols are aggregated by one statement.
+
+    :param session: SQLAlchemy session
+    :param symbol_ids: Market symbol_ids, duplicates are ignored
+    :param timeframe: Timeframe in minutes or as a label such as H4, W1 or MN1
+    :param join: inner, outer or ffill, see aligned_candles_query
+    :param start_date: Start date in ISO format (optional)
+    :param end_date: End date in ISO format (optional)
+    :param limit: Maximum number of timestamps to return (optional)
+    :param offset: Session offset in minutes (optional)
+
+    :return: The timestamp axis and one entry per symbol with its market
+        fields and open/high/low/close/volume columns, None where missing
+    :rtype: dict
+
+    :raises ValueError: If the timeframe cannot be parsed
+    :raises LookupError: If a symbol_id does not exist
+    """
+    if not isinstance(timeframe, Timeframe):
+        timeframe = parse_timeframe(timeframe)
+    symbol_ids = list(dict.fromkeys(symbol_ids))
+
+    # Markets and their min_move come from the catalog, only markets it does
+    # not know yet are read from the database
+    found = {}
+    if market_catalog.loaded:
+        for symbol_id in symbol_ids:
+            market = market_catalog.by_id(symbol_id)
+            if market is not None:
+                found[symbol_id] = dict(market)
+    unresolved = [symbol_id for symbol_id in symbol_ids if symbol_id not in found]
+    if unresolved:
+        result = await session.execute(
+            select(markets).where(markets.c.symbol_id.in_(unresolved)))
+        found.update((row.symbol_id, dict(row._mapping)) for row in result)
+    missing = [symbol_id for symbol_id in symbol_ids if symbol_id not in found]
+    if missing:
+        raise LookupError(f"Unknown symbol_ids: {missing}")
+
+    start_date, end_date = _parse_range(_start_date, _end_date)
+
+    source = aggregates.select_source(timeframe, offset)
+    sql = aligned_candles_query(timeframe, source, join, start_date, end_date, limit, offset)
+    params = {
+        "symbol_ids": symbol_ids,
+        "symbol_count": len(symbol_ids),
+        "start_date": start_date,
+        "end_date": end_date,
+    }
+    if limit is not None:
+        params["limit"] = limit
+
+    result = await session.execute(sql, params)
+    rows = result.fetchall()
+
+    # Every symbol has one row per axis timestamp, grouped in request order
+    length = len(rows) // len(symbol_ids)
+    symbols = []
+    for index, symbol_id in enumerate(symbol_ids):
+        block = rows[index * length:(index + 1) * length]
+        values = list(zip(*block)) or [()] * len(CANDLE_COLUMNS)
+        columns = {
+            name: list(column) for name, column in zip(CANDLE_COLUMNS, values)
+            if name not in ("symbol_id", "timestamp")
+        }
+        columns = candle_layout.decode_columns(found[symbol_id]["min_move"], columns)
+        symbols.append({**found[symbol_id], **columns})
+
+    return {
+        "timeframe": timeframe.label,
+        "join": join,
+        "timestamp": [row.timestamp for row in rows[:length]],
+        "symbols": symbols,
+    }
+
+
+async def get_candle_page(
+    session, symbol_id: int, timeframe: Union[int, str, Timeframe], page_size: int,
+    cursor: Optional[PageCursor] = None, direction: Direction = "backward", offset: int = 0
+):
+    """
+    Get one page of candles using keyset pagination on (symbol_id, timestamp)
+
+    Without a cursor the first page starts at the newest (backward) or oldest
+    (forward) bucket. With a cursor the page continues from the bucket it
+    points at, in the cursor's direction.
+
+    :param session: SQLAlchemy session
+    :param symbol_id: Market symbol_id
+    :param timeframe: Timeframe in minutes or as a label such as H4, W1 or MN1
+    :param page_size: Maximum number of candles in the page
+    :param cursor: Continuation cursor from a previous page (optional)
+    :param direction: Direction of the first page when no cursor is given
+    :param offset: Session offset in minutes (optional)
+
+    :return: Candles oldest first, has_more, and the cursors continuing
+        in the same (next_cursor) and opposite (prev_cursor) direction
+    :rtype: dict
+
+    :raises ValueError: If the timeframe cannot be parsed or the cursor was
+        issued for another timeframe or offset
+    """
+    if not isinstance(timeframe, Timeframe):
+        timeframe = parse_timeframe(timeframe)
+
+    if cursor is not None:
+        if cursor.timeframe != timeframe.label or cursor.offset != offset:
+            raise ValueError("Cursor was issued for a different timeframe or offset")
+        direction = cursor.direction
+
+    source = aggregates.select_source(timeframe, offset)
+    # Upper bound of source rows per bucket; the scan has to cover the page
+    # plus the look-ahead bucket, and a partial bucket at the far edge forward
+    rows_per_bucket = timeframe.max_minutes // source.minutes
+    scan_buckets = page_size + (1 if direction == "backward" else 2)
+
+    sql = page_query(timeframe, source, direction, cursor is not None, offset)
+    params = {
+        "symbol_id": symbol_id,
+        "scan_rows": scan_buckets * rows_per_bucket,
+        "limit": page_size + 1,
+    }
+    if cursor is not None:
+        params["boundary"] = cursor.bucket
+
+    result = await session.execute(sql, params)
+    rows = result.fetchall()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == "backward":
+        rows.reverse()
+    candles = await candle_layout.decode_candles(
+        session, symbol_id, [dict(row._mapping) for row in rows])
+
+    next_cursor = encode_cursor(cursor) if cursor is not None else None
+    prev_cursor = None
+    if candles:
+        older = PageCursor("backward", candles[0]["timestamp"], timeframe.label, offset)
+        newer = PageCursor("forward", candles[-1]["timestamp"], timeframe.label, offset)
+        if direction == "backward":
+            next_cursor, prev_cursor = encode_cursor(older), encode_cursor(newer)
+        else:
+            next_cursor, prev_cursor = encode_cursor(newer), encode_cursor(older)
+
+    return {
+        "candles": candles,
+        "has_more": has_more,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+    }
+
+
+async def get_candle_changes(
+    session, symbol_id: int, timeframe: Union[int, str, Timeframe],
+    since: Optional[int] = None, since_time: Optional[str] = None, offset: int = 0
+):
+    """
+    Get the buckets affected by writes after a data version
+
+    Every written range is widened to whole buckets, including the partial
+    last bucket, and re-aggregated. Clients replace their candles within the
+    returned ranges with the returned candles and keep version as their new
+    watermark. reset means the changes cannot be replayed (all candles were
+    replaced, or the change log no longer reaches back to since) and the
+    history has to be reloaded.
+
+    :param session: SQLAlchemy session
+    :param symbol_id: Market symbol_id
+    :param timeframe: Timeframe in minutes or as a label such as H4, W1 or MN1
+    :param since: Data version the client has seen, e.g. from X-Data-Version
+    :param since_time: Alternatively, the time of the client's last sync in ISO format
+    :param offset: Session offset in minutes (optional)
+
+    :return: version, reset, ranges and candles oldest first
+    :rtype: dict
+
+    :raises ValueError: If the timeframe or since_time cannot be parsed
+    """
+    if not isinstance(timeframe, Timeframe):
+        timeframe = parse_timeframe(timeframe)
+
+    if since is None:
+        synced_at = datetime.fromisoformat(since_time) if since_time else datetime.min
+        if synced_at.tzinfo is None:
+            synced_at = synced_at.replace(tzinfo=timezone.utc)
+        since = await versions.version_at(session, symbol_id, synced_at) or 0
+
+    state, changes = await versions.get_changes(session, symbol_id, since)
+    reset = state is None or since < state["changes_floor"] \
+        or any(change.min_ts is None for change in changes)
+
+    ranges = []
+    if not reset:
+        for change in sorted(changes, key=lambda change: change.min_ts):
+            start = bucket_start(timeframe, change.min_ts, offset)
+            end = next_bucket(timeframe, bucket_start(timeframe, change.max_ts, offset), offset)
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+
+    candles_changed = []
+    for start, end in ranges:
+        candles_changed += await get_candles(
+            session, symbol_id, timeframe, start.isoformat(), end.isoformat(), offset=offset)
+
+    return {
+        "symbol_id": symbol_id,
+        "timeframe": timeframe.label,
+        "since": since,
+        "version": state["version"] if state else None,
+        "reset": reset,
+        "ranges": [{"start": start, "end": end} for start, end in ranges],
+        "candles": candles_changed,
+    }
+
+
+async def stream_candle_rows(
+    session, symbol_id: int, timeframe: Union[int, str, Timeframe],
+    _start_date: Optional[str] = None, _end_date: Optional[str] = None,
+    limit: Optional[int] = None, offset: int = 0,
+    epoch_ms: bool = False, batch_rows: int = 10000
+):
+    """
+    Stream candles from a server-side cursor in batches, oldest first
+
+    Same parameters as get_candles. Only one batch is held in memory at a
+    time; the session must stay open until the iterator is exhausted.
+
+    :param epoch_ms: Return timestamps as epoch milliseconds
+    :param batch_rows: Rows fetched from the cursor per batch
+
+    :return: Async iterator of row batches
+    :rtype: AsyncIterator[list[Row]]
+
+    :raises ValueError: If the timeframe cannot be parsed
+    """
+    if not isinstance(timeframe, Timeframe):
+        timeframe = parse_timeframe(timeframe)
+    start_date, end_date = _parse_range(_start_date, _end_date)
+
+    sql, params = _candles_statement(
+        symbol_id, timeframe, start_date, end_date, limit, offset, epoch_ms)
+    if limit is not None:
+        sql = oldest_first(sql)
+
+    result = await session.stream(sql, params)
+    async for rows in result.partitions(batch_rows):
+        yield await candle_layout.decode_rows(session, symbol_id, rows)
+
+
+def _parse_range(_start_date: Optional[str], _end_date: Optional[str]):
     start_date = datetime.fromisoformat(_start_date) if _start_date else None
     end_date = datetime.fromisoformat(_end_date) if _end_date else None
+    return start_date, end_date
+
+
+def _candles_statement(
+    symbol_id: int, timeframe: Timeframe,
+    start_date: Optional[datetime], end_date: Optional[datetime],
+    limit: Optional[int], offset: int, epoch_ms: bool
+):
+    source = aggregates.select_source(timeframe, offset)
     params = {
         "symbol_id": symbol_id,
-        "timeframe": timeframe,
         "start_date": start_date,
         "end_date": end_date,
     }
@@ -215,26 +724,130 @@ async def get_candles(
     if limit is not None:
         params["limit"] = limit
 
+    if limit is not None and start_date is None:
+        # Latest N bars: bound the scan instead of aggregating the whole history
+        sql = tail_query(timeframe, source, end_date, offset, epoch_ms)
+        params["scan_rows"] = tail_scan_rows(timeframe, source, limit)
+    else:
+        sql = candles_query(timeframe, source, start_date, end_date, limit, offset, epoch_ms)
+
+    return sql, params
+
+
+async def _fetch_candle_rows(
+    session, symbol_id: int, timeframe: Union[int, str, Timeframe],
+    _start_date: Optional[str], _end_date: Optional[str],
+    limit: Optional[int], offset: int, epoch_ms: bool = False
+):
+    if not isinstance(timeframe, Timeframe):
+        timeframe = parse_timeframe(timeframe)
+    start_date, end_date = _parse_range(_start_date, _end_date)
+
+    if candle_cache.cacheable(timeframe, offset, start_date, end_date):
+        async def load(block_start: datetime, block_end: datetime):
+            sql, params = _candles_statement(
+                symbol_id, timeframe, block_start, block_end, None, offset, epoch_ms=True)
+            result = await session.execute(sql, params)
+            return result.fetchall()
+
+        rows = await candle_cache.get_rows(
+            symbol_id, timeframe, offset, start_date, end_date, load)
+        if limit is not None:
+            rows = rows[-limit:] if limit > 0 else []
+        rows = await candle_layout.decode_rows(session, symbol_id, rows)
+        if not epoch_ms:
+            rows = [(from_epoch_ms(row[0]), *row[1:]) for row in rows]
+        return rows
+
+    if tail_buffer.serves(limit, start_date, end_date):
+        rows = await tail_buffer.get_rows(session, symbol_id, timeframe, offset, limit)
+        rows = await candle_layout.decode_rows(session, symbol_id, rows)
+        if not epoch_ms:
+            rows = [(from_epoch_ms(row[0]), *row[1:]) for row in rows]
+        return rows
+
+    if candle_cache.enabled:
+        candle_cache.bypassed += 1
+
+    sql, params = _candles_statement(
+        symbol_id, timeframe, start_date, end_date, limit, offset, epoch_ms)
+
     result = await session.execute(sql, params)
     rows = result.fetchall()
 
     if limit is not None:
         rows = list(reversed(rows))
 
-    return [dict(row._mapping) for row in rows]
+    return await candle_layout.decode_rows(session, symbol_id, rows)
 
 
-async def delete_candles(session, symbol_id: int):
+async def delete_candles(
+    session, symbol_id: int, _start_date: Optional[str] = None, _end_date: Optional[str] = None
+):
     """
-    Delete all candles for a given symbol_id
+    Delete the candles of a symbol_id, all of them or those in a time range
+
+    The delete runs as one statement; use app.retention.delete_candles_in_batches
+    for large ranges.
 
     :param session: SQLAlchemy session
     :param symbol_id: Market symbol_id
+    :param start_date: Inclusive start date in ISO format (optional)
+    :param end_date: Exclusive end date in ISO format (optional)
 
     :return: Number of candles deleted
     :rtype: int
     """
+    start_date, end_date = _parse_range(_start_date, _end_date)
+    if start_date is not None or end_date is not None:
+        return await delete_candle_range(session, symbol_id, start_date, end_date)
+
     stmt = delete(candles).where(candles.c.symbol_id == symbol_id)
     result = await session.execute(stmt)
+    if result.rowcount:
+        await versions.record_changes(session, {symbol_id: None})
+        await coverage.rebuild_ranges(session, symbol_id)
     await session.commit()
+    await candle_cache.invalidate(symbol_id)
+    tail_buffer.discard(symbol_id)
     return result.rowcount
+
+
+async def delete_candle_range(
+    session, symbol_id: int, start_date: Optional[datetime], end_date: Optional[datetime],
+    update_coverage: bool = True
+):
+    """
+    Delete the candles of a symbol_id in a time range and commit
+
+    The deleted range is logged as a change, so delta sync and buffered bars
+    only re-aggregate the affected buckets.
+
+    :param session: SQLAlchemy session
+    :param symbol_id: Market symbol_id
+    :param start_date: Inclusive lower bound, None for unbounded
+    :param end_date: Exclusive upper bound, None for unbounded
+    :param update_coverage: Rebuild the affected coverage ranges; callers
+        deleting many ranges in a row can rebuild once at the end instead
+
+    :return: Number of candles deleted
+    :rtype: int
+    """
+    result = await session.execute(text(f"""
+        WITH deleted AS (
+            DELETE FROM candles
+            WHERE symbol_id = :symbol_id{time_conditions(start_date, end_date)}
+            RETURNING timestamp
+        )
+        SELECT count(*) AS deleted, min(timestamp) AS first, max(timestamp) AS last
+        FROM deleted
+    """), {"symbol_id": symbol_id, "start_date": start_date, "end_date": end_date})
+    row = result.one()
+    if row.deleted:
+        await versions.record_changes(session, {symbol_id: (row.first, row.last)})
+        if update_coverage:
+            await coverage.rebuild_ranges(session, symbol_id, row.first, row.last)
+    await session.commit()
+    if row.deleted:
+        await candle_cache.invalidate(symbol_id, row.first, row.last)
+    return row.deleted
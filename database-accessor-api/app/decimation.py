@@ -0,0 +1,102 @@
+# app/decimation.py
+"""
+Decimation of candle columns to a point budget for zoomed-out charts.
+
+Both methods split the series into consecutive buckets of about equal bar
+counts, one per point (pixel column) of the budget:
+
+- ``minmax`` merges the bars of a bucket into one candle: first open, highest
+  high, lowest low, last close and summed volume, timestamped at the first
+  bar. The envelope of the series is kept exactly, every extreme stays visible.
+- ``lttb`` (Largest Triangle Three Buckets) keeps one original bar per bucket,
+  the one whose close forms the largest triangle with the bar kept in the
+  previous bucket and the average of the next one. The first and last bars
+  are always kept. Suited to line charts of the close.
+
+Columns are numpy arrays as returned by crud.get_candle_columns; series that
+already fit the budget are returned unchanged.
+"""
+import numpy as np
+
+from app.cache import from_epoch_ms
+
+METHODS = ("minmax", "lttb")
+
+
+def decimate(columns: dict, max_points: int, method: str = "minmax") -> dict:
+    """
+    Reduce candle columns to at most max_points bars
+
+    :param columns: Column name to numpy array, timestamps as epoch milliseconds
+    :param max_points: Point budget, at least 3
+    :param method: minmax or lttb
+
+    :return: Decimated columns
+    :rtype: dict[str, numpy.ndarray]
+
+    :raises ValueError: If the method is unknown or the budget below 3
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown decimation method: {method}")
+    if max_points < 3:
+        raise ValueError("max_points must be at least 3")
+    if len(columns["timestamp"]) <= max_points:
+        return columns
+    if method == "lttb":
+        return {name: values[lttb_indexes(columns, max_points)]
+                for name, values in columns.items()}
+    return minmax(columns, max_points)
+
+
+def minmax(columns: dict, max_points: int) -> dict:
+    """Merge the bars of each of max_points buckets into one candle."""
+    length = len(columns["timestamp"])
+    starts = np.linspace(0, length, max_points + 1).astype(np.int64)[:-1]
+    ends = np.append(starts[1:], length)
+    return {
+        "timestamp": columns["timestamp"][starts],
+        "open": columns["open"][starts],
+        "high": np.maximum.reduceat(columns["high"], starts),
+        "low": np.minimum.reduceat(columns["low"], starts),
+        "close": columns["close"][ends - 1],
+        "volume": np.add.reduceat(columns["volume"], starts),
+    }
+
+
+def lttb_indexes(columns: dict, max_points: int) -> np.ndarray:
+    """Indexes of the bars LTTB keeps on the close, oldest first."""
+    x = columns["timestamp"].astype(np.float64)
+    y = columns["close"]
+    length = len(x)
+    # Inner buckets between the fixed first and last bar
+    edges = (np.arange(max_points - 1) * (length - 2) / (max_points - 2)).astype(np.int64) + 1
+    edges[-1] = length - 1
+
+    # Averages of the next bucket, the last bar for the last inner bucket
+    counts = np.diff(edges)
+    x_next = np.append(np.add.reduceat(x[1:-1], edges[:-1] - 1) / counts, x[-1])[1:]
+    y_next = np.append(np.add.reduceat(y[1:-1], edges[:-1] - 1) / counts, y[-1])[1:]
+
+    indexes = np.empty(max_points, dtype=np.int64)
+    indexes[0], indexes[-1] = 0, length - 1
+    kept = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Twice the triangle area, the constant factor does not change the argmax
+        areas = np.abs(
+            (x[kept] - x_next[bucket]) * (y[start:end] - y[kept])
+            - (x[kept] - x[start:end]) * (y_next[bucket] - y[kept])
+        )
+        kept = start + int(np.argmax(areas))
+        indexes[bucket + 1] = kept
+    return indexes
+
+
+def columns_to_candles(columns: dict) -> list[dict]:
+    """Candle dicts like crud.get_candles from columns with epoch millisecond timestamps."""
+    fields = [name for name in columns if name != "timestamp"]
+    return [
+        {"timestamp": from_epoch_ms(timestamp), **dict(zip(fields, values))}
+        for timestamp, *values in zip(
+            columns["timestamp"].tolist(), *(columns[name].tolist() for name in fields))
+    ]
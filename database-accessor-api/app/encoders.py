@@ -0,0 +1,209 @@
+# app/encoders.py
+"""
+Binary columnar encodings for candle responses.
+
+Clients opt in through the Accept header. Columns are sent as contiguous
+arrays with epoch millisecond timestamps, so decoding is a memory copy
+instead of parsing one JSON object per candle:
+
+- ``application/vnd.apache.arrow.stream``: Arrow IPC stream (needs pyarrow)
+- ``application/x-npz``: uncompressed ``numpy.savez`` archive, one array per column
+
+Streamed responses (``stream=true``) are written batch by batch as an Arrow
+IPC stream or as NDJSON, one candle per line.
+"""
+import io
+import json
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+NPZ = "application/x-npz"
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+
+
+def binary_media_types() -> list[str]:
+    """Binary media types this server can produce, in order of preference."""
+    if pa is None:
+        return [NPZ]
+    return [ARROW_STREAM, NPZ]
+
+
+def _parse_accept(accept: str) -> list[tuple[str, float]]:
+    media_ranges = []
+    for part in accept.split(","):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        if not media_type:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        media_ranges.append((media_type.lower(), quality))
+    return media_ranges
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """
+    Pick a binary encoding from an Accept header
+
+    Only explicitly listed binary types are considered, wildcards keep the
+    JSON default so existing clients are unaffected.
+
+    :param accept: Value of the Accept header
+
+    :return: The binary media type to respond with, or None for JSON
+    :rtype: Optional[str]
+    """
+    if not accept:
+        return None
+
+    available = binary_media_types()
+    best, best_quality = None, 0.0
+    for media_type, quality in _parse_accept(accept):
+        if media_type == JSON and quality >= best_quality:
+            best, best_quality = None, quality
+        elif media_type in available and quality > best_quality:
+            best, best_quality = media_type, quality
+    return best
+
+
+def negotiate_stream(accept: Optional[str]) -> str:
+    """
+    Pick the encoding of a streamed response, Arrow when asked for, else NDJSON
+
+    :rtype: str
+    """
+    if pa is not None and accept:
+        if any(media_type == ARROW_STREAM and quality > 0
+               for media_type, quality in _parse_accept(accept)):
+            return ARROW_STREAM
+    return NDJSON
+
+
+def arrow_schema():
+    return pa.schema([
+        ("timestamp", pa.timestamp("ms")),
+        ("open", pa.float64()),
+        ("high", pa.float64()),
+        ("low", pa.float64()),
+        ("close", pa.float64()),
+        ("volume", pa.float64()),
+    ])
+
+
+def arrow_batch(columns: dict):
+    """
+    Build an Arrow record batch from candle columns
+
+    :param columns: Column name to numpy array, timestamps as epoch milliseconds
+
+    :rtype: pyarrow.RecordBatch
+    """
+    schema = arrow_schema()
+    arrays = [
+        pa.array(columns[field.name].view("datetime64[ms]"), type=field.type)
+        if field.name == "timestamp" else pa.array(columns[field.name], type=field.type)
+        for field in schema
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def encode_columns(columns: dict, media_type: str) -> bytes:
+    """
+    Encode candle columns in the negotiated binary format
+
+    :param columns: Column name to numpy array, timestamps as epoch milliseconds
+    :param media_type: One of the types returned by negotiate()
+
+    :return: Encoded response body
+    :rtype: bytes
+    """
+    buffer = io.BytesIO()
+    if media_type == ARROW_STREAM:
+        batch = arrow_batch(columns)
+        with pa.ipc.new_stream(buffer, batch.schema) as writer:
+            writer.write_batch(batch)
+    elif media_type == NPZ:
+        np.savez(buffer, **columns)
+    else:
+        raise ValueError(f"Unsupported media type: {media_type}")
+    return buffer.getvalue()
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_json(content) -> bytes:
+    """Encode like FastAPI's JSONResponse, for responses built outside of it."""
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+        default=_json_default,
+    ).encode()
+
+
+def _drain(buffer: io.BytesIO) -> bytes:
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+
+async def arrow_stream_chunks(column_batches):
+    """
+    Encode batches of candle columns as one Arrow IPC stream
+
+    Yields the schema first, then one record batch per input batch, so the
+    first bytes go out before the query has finished.
+
+    :param column_batches: Async iterator of column dicts
+
+    :rtype: AsyncIterator[bytes]
+    """
+    buffer = io.BytesIO()
+    writer = pa.ipc.new_stream(buffer, arrow_schema())
+    yield _drain(buffer)
+    async for columns in column_batches:
+        writer.write_batch(arrow_batch(columns))
+        yield _drain(buffer)
+    writer.close()
+    yield _drain(buffer)
+
+
+async def ndjson_chunks(row_batches):
+    """
+    Encode batches of candle rows as NDJSON, one object per line
+
+    Objects have the same fields and timestamp format as the JSON response.
+
+    :param row_batches: Async iterator of row batches
+
+    :rtype: AsyncIterator[bytes]
+    """
+    async for rows in row_batches:
+        yield "".join(
+            json.dumps({
+                "timestamp": timestamp.isoformat(),
+                "open": open_,
+                "high": high,
+                "low": low,
+                "close": close,
+                "volume": volume,
+            }) + "\n"
+            for timestamp, open_, high, low, close, volume in rows
+        ).encode()
@@ -0,0 +1,404 @@
+# app/ingest.py
+"""
+Streaming candle ingest from NDJSON, CSV or Arrow IPC request bodies.
+
+The body is parsed incrementally into fixed-size column chunks which are
+validated with vectorized checks and written chunk by chunk, so memory use
+is bounded by the chunk size instead of the upload size.
+"""
+import asyncio
+import csv
+import io
+import json
+import queue
+import time
+import warnings
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from itertools import repeat
+from typing import AsyncIterator, Optional
+
+import numpy as np
+
+from app import crud
+from app.compact import EncodingError
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # optional dependency
+    pa = None
+
+PRICE_FIELDS = ("open", "high", "low", "close")
+FIELDS = ("timestamp", *PRICE_FIELDS, "volume")
+
+NDJSON = "ndjson"
+CSV = "csv"
+ARROW = "arrow"
+
+MEDIA_TYPES = {
+    "application/x-ndjson": NDJSON,
+    "application/jsonl": NDJSON,
+    "application/json-seq": NDJSON,
+    "text/csv": CSV,
+    "application/vnd.apache.arrow.stream": ARROW,
+}
+
+
+class IngestError(ValueError):
+    def __init__(self, message: str, row: Optional[int] = None, reason: Optional[str] = None):
+        super().__init__(message)
+        self.row = row
+        self.reason = reason
+        self.report: Optional[dict] = None
+
+
+@dataclass
+class CandleChunk:
+    timestamp: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    def take(self, mask: np.ndarray) -> "CandleChunk":
+        return CandleChunk(*(getattr(self, field)[mask] for field in FIELDS))
+
+    def records(self, symbol_id: int) -> list[tuple]:
+        """Rows ordered like crud.CANDLE_COLUMNS, timestamps as naive UTC datetimes."""
+        return list(zip(
+            repeat(symbol_id),
+            self.timestamp.astype("datetime64[us]").tolist(),
+            self.open.tolist(),
+            self.high.tolist(),
+            self.low.tolist(),
+            self.close.tolist(),
+            self.volume.tolist(),
+        ))
+
+
+def detect_format(content_type: Optional[str]) -> str:
+    """
+    Map a request content type to an ingest format
+
+    :raises IngestError: If the content type is not supported
+    """
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type not in MEDIA_TYPES:
+        raise IngestError(
+            f"Unsupported content type '{media_type}', use one of {sorted(MEDIA_TYPES)}")
+    if MEDIA_TYPES[media_type] == ARROW and pa is None:
+        raise IngestError("Arrow ingest requires pyarrow to be installed")
+    return MEDIA_TYPES[media_type]
+
+
+def parse_timestamps(values) -> np.ndarray:
+    """
+    Convert ISO strings or epoch seconds/milliseconds to datetime64[us] in UTC
+
+    :raises IngestError: If a timestamp cannot be parsed
+    """
+    array = np.asarray(values)
+    if array.dtype.kind == "M":
+        return array.astype("datetime64[us]")
+    if array.dtype.kind in "iuf":
+        if not np.isfinite(array).all():
+            raise IngestError("Timestamps must not be empty", reason="timestamp")
+        unit = "ms" if len(array) and np.abs(array).max() > 1e11 else "s"
+        return array.astype("int64").astype(f"datetime64[{unit}]").astype("datetime64[us]")
+
+    strings = array.astype(str)
+    epochs = np.char.isdigit(strings)
+    if epochs.all():
+        return parse_timestamps(strings.astype("int64"))
+
+    parsed = np.empty(len(strings), dtype="datetime64[us]")
+    if epochs.any():
+        parsed[epochs] = parse_timestamps(strings[epochs].astype("int64"))
+    isoformat = np.char.replace(np.char.replace(strings[~epochs], "Z", ""), "+00:00", "")
+    try:
+        # numpy only warns about UTC offsets, let those take the slow path
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            parsed[~epochs] = isoformat.astype("datetime64[us]")
+    except (ValueError, UserWarning, DeprecationWarning):
+        try:
+            parsed[~epochs] = [_utc(datetime.fromisoformat(value))
+                               for value in strings[~epochs]]
+        except ValueError as exc:
+            raise IngestError(f"Invalid timestamp: {exc}", reason="timestamp") from exc
+    return parsed
+
+
+def _utc(timestamp: datetime) -> datetime:
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _to_chunk(columns: dict) -> CandleChunk:
+    try:
+        prices = {
+            field: np.asarray(columns[field], dtype=np.float64)
+            for field in (*PRICE_FIELDS, "volume")
+        }
+        timestamps = columns["timestamp"]
+    except KeyError as exc:
+        raise IngestError(f"Missing column {exc}", reason="schema") from exc
+    except (TypeError, ValueError) as exc:
+        raise IngestError(f"Invalid number: {exc}", reason="number") from exc
+    return CandleChunk(timestamp=parse_timestamps(timestamps), **prices)
+
+
+def validate_chunk(
+    chunk: CandleChunk, previous_timestamp: Optional[np.datetime64], row_offset: int,
+    drop_invalid: bool
+) -> tuple[CandleChunk, dict]:
+    """
+    Validate a chunk with vectorized column checks
+
+    Checks finite values, positive prices and non-negative volume, OHLC
+    consistency and strictly increasing timestamps, also across chunks.
+
+    :param chunk: Parsed candles
+    :param previous_timestamp: Last timestamp of the previous chunk
+    :param row_offset: Index of the first row of the chunk within the upload
+    :param drop_invalid: Drop invalid rows instead of rejecting the upload
+
+    :return: The valid rows and the number of rows failing each check
+    :rtype: tuple[CandleChunk, dict]
+
+    :raises IngestError: If a row is invalid and drop_invalid is False
+    """
+    prices = np.vstack([chunk.open, chunk.high, chunk.low, chunk.close])
+    checks = {
+        "not_finite": np.isfinite(prices).all(axis=0) & np.isfinite(chunk.volume),
+        "negative": (prices > 0).all(axis=0) & (chunk.volume >= 0),
+        "ohlc": (
+            (chunk.high >= np.maximum(chunk.open, chunk.close))
+            & (chunk.low <= np.minimum(chunk.open, chunk.close))
+        ),
+    }
+    valid = np.logical_and.reduce(list(checks.values()))
+    invalid = {reason: int((~mask).sum()) for reason, mask in checks.items()}
+
+    timestamps = chunk.timestamp.astype("int64")
+    start = np.iinfo(np.int64).min if previous_timestamp is None else \
+        previous_timestamp.astype("datetime64[us]").astype("int64")
+    if drop_invalid:
+        timestamps = np.where(valid, timestamps, np.iinfo(np.int64).min)
+    running_max = np.maximum.accumulate(np.concatenate(([start], timestamps)))[:-1]
+    monotonic = timestamps > running_max
+    invalid["not_increasing"] = int((valid & ~monotonic).sum())
+    valid &= monotonic
+
+    if not drop_invalid and not valid.all():
+        row = int(np.argmin(valid))
+        reason = next(
+            (name for name, mask in {**checks, "not_increasing": monotonic}.items()
+             if not mask[row]),
+            "invalid",
+        )
+        raise IngestError(f"Invalid candle at row {row_offset + row}: {reason}",
+                          row=row_offset + row, reason=reason)
+
+    return chunk.take(valid), {reason: count for reason, count in invalid.items() if count}
+
+
+async def iter_lines(body: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    remainder = b""
+    async for part in body:
+        lines = (remainder + part).split(b"\n")
+        remainder = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line.decode()
+    if remainder.strip():
+        yield remainder.decode()
+
+
+async def iter_ndjson_chunks(body: AsyncIterator[bytes], chunk_rows: int):
+    rows = []
+    async for line in iter_lines(body):
+        try:
+            rows.append(json.loads(line))
+        except json.JSONDecodeError as exc:
+            raise IngestError(f"Invalid JSON line: {exc}", reason="format") from exc
+        if len(rows) >= chunk_rows:
+            yield _rows_to_chunk(rows)
+            rows = []
+    if rows:
+        yield _rows_to_chunk(rows)
+
+
+def _rows_to_chunk(rows: list[dict]) -> CandleChunk:
+    try:
+        return _to_chunk({field: [row[field] for row in rows] for field in FIELDS})
+    except KeyError as exc:
+        raise IngestError(f"Missing field {exc}", reason="schema") from exc
+
+
+async def iter_csv_chunks(body: AsyncIterator[bytes], chunk_rows: int):
+    header = None
+    lines = []
+    async for line in iter_lines(body):
+        if header is None:
+            header = [name.strip().lower() for name in next(csv.reader([line]))]
+            continue
+        lines.append(line)
+        if len(lines) >= chunk_rows:
+            yield _csv_to_chunk(header, lines)
+            lines = []
+    if lines:
+        yield _csv_to_chunk(header, lines)
+
+
+def _csv_to_chunk(header: list[str], lines: list[str]) -> CandleChunk:
+    columns = list(zip(*csv.reader(lines)))
+    if len(columns) != len(header):
+        raise IngestError("CSV rows do not match the header", reason="format")
+    return _to_chunk(dict(zip(header, columns)))
+
+
+class _QueueReader(io.RawIOBase):
+    """Blocking file object fed with body parts from the event loop."""
+
+    def __init__(self, parts: queue.Queue):
+        super().__init__()
+        self._parts = parts
+        self._buffer = bytearray()
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        # Arrow treats short reads as end of stream, so block until size bytes
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            part = self._parts.get()
+            if part is None:
+                self._eof = True
+            else:
+                self._buffer += part
+        size = len(self._buffer) if size < 0 else min(size, len(self._buffer))
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _read_next_batch(reader):
+    try:
+        return reader.read_next_batch()
+    except StopIteration:
+        return None
+
+
+async def iter_arrow_chunks(body: AsyncIterator[bytes], chunk_rows: int):
+    parts: queue.Queue = queue.Queue(maxsize=8)
+
+    async def feed():
+        try:
+            async for part in body:
+                if part:
+                    await asyncio.to_thread(parts.put, part)
+        finally:
+            await asyncio.to_thread(parts.put, None)
+
+    feeder = asyncio.create_task(feed())
+    try:
+        try:
+            reader = await asyncio.to_thread(pa.ipc.open_stream, _QueueReader(parts))
+            while (batch := await asyncio.to_thread(_read_next_batch, reader)) is not None:
+                for start in range(0, batch.num_rows, chunk_rows):
+                    columns = batch.slice(start, chunk_rows)
+                    yield _to_chunk({
+                        name: columns.column(name).to_numpy(zero_copy_only=False)
+                        for name in columns.schema.names
+                    })
+        except pa.ArrowInvalid as exc:
+            raise IngestError(f"Invalid Arrow stream: {exc}", reason="format") from exc
+    finally:
+        feeder.cancel()
+        while not parts.empty():
+            parts.get_nowait()
+        parts.put_nowait(None)
+
+
+def iter_chunks(body: AsyncIterator[bytes], ingest_format: str, chunk_rows: int):
+    """
+    Parse a streamed request body into candle chunks of at most chunk_rows rows
+
+    :param body: Request body parts
+    :param ingest_format: One of NDJSON, CSV, ARROW
+    :param chunk_rows: Maximum rows per chunk
+    """
+    if ingest_format == ARROW:
+        return iter_arrow_chunks(body, chunk_rows)
+    if ingest_format == CSV:
+        return iter_csv_chunks(body, chunk_rows)
+    return iter_ndjson_chunks(body, chunk_rows)
+
+
+async def ingest_stream(session, symbol_id: int, chunks, drop_invalid: bool = False) -> dict:
+    """
+    Validate and write streamed candle chunks, committing chunk by chunk
+
+    :param session: SQLAlchemy session
+    :param symbol_id: Market symbol_id
+    :param chunks: Async iterator of CandleChunk, see iter_chunks
+    :param drop_invalid: Drop invalid rows instead of rejecting the upload
+
+    :return: Ingest report
+    :rtype: dict
+
+    :raises IngestError: On malformed input or, unless dropping, invalid rows.
+        Chunks before the failing one are already committed, see the report
+        attached to the error.
+    """
+    started = time.perf_counter()
+    report = {
+        "rows_received": 0,
+        "rows_invalid": 0,
+        "added_candles": 0,
+        "duplicates_skipped": 0,
+        "chunks": 0,
+        "invalid": {},
+    }
+    previous_timestamp = None
+
+    try:
+        async for chunk in chunks:
+            valid, invalid = validate_chunk(
+                chunk, previous_timestamp, report["rows_received"], drop_invalid)
+            report["rows_received"] += len(chunk)
+            report["rows_invalid"] += len(chunk) - len(valid)
+            for reason, count in invalid.items():
+                report["invalid"][reason] = report["invalid"].get(reason, 0) + count
+
+            if len(valid):
+                previous_timestamp = valid.timestamp[-1]
+                try:
+                    written = await crud.copy_candle_records(session, valid.records(symbol_id))
+                except EncodingError as exc:
+                    raise IngestError(str(exc), row=report["rows_received"] - len(chunk),
+                                      reason="not_compact") from exc
+                report["added_candles"] += written["added_candles"]
+                report["duplicates_skipped"] += written["duplicates_skipped"]
+            report["chunks"] += 1
+    except IngestError as exc:
+        exc.report = report
+        raise
+
+    elapsed = time.perf_counter() - started
+    report["seconds"] = round(elapsed, 3)
+    report["rows_per_sec"] = round(report["rows_received"] / elapsed) if elapsed else None
+    return report
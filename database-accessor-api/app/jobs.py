@@ -0,0 +1,113 @@
+# app/jobs.py
+"""
+Background jobs with status reporting.
+
+Long running maintenance such as large deletes runs as an asyncio task in
+the worker that received the request, so the API call returns right away
+with a job id to poll at /jobs/{job_id}. The newest JOBS_HISTORY finished
+jobs are kept. Jobs are not persisted: running jobs are cancelled on
+shutdown and each worker only knows its own jobs.
+"""
+import asyncio
+import logging
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+from app import settings
+
+log = logging.getLogger(__name__)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    params: dict
+    # pending, running, done, failed or cancelled
+    status: str = "pending"
+    progress: dict = field(default_factory=dict)
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=_now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+JobFunction = Callable[[Job], Awaitable[dict]]
+
+
+class JobRunner:
+    def __init__(self, history: int):
+        self.history = history
+        self._jobs: dict[str, Job] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def submit(self, kind: str, params: dict, run: JobFunction) -> Job:
+        """
+        Start a job in the background
+
+        :param kind: Job type, e.g. delete_candles
+        :param params: Parameters reported with the job status
+        :param run: Coroutine function doing the work; it may update
+            job.progress and returns the job result
+
+        :rtype: Job
+        """
+        job = Job(uuid.uuid4().hex, kind, params)
+        self._jobs[job.id] = job
+        self._tasks[job.id] = asyncio.create_task(self._run(job, run))
+        self._trim()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> list[Job]:
+        return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    async def shutdown(self):
+        """Cancel running jobs and wait for them to stop."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job: Job, run: JobFunction):
+        job.status = "running"
+        job.started_at = _now()
+        try:
+            job.result = await run(job)
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as exc:
+            log.exception("Job %s (%s) failed", job.id, job.kind)
+            job.status = "failed"
+            job.error = str(exc)
+        finally:
+            job.finished_at = _now()
+            self._tasks.pop(job.id, None)
+            self._trim()
+
+    def _trim(self):
+        finished = [job for job in self._jobs.values() if job.finished]
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:max(len(finished) - self.history, 0)]:
+            del self._jobs[job.id]
+
+
+jobs = JobRunner(settings.JOBS_HISTORY)
@@ -0,0 +1,63 @@
+# app/pagination.py
+"""
+Opaque continuation cursors for keyset pagination of candles.
+
+A cursor records the bucket a page stopped at and which side of it the next
+page lies on, together with the timeframe and session offset it was issued
+for. It is sent to clients as URL-safe base64 JSON.
+"""
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Literal
+
+Direction = Literal["backward", "forward"]
+
+
+@dataclass(frozen=True)
+class PageCursor:
+    # Buckets strictly before (backward) or after (forward) this bucket
+    direction: Direction
+    bucket: datetime
+    timeframe: str
+    offset: int = 0
+
+
+def encode_cursor(cursor: PageCursor) -> str:
+    payload = {
+        "d": cursor.direction,
+        "b": cursor.bucket.isoformat(),
+        "tf": cursor.timeframe,
+        "o": cursor.offset,
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(value: str) -> PageCursor:
+    """
+    Decode a cursor returned by encode_cursor
+
+    :param value: Opaque cursor string
+
+    :rtype: PageCursor
+
+    :raises ValueError: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+        payload = json.loads(raw)
+        cursor = PageCursor(
+            direction=payload["d"],
+            bucket=datetime.fromisoformat(payload["b"]),
+            timeframe=payload["tf"],
+            offset=int(payload["o"]),
+        )
+    except (binascii.Error, UnicodeDecodeError, TypeError, KeyError, ValueError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+    if cursor.direction not in ("backward", "forward"):
+        raise ValueError("Invalid cursor")
+    return cursor
@@ -0,0 +1,455 @@
+# app/persister.py
+"""
+Persisters of live market data published to Redis streams.
+
+broker-service publishes live bars to candles:{account_id}:{symbol}:{timeframe}
+and ticks to ticks:{account_id}:{symbol}. Each persister reads its streams
+through a consumer group (one consumer per worker), so every entry is handled
+by one worker only. The candle persister (CANDLE_PERSISTER) reads the M1
+streams, higher timeframes are aggregated from the 1 minute candles; the tick
+persister (TICK_PERSISTER, see app/ticks.py) reads the tick streams.
+
+Entries are collected into micro-batches of up to the persister's batch size,
+or until its batch time has passed since the first one, and a batch is
+written in one round trip for all of its markets. Entries are acknowledged
+only after the commit. When a write fails, each stream of the batch is
+written on its own and the streams that succeed are acknowledged; the entries
+of the failing streams stay pending and are read again from the consumer's
+pending entries after a pause. Once an entry has been delivered
+STREAM_PERSISTER_MAX_DELIVERIES times and the database is reachable, the
+failure is taken for the entry's own: the entries of the stream are written
+one by one, and the ones that still fail are moved to the dead letter stream
+deadletter:{stream} with the error and acknowledged. Streams are
+discovered every STREAM_PERSISTER_DISCOVERY seconds, and then entries left
+pending by stopped consumers are claimed once they have been idle for
+STREAM_PERSISTER_CLAIM_IDLE milliseconds.
+
+Symbols are resolved with the market catalog (on STREAM_PERSISTER_EXCHANGE if
+set). Entries of unknown markets or with invalid fields are acknowledged and
+counted, as redelivering them would never succeed. Live bars are upserted, as
+broker-service can publish a bar again on every update while it forms: a
+stored candle is replaced by a later, different version, and the change log,
+coverage index, caches and tail buffer are updated like on any other ingest.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import text
+
+from app import crud, settings
+from app.cache import EPOCH
+from app.catalog import market_catalog
+from app.database import AsyncSessionLocal
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import ResponseError
+except ImportError:  # pragma: no cover - optional dependency
+    aioredis = None
+
+log = logging.getLogger(__name__)
+
+# Seconds to wait before reading the pending entries again after a failed write
+RETRY_DELAY = 5
+# Prefix of the dead letter streams, outside the persisters' patterns
+DEAD_LETTER_PREFIX = "deadletter:"
+# Entries kept per dead letter stream
+DEAD_LETTER_MAXLEN = 100_000
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def market_id(stream: str) -> Optional[int]:
+    """symbol_id of the market of a stream key, None if it is unknown."""
+    market = market_catalog.by_symbol(
+        stream.split(":")[2], settings.STREAM_PERSISTER_EXCHANGE or None)
+    return market["symbol_id"] if market is not None else None
+
+
+def decode_entry_id(entry_id) -> tuple[int, int]:
+    """Milliseconds and sequence number of a stream entry id such as 1700000000000-3."""
+    milliseconds, _, sequence = _decode(entry_id).partition("-")
+    return int(milliseconds), int(sequence)
+
+
+def decode_fields(fields: dict) -> dict:
+    return {_decode(key): _decode(value) for key, value in fields.items()}
+
+
+class StreamPersister(ABC):
+    """Base of the persisters, subclasses set pattern and implement parse and write."""
+    # Stream keys to consume, as a SCAN pattern
+    pattern = ""
+
+    def __init__(self, url: str, group: str, consumer: str, batch_size: int, batch_ms: int,
+                 claim_idle: int, discovery_interval: int, max_deliveries: int):
+        self.url = url
+        self.group = group
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.batch_ms = batch_ms
+        self.claim_idle = claim_idle
+        self.discovery_interval = discovery_interval
+        self.max_deliveries = max(max_deliveries, 1)
+        self.consumed = 0
+        self.added = 0
+        self.duplicates = 0
+        self.updated = 0
+        self.unknown = 0
+        self.invalid = 0
+        self.dead_lettered = 0
+        self.batches = 0
+        self.failures = 0
+        self.write_seconds = 0.0
+        self.last_flush_at: Optional[datetime] = None
+        self._redis = None
+        self._streams: set[str] = set()
+        self._discovered_at = 0.0
+        self._recover = True
+        self._stopping = asyncio.Event()
+
+    async def run(self):
+        """Consume the streams until stop() is called or cancelled."""
+        self._redis = aioredis.from_url(self.url)
+        batch: list[tuple[str, bytes, dict]] = []
+        deadline = 0.0
+        try:
+            while not self._stopping.is_set():
+                try:
+                    await self._discover()
+                    if self._recover:
+                        # Entries read again must not also be in the open batch
+                        if batch:
+                            await self._flush(batch)
+                            batch, deadline = [], 0.0
+                        pending = await self._read_pending()
+                        if pending:
+                            await self._flush(pending)
+                        else:
+                            self._recover = False
+                        continue
+
+                    if not self._streams:
+                        await asyncio.sleep(self.batch_ms / 1000)
+                        continue
+                    wait_ms = self.batch_ms if not batch \
+                        else (deadline - time.monotonic()) * 1000
+                    batch += await self._read(self.batch_size - len(batch), wait_ms)
+                    if batch and not deadline:
+                        deadline = time.monotonic() + self.batch_ms / 1000
+                    if len(batch) >= self.batch_size or batch and time.monotonic() >= deadline:
+                        await self._flush(batch)
+                        batch, deadline = [], 0.0
+                except Exception as exc:
+                    # Unacknowledged entries stay pending and are read again
+                    log.warning("Persister of %s failed, retrying in %ss: %s",
+                                self.pattern, RETRY_DELAY, exc)
+                    self.failures += 1
+                    batch, deadline = [], 0.0
+                    self._recover = True
+                    await asyncio.sleep(RETRY_DELAY)
+            if batch:
+                await self._flush(batch)
+        finally:
+            await self._redis.aclose()
+            self._redis = None
+
+    def stop(self):
+        """Finish the current batch and stop."""
+        self._stopping.set()
+
+    @abstractmethod
+    def parse(self, stream: str, entry_id, fields: dict):
+        """
+        Turn a stream entry into a record to write
+
+        :return: The record, or None for entries of unknown markets
+        :raises (KeyError, ValueError): For malformed entries
+        """
+
+    @abstractmethod
+    async def write(self, records: list) -> tuple[int, int]:
+        """
+        Write the records of a batch in one transaction
+
+        :return: Number of rows written and number of them that were added
+        :rtype: tuple[int, int]
+        """
+
+    async def _discover(self):
+        """Find new streams and create the consumer group on them."""
+        if time.monotonic() - self._discovered_at < self.discovery_interval:
+            return
+        self._discovered_at = time.monotonic()
+        async for key in self._redis.scan_iter(match=self.pattern, _type="stream"):
+            stream = _decode(key)
+            if stream in self._streams:
+                continue
+            try:
+                # Start at the beginning, bars already stored are skipped on insert
+                await self._redis.xgroup_create(stream, self.group, id="0")
+            except ResponseError as exc:
+                if "BUSYGROUP" not in str(exc):
+                    raise
+            self._streams.add(stream)
+        # Look for entries left by stopped consumers on every discovery
+        self._recover = True
+
+    async def _read(self, count: int, wait_ms: float) -> list:
+        # COUNT applies per stream, split it so the batch stays within count
+        response = await self._redis.xreadgroup(
+            self.group, self.consumer, {stream: ">" for stream in self._streams},
+            count=max(count // len(self._streams), 1), block=max(int(wait_ms), 1))
+        return [
+            (_decode(stream), entry_id, fields)
+            for stream, entries in response or ()
+            for entry_id, fields in entries
+        ]
+
+    async def _read_pending(self) -> list:
+        """Entries delivered to this consumer but not acknowledged, and idle ones of others."""
+        entries = {}
+        # At most batch_size entries over all streams, the rest is read on the next call
+        for stream in self._streams:
+            remaining = self.batch_size - len(entries)
+            if remaining <= 0:
+                break
+            response = await self._redis.xreadgroup(
+                self.group, self.consumer, {stream: "0"}, count=remaining)
+            for _, pending in response or ():
+                entries.update(((stream, entry_id), fields) for entry_id, fields in pending)
+            remaining = self.batch_size - len(entries)
+            if remaining <= 0:
+                break
+            _, claimed, *_ = await self._redis.xautoclaim(
+                stream, self.group, self.consumer, self.claim_idle, count=remaining)
+            # Trimmed entries are claimed without fields
+            entries.update(((stream, entry_id), fields) for entry_id, fields in claimed if fields)
+        return [(stream, entry_id, fields) for (stream, entry_id), fields in entries.items()]
+
+    async def _flush(self, batch: list):
+        """
+        Write a batch of entries and acknowledge them after the commit
+
+        :raises Exception: The write error when entries of a stream stay pending
+        """
+        acknowledged: dict[str, list] = {}
+        entries: dict[str, list] = {}
+        for stream, entry_id, fields in batch:
+            try:
+                record = self.parse(stream, entry_id, fields)
+            except (KeyError, ValueError, IndexError) as exc:
+                log.warning("Skipping invalid entry of %s: %s", stream, exc)
+                self.invalid += 1
+                record = None
+            else:
+                if record is None:
+                    self.unknown += 1
+            if record is None:
+                acknowledged.setdefault(stream, []).append(entry_id)
+            else:
+                entries.setdefault(stream, []).append((entry_id, fields, record))
+
+        started = time.perf_counter()
+        rows = added = 0
+        error = None
+        try:
+            if entries:
+                rows, added = await self.write(
+                    [record for stream_entries in entries.values()
+                     for _, _, record in stream_entries])
+            failed = {}
+        except Exception as exc:
+            error = exc
+            failed = dict.fromkeys(entries, exc)
+            if len(entries) > 1:
+                log.warning("Failed to write a batch of %s streams, writing them per stream: %s",
+                            len(entries), exc)
+                failed = {}
+                for stream, stream_entries in entries.items():
+                    try:
+                        stream_rows, stream_added = await self.write(
+                            [record for _, _, record in stream_entries])
+                    except Exception as stream_exc:
+                        failed[stream] = stream_exc
+                        continue
+                    rows += stream_rows
+                    added += stream_added
+        for stream, stream_entries in entries.items():
+            if stream not in failed:
+                acknowledged.setdefault(stream, []).extend(
+                    entry_id for entry_id, _, _ in stream_entries)
+
+        pending = False
+        if failed and await self._database_available():
+            for stream, exc in failed.items():
+                stream_rows, stream_added, done = await self._expire(
+                    stream, entries[stream], exc)
+                rows += stream_rows
+                added += stream_added
+                acknowledged.setdefault(stream, []).extend(done)
+                pending = pending or len(done) < len(entries[stream])
+        else:
+            pending = bool(failed)
+
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for stream, entry_ids in acknowledged.items():
+                if entry_ids:
+                    pipe.xack(stream, self.group, *entry_ids)
+            await pipe.execute()
+
+        self.write_seconds += time.perf_counter() - started
+        self.consumed += sum(len(entry_ids) for entry_ids in acknowledged.values())
+        self.added += added
+        self.duplicates += rows - added
+        self.batches += 1
+        self.last_flush_at = datetime.now(timezone.utc)
+        if pending:
+            # Unacknowledged entries stay pending and are read again
+            raise error
+
+    async def _expire(self, stream: str, entries: list, exc: Exception) -> tuple[int, int, list]:
+        """
+        Give up on entries of a failing stream delivered max_deliveries times
+
+        They are written one by one, and the ones that fail again are moved to
+        the dead letter stream.
+
+        :return: Rows written, rows added and the entry ids to acknowledge
+        :rtype: tuple[int, int, list]
+        """
+        # Entry ids order by their numbers, not as strings
+        ids = sorted((_decode(entry_id) for entry_id, _, _ in entries),
+                     key=lambda entry_id: tuple(map(int, entry_id.split("-"))))
+        details = await self._redis.xpending_range(
+            stream, self.group, min=ids[0], max=ids[-1], count=len(entries),
+            consumername=self.consumer)
+        deliveries = {_decode(detail["message_id"]): detail["times_delivered"]
+                      for detail in details}
+        rows = added = 0
+        done = []
+        for entry_id, fields, record in entries:
+            if deliveries.get(_decode(entry_id), 0) < self.max_deliveries:
+                continue
+            try:
+                entry_rows, entry_added = await self.write([record])
+            except Exception as entry_exc:
+                await self._redis.xadd(
+                    DEAD_LETTER_PREFIX + stream,
+                    {**fields, "entry_id": entry_id, "error": str(entry_exc)[:1000]},
+                    maxlen=DEAD_LETTER_MAXLEN, approximate=True)
+                self.dead_lettered += 1
+                log.error("Moved entry %s of %s to the dead letter stream after %s "
+                          "deliveries: %s", _decode(entry_id), stream, self.max_deliveries,
+                          entry_exc)
+            else:
+                rows += entry_rows
+                added += entry_added
+            done.append(entry_id)
+        if len(done) < len(entries):
+            log.warning("Keeping %s entries of %s pending: %s",
+                        len(entries) - len(done), stream, exc)
+        return rows, added, done
+
+    @staticmethod
+    async def _database_available() -> bool:
+        """Whether the database answers, so a failed write is the data's fault."""
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(text("SELECT 1"))
+            return True
+        except Exception:
+            return False
+
+    async def stats(self) -> dict:
+        """Counters, write throughput, and lag and pending entries per stream."""
+        streams = {}
+        if self._redis is not None:
+            for stream in sorted(self._streams):
+                try:
+                    groups = await self._redis.xinfo_groups(stream)
+                except ResponseError:
+                    continue
+                for group in groups:
+                    if _decode(group["name"]) == self.group:
+                        # lag is reported by Redis 7 and later
+                        streams[stream] = {"lag": group.get("lag"), "pending": group["pending"]}
+        return {
+            "running": self._redis is not None,
+            "consumer": self.consumer,
+            "group": self.group,
+            "consumed": self.consumed,
+            "added": self.added,
+            "duplicates_skipped": self.duplicates - self.updated,
+            "updated": self.updated,
+            "unknown_markets": self.unknown,
+            "invalid_entries": self.invalid,
+            "dead_lettered": self.dead_lettered,
+            "batches": self.batches,
+            "failures": self.failures,
+            "rows_per_sec": round(self.consumed / self.write_seconds)
+            if self.write_seconds else None,
+            "last_flush_at": self.last_flush_at,
+            "streams": streams,
+        }
+
+
+class CandlePersister(StreamPersister):
+    pattern = "candles:*:M1"
+
+    def parse(self, stream: str, entry_id, fields: dict) -> Optional[dict]:
+        symbol_id = market_id(stream)
+        if symbol_id is None:
+            return None
+        fields = decode_fields(fields)
+        return {
+            "symbol_id": symbol_id,
+            "timestamp": EPOCH + timedelta(milliseconds=int(fields["t"])),
+            "open": float(fields["o"]),
+            "high": float(fields["h"]),
+            "low": float(fields["l"]),
+            "close": float(fields["c"]),
+            "volume": float(fields["v"]),
+        }
+
+    async def write(self, records: list) -> tuple[int, int]:
+        # broker-service may publish a bar on every update while it forms: later
+        # entries replace earlier ones, in the batch and in the stored candles
+        candles = {(candle["symbol_id"], candle["timestamp"]): candle for candle in records}
+        async with AsyncSessionLocal() as session:
+            added, updated = await crud.upsert_candle_records(session, list(candles.values()))
+        self.updated += updated
+        return len(candles), added
+
+
+def create_persister(cls, enabled: bool, name: str, group: str, batch_size: int,
+                     batch_ms: int) -> Optional[StreamPersister]:
+    """Persister with the shared STREAM_PERSISTER settings, None if disabled."""
+    if not enabled:
+        return None
+    if aioredis is None:
+        log.warning("redis is not installed, %s persister disabled", name)
+        return None
+    return cls(
+        settings.STREAM_PERSISTER_REDIS_URL,
+        group,
+        settings.STREAM_PERSISTER_CONSUMER or f"{socket.gethostname()}-{os.getpid()}",
+        batch_size,
+        batch_ms,
+        settings.STREAM_PERSISTER_CLAIM_IDLE,
+        settings.STREAM_PERSISTER_DISCOVERY,
+        settings.STREAM_PERSISTER_MAX_DELIVERIES,
+    )
+
+
+candle_persister = create_persister(
+    CandlePersister, settings.CANDLE_PERSISTER, "candle", settings.CANDLE_PERSISTER_GROUP,
+    settings.CANDLE_PERSISTER_BATCH_SIZE, settings.CANDLE_PERSISTER_BATCH_MS)
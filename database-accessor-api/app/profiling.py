@@ -0,0 +1,291 @@
+# app/profiling.py
+"""
+Request stage timing, latency histograms and slow-query capture.
+
+Each request collects the time spent per stage in a context variable:
+``db`` (statement execution including row transfer, summed over all
+statements), ``rows`` (building Python rows or columns) and ``encode``
+(serializing the response). The middleware reports them in a Server-Timing
+header and records the total in a histogram per route and timeframe,
+rendered at /metrics in the Prometheus text format.
+
+Statements slower than SLOW_QUERY_MS that start with WITH or SELECT are
+re-run in the background with EXPLAIN (ANALYZE, BUFFERS) in a read-only
+transaction that is rolled back, and kept in a bounded log. Writes hidden in
+them (data-modifying CTEs, drop_chunks() and the like) fail there and get a
+plain EXPLAIN instead, so a slow write is never executed twice.
+"""
+import asyncio
+import hashlib
+import logging
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+from app import settings
+from app.database import engine, pool_stats
+from app.timeframes import parse_timeframe
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# SQLSTATE of a write attempted in a read-only transaction
+READ_ONLY_SQL_TRANSACTION = "25006"
+# Statements remembered for the once a minute limit of EXPLAIN
+EXPLAINED_STATEMENTS = 1024
+
+_timings: ContextVar[Optional[dict]] = ContextVar("timings", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Add the time spent in the block to the current request's stage timings."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(name, time.perf_counter() - started)
+
+
+def add_timing(name: str, seconds: float):
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+
+class Metrics:
+    def __init__(self):
+        self.requests: dict[tuple[str, str, str], Histogram] = {}
+        self.stages: dict[tuple[str, str], float] = {}
+
+    def observe(self, route: str, timeframe: str, status: int, seconds: float, timings: dict):
+        key = (route, timeframe, str(status))
+        histogram = self.requests.get(key)
+        if histogram is None:
+            histogram = self.requests[key] = Histogram()
+        histogram.observe(seconds)
+        for name, value in timings.items():
+            self.stages[(route, name)] = self.stages.get((route, name), 0.0) + value
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP accessor_request_duration_seconds Request latency by route and timeframe",
+            "# TYPE accessor_request_duration_seconds histogram",
+        ]
+        for (route, timeframe, status), histogram in sorted(self.requests.items()):
+            labels = f'route="{route}",timeframe="{timeframe}",status="{status}"'
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(
+                    f'accessor_request_duration_seconds_bucket{{{labels},le="{bound}"}} '
+                    f"{cumulative}")
+            lines.append(
+                f'accessor_request_duration_seconds_bucket{{{labels},le="+Inf"}} '
+                f"{histogram.count}")
+            lines.append(f"accessor_request_duration_seconds_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"accessor_request_duration_seconds_count{{{labels}}} {histogram.count}")
+
+        lines += [
+            "# HELP accessor_request_stage_seconds_total Time spent per request stage",
+            "# TYPE accessor_request_stage_seconds_total counter",
+        ]
+        for (route, name), seconds in sorted(self.stages.items()):
+            lines.append(
+                f'accessor_request_stage_seconds_total{{route="{route}",stage="{name}"}} '
+                f"{seconds}")
+
+        lines += [
+            "# HELP accessor_db_pool_connections Connections of the database pool by state",
+            "# TYPE accessor_db_pool_connections gauge",
+        ]
+        for state, value in pool_stats().items():
+            lines.append(f'accessor_db_pool_connections{{state="{state}"}} {value}')
+
+        lines += [
+            "# HELP accessor_slow_queries_total Statements slower than SLOW_QUERY_MS",
+            "# TYPE accessor_slow_queries_total counter",
+            f"accessor_slow_queries_total {slow_queries.total}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def _timeframe_label(value: Optional[str]) -> str:
+    if value is None:
+        return ""
+    try:
+        return parse_timeframe(value).label
+    except ValueError:
+        return "invalid"
+
+
+async def timing_middleware(request, call_next):
+    """
+    Collect stage timings of a request, report them in Server-Timing and
+    record the request latency
+    """
+    timings = {}
+    token = _timings.set(timings)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _timings.reset(token)
+    elapsed = time.perf_counter() - started
+
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    timeframe = _timeframe_label(request.query_params.get("timeframe"))
+    metrics.observe(path, timeframe, response.status_code, elapsed, timings)
+
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    entries.append(f"total;dur={elapsed * 1000:.2f}")
+    response.headers["Server-Timing"] = ", ".join(entries)
+    return response
+
+
+class SlowQueryLog:
+    """Captures EXPLAIN (ANALYZE, BUFFERS) of slow read-only statements."""
+
+    _read_only = re.compile(r"^\s*(WITH|SELECT)\b", re.IGNORECASE)
+    # Names that differ on every run, such as candles_staging_<uuid>
+    _unique_names = re.compile(r"_staging_[0-9a-f]{32}\b")
+
+    def __init__(self, threshold_ms: int, size: int):
+        self.threshold = threshold_ms / 1000
+        self.entries: deque = deque(maxlen=size)
+        self.total = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._last_explained: dict[str, float] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def record(self, statement: str, parameters, seconds: float):
+        self.total += 1
+        entry = {
+            "statement": statement,
+            "seconds": round(seconds, 3),
+            "captured_at": time.time(),
+            "plan": None,
+        }
+        self.entries.append(entry)
+        log.warning("Slow query (%.0f ms): %s", seconds * 1000, " ".join(statement.split()))
+
+        # ANALYZE runs the statement again, so only statements starting with
+        # WITH or SELECT are explained, in a read-only transaction that is
+        # rolled back, and each at most once a minute
+        if self._queue is None or not self._read_only.match(statement):
+            return
+        now = time.monotonic()
+        key = self._statement_key(statement)
+        if now - self._last_explained.get(key, -60.0) < 60:
+            return
+        if len(self._last_explained) >= EXPLAINED_STATEMENTS:
+            self._last_explained = {
+                key: at for key, at in self._last_explained.items() if now - at < 60}
+            if len(self._last_explained) >= EXPLAINED_STATEMENTS:
+                return
+        self._last_explained[key] = now
+        try:
+            self._queue.put_nowait((entry, statement, tuple(parameters or ())))
+        except asyncio.QueueFull:
+            pass
+
+    def _statement_key(self, statement: str) -> str:
+        """Digest of a statement with whitespace and unique names normalized."""
+        normalized = self._unique_names.sub("_staging_", " ".join(statement.split()))
+        return hashlib.sha1(normalized.encode()).hexdigest()
+
+    async def run(self):
+        """Explain queued statements until cancelled."""
+        self._queue = asyncio.Queue(maxsize=100)
+        try:
+            while True:
+                entry, statement, parameters = await self._queue.get()
+                try:
+                    entry["plan"] = await self._explain(statement, parameters)
+                    log.warning("Plan of slow query:\n%s", entry["plan"])
+                except Exception as exc:
+                    entry["plan"] = f"EXPLAIN failed: {exc}"
+        finally:
+            self._queue = None
+
+    async def _explain(self, statement: str, parameters: tuple) -> str:
+        # Run through the driver directly so the EXPLAIN is not timed itself
+        async with engine.connect() as conn:
+            raw_connection = await conn.get_raw_connection()
+            driver = raw_connection.driver_connection
+            try:
+                rows = await self._fetch_rolled_back(
+                    driver, f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+            except Exception as exc:
+                # Writes such as WITH ... AS (INSERT ...) or SELECT drop_chunks()
+                # fail in the read-only transaction, plan them without running
+                if getattr(exc, "sqlstate", None) != READ_ONLY_SQL_TRANSACTION:
+                    raise
+                rows = await self._fetch_rolled_back(driver, f"EXPLAIN {statement}", parameters)
+        return "\n".join(row[0] for row in rows)
+
+    @staticmethod
+    async def _fetch_rolled_back(driver, statement: str, parameters: tuple):
+        """Fetch in a read-only transaction that is always rolled back."""
+        transaction = driver.transaction(readonly=True)
+        await transaction.start()
+        try:
+            return await driver.fetch(statement, *parameters)
+        finally:
+            await transaction.rollback()
+
+
+slow_queries = SlowQueryLog(settings.SLOW_QUERY_MS, settings.SLOW_QUERY_LOG_SIZE)
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    add_timing("db", elapsed)
+    if slow_queries.enabled and elapsed >= slow_queries.threshold and not executemany:
+        slow_queries.record(statement, parameters, elapsed)
+
+
+@event.listens_for(engine.sync_engine, "handle_error")
+def _handle_error(context):
+    # Failed statements never reach after_cursor_execute
+    if context.connection is None or context.execution_context is None:
+        return
+    started = context.connection.info.get("query_started")
+    if started:
+        started.pop()
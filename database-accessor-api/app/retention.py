@@ -0,0 +1,181 @@
+# app/retention.py
+"""
+Batched deletes and retention of candles.
+
+Large deletes run as background jobs (see app/jobs.py) in batches of
+DELETE_BATCH_ROWS candles, each in its own short transaction, so locks are
+held briefly and vacuum can keep up. Batch boundaries are found with an
+index scan on (symbol_id, timestamp), and every batch is logged as a change
+like any other write.
+
+Retention works on whole chunks: raw candles older than CANDLES_RETENTION
+and aggregate buckets older than CANDLES_AGGREGATE_RETENTION are removed
+with drop_chunks instead of row deletes. With a raw retention the aggregate
+refresh window starts at the retention age (see app/aggregates.py), so the
+aggregates outlive the 1 minute candles they were built from. Dropped
+ranges are logged as changes of every market, and the coverage index is
+trimmed to the remaining candles.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import text
+
+from app import aggregates, coverage, crud, settings, versions
+from app.aggregation import time_conditions
+from app.cache import candle_cache
+from app.database import AsyncSessionLocal, engine
+from app.jobs import Job
+from app.timescale import CANDLES_TABLE, is_hypertable
+
+log = logging.getLogger(__name__)
+
+
+async def delete_candles_in_batches(
+    symbol_id: int, start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None, job: Optional[Job] = None
+) -> dict:
+    """
+    Delete the candles of a symbol_id in a time range batch by batch
+
+    :param symbol_id: Market symbol_id
+    :param start_date: Inclusive lower bound (optional)
+    :param end_date: Exclusive upper bound (optional)
+    :param job: Job to report progress on (optional)
+
+    :return: Number of candles deleted
+    :rtype: dict
+    """
+    deleted = 0
+    lower = start_date
+    while True:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(text(f"""
+                SELECT timestamp FROM {CANDLES_TABLE}
+                WHERE symbol_id = :symbol_id{time_conditions(lower, end_date)}
+                ORDER BY timestamp
+                OFFSET :batch_rows
+                LIMIT 1
+            """), {
+                "symbol_id": symbol_id,
+                "start_date": lower,
+                "end_date": end_date,
+                "batch_rows": settings.DELETE_BATCH_ROWS,
+            })
+            upper = result.scalar()
+            deleted += await crud.delete_candle_range(
+                session, symbol_id, lower, upper if upper is not None else end_date,
+                update_coverage=False)
+
+        if job is not None:
+            job.progress.update(deleted_candles=deleted, deleted_before=upper)
+        if upper is None:
+            break
+        lower = upper
+
+    # Coverage is rebuilt once, batches would rescan the rest of a range each
+    async with AsyncSessionLocal() as session:
+        await coverage.rebuild_ranges(
+            session, symbol_id, start_date,
+            end_date - coverage.CANDLE_STEP if end_date is not None else None)
+        await session.commit()
+    return {"symbol_id": symbol_id, "deleted_candles": deleted}
+
+
+async def delete_market_in_batches(symbol_id: int, job: Optional[Job] = None) -> dict:
+    """
+    Delete the candles of a market in batches, then the market itself
+
+    :param symbol_id: Market symbol_id
+    :param job: Job to report progress on (optional)
+
+    :return: Whether the market was deleted and the number of candles deleted
+    :rtype: dict
+    """
+    report = await delete_candles_in_batches(symbol_id, job=job)
+    async with AsyncSessionLocal() as session:
+        deleted = await crud.delete_market(session, symbol_id)
+    return {
+        "symbol_id": symbol_id,
+        "market_deleted": deleted["market_deleted"],
+        "deleted_candles": report["deleted_candles"] + deleted["deleted_candles"],
+    }
+
+
+async def _drop_old_chunks(conn, relation: str, retention: str) -> dict:
+    """Drop the chunks of a hypertable or continuous aggregate older than retention."""
+    result = await conn.execute(text(f"""
+        SELECT
+            count(*) AS chunks,
+            min(range_start) AT TIME ZONE 'UTC' AS first,
+            max(range_end) AT TIME ZONE 'UTC' AS last
+        FROM timescaledb_information.chunks
+        WHERE format('%I.%I', chunk_schema, chunk_name)::regclass IN (
+            SELECT show_chunks('{relation}', older_than => CAST(:retention AS TEXT)::interval)
+        )
+    """), {"retention": retention})
+    dropped = result.one()
+    if dropped.chunks:
+        await conn.execute(text(f"""
+            SELECT drop_chunks('{relation}', older_than => CAST(:retention AS TEXT)::interval)
+        """), {"retention": retention})
+    return {"relation": relation, "chunks": dropped.chunks,
+            "first": dropped.first, "last": dropped.last}
+
+
+async def apply_retention() -> list[dict]:
+    """
+    Drop raw candle and aggregate chunks past their retention
+
+    :return: Dropped chunks and their time range per relation
+    :rtype: list[dict]
+    """
+    targets = []
+    if settings.CANDLES_RETENTION:
+        targets.append((CANDLES_TABLE, settings.CANDLES_RETENTION))
+    if settings.CANDLES_AGGREGATE_RETENTION:
+        targets += [(source.relation, settings.CANDLES_AGGREGATE_RETENTION)
+                    for source in aggregates.available_sources()]
+    if not targets:
+        return []
+
+    report = []
+    async with engine.begin() as conn:
+        if not await is_hypertable(conn):
+            log.warning("candles is not a hypertable, retention needs chunks")
+            return report
+
+        for relation, retention in targets:
+            report.append(await _drop_old_chunks(conn, relation, retention))
+
+        dropped = [entry for entry in report if entry["chunks"]]
+        if dropped:
+            first = min(entry["first"] for entry in dropped)
+            # Chunk ranges end exclusive, changes are inclusive
+            last = max(entry["last"] for entry in dropped) - timedelta(microseconds=1)
+            result = await conn.execute(text("SELECT symbol_id FROM markets"))
+            symbol_ids = result.scalars().all()
+            await versions.record_changes(
+                conn, {symbol_id: (first, last) for symbol_id in symbol_ids})
+        for entry in dropped:
+            if entry["relation"] == CANDLES_TABLE:
+                await coverage.drop_before(conn, entry["last"])
+
+    if dropped:
+        for symbol_id in symbol_ids:
+            await candle_cache.invalidate(symbol_id, first, last)
+        log.info("Retention dropped %s chunks up to %s",
+                 sum(entry["chunks"] for entry in dropped), last)
+    return report
+
+
+async def run_retention(interval: int):
+    """Apply retention every interval seconds until cancelled."""
+    while True:
+        try:
+            await apply_retention()
+        except Exception as exc:
+            log.warning("Failed to apply candle retention: %s", exc)
+        await asyncio.sleep(interval)
@@ -0,0 +1,109 @@
+# app/settings.py
+from dotenv import load_dotenv
+import os
+
+# Load .env file
+load_dotenv()
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() == "true"
+
+
+def _env_int_list(name: str, default: str) -> list[int]:
+    return [int(value) for value in os.getenv(name, default).split(",") if value.strip()]
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Schema management (see app/timescale.py)
+DB_MANAGE_SCHEMA = _env_bool("DB_MANAGE_SCHEMA", True)
+CANDLES_CHUNK_INTERVAL = os.getenv("CANDLES_CHUNK_INTERVAL", "7 days")
+CANDLES_COMPRESSION = _env_bool("CANDLES_COMPRESSION", True)
+CANDLES_COMPRESS_AFTER = os.getenv("CANDLES_COMPRESS_AFTER", "30 days")
+CANDLES_REORDER_POLICY = _env_bool("CANDLES_REORDER_POLICY", True)
+
+# Retention (see app/retention.py) as Postgres intervals, empty keeps everything
+CANDLES_RETENTION = os.getenv("CANDLES_RETENTION", "")
+CANDLES_AGGREGATE_RETENTION = os.getenv("CANDLES_AGGREGATE_RETENTION", "")
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "3600"))
+
+# Largest step in minutes between candles of one coverage range (see app/coverage.py)
+CANDLES_COVERAGE_TOLERANCE = int(os.getenv("CANDLES_COVERAGE_TOLERANCE", "1"))
+
+# Rows per transaction of background deletes, and finished jobs kept (see app/jobs.py)
+DELETE_BATCH_ROWS = int(os.getenv("DELETE_BATCH_ROWS", "50000"))
+JOBS_HISTORY = int(os.getenv("JOBS_HISTORY", "100"))
+
+# Continuous aggregates (see app/aggregates.py), timeframes in minutes
+CANDLES_AGGREGATE_TIMEFRAMES = _env_int_list("CANDLES_AGGREGATE_TIMEFRAMES", "5,15,60,240,1440")
+
+# Ingest path of POST /candles: "insert" (multi-VALUES batches), "copy" (COPY + merge)
+# or "buffered" (write-behind buffer)
+CANDLES_INGEST_MODE = os.getenv("CANDLES_INGEST_MODE", "insert").lower()
+
+# Write-behind buffer of POST /candles?mode=buffered (see app/writebuffer.py): candles
+# queued before a flush, milliseconds the first one waits, queued candles before
+# requests wait for a flush, and failed writes of a market before its candles are dropped
+CANDLE_WRITE_BUFFER_ROWS = int(os.getenv("CANDLE_WRITE_BUFFER_ROWS", "2000"))
+CANDLE_WRITE_BUFFER_MS = int(os.getenv("CANDLE_WRITE_BUFFER_MS", "250"))
+CANDLE_WRITE_BUFFER_MAX_ROWS = int(os.getenv("CANDLE_WRITE_BUFFER_MAX_ROWS", "100000"))
+CANDLE_WRITE_BUFFER_ATTEMPTS = int(os.getenv("CANDLE_WRITE_BUFFER_ATTEMPTS", "5"))
+
+# Rows per chunk of POST /candles/{symbol_id}/stream (see app/ingest.py)
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "50000"))
+
+# Rows per server-side cursor batch of GET /candles/{symbol_id}?stream=true
+CANDLES_STREAM_BATCH_ROWS = int(os.getenv("CANDLES_STREAM_BATCH_ROWS", "10000"))
+
+# Volume, range, Renko, Heikin-Ashi and tick bar results kept per worker (see app/bars.py),
+# and bars they may hold in total
+BARS_CACHE_SIZE = int(os.getenv("BARS_CACHE_SIZE", "32"))
+BARS_CACHE_MAX_BARS = int(os.getenv("BARS_CACHE_MAX_BARS", "500000"))
+
+# Aggregated candle cache (see app/cache.py): memory, redis or off
+CANDLE_CACHE_BACKEND = os.getenv("CANDLE_CACHE_BACKEND", "memory").lower()
+CANDLE_CACHE_BLOCK_BUCKETS = int(os.getenv("CANDLE_CACHE_BLOCK_BUCKETS", "1000"))
+CANDLE_CACHE_MAX_ROWS = int(os.getenv("CANDLE_CACHE_MAX_ROWS", "2000000"))
+CANDLE_CACHE_REDIS_URL = os.getenv("CANDLE_CACHE_REDIS_URL", "redis://redis:6379/0")
+CANDLE_CACHE_REDIS_TTL = int(os.getenv("CANDLE_CACHE_REDIS_TTL", "86400"))
+
+# Newest bars buffered per (symbol, timeframe) for limit-only requests (see app/tail.py),
+# 0 disables the buffer
+CANDLE_TAIL_BARS = int(os.getenv("CANDLE_TAIL_BARS", "1000"))
+CANDLE_TAIL_MAX_SERIES = int(os.getenv("CANDLE_TAIL_MAX_SERIES", "500"))
+
+# Change log behind GET /candles/{symbol_id}/changes (see app/versions.py)
+CANDLE_CHANGES_RETENTION = os.getenv("CANDLE_CHANGES_RETENTION", "7 days")
+CANDLE_CHANGES_PRUNE_INTERVAL = int(os.getenv("CANDLE_CHANGES_PRUNE_INTERVAL", "3600"))
+
+# Slow query log (see app/profiling.py), 0 disables it
+SLOW_QUERY_MS = int(os.getenv("SLOW_QUERY_MS", "500"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "50"))
+
+# Seconds between reloads of the in-memory market catalog (see app/catalog.py)
+MARKET_CATALOG_REFRESH = int(os.getenv("MARKET_CATALOG_REFRESH", "60"))
+
+# Persisters of live data from broker-service Redis streams (see app/persister.py)
+STREAM_PERSISTER_REDIS_URL = os.getenv("STREAM_PERSISTER_REDIS_URL", "redis://redis:6379/0")
+# Consumer name, defaults to hostname and process id
+STREAM_PERSISTER_CONSUMER = os.getenv("STREAM_PERSISTER_CONSUMER", "")
+STREAM_PERSISTER_EXCHANGE = os.getenv("STREAM_PERSISTER_EXCHANGE", "")
+STREAM_PERSISTER_CLAIM_IDLE = int(os.getenv("STREAM_PERSISTER_CLAIM_IDLE", "60000"))
+STREAM_PERSISTER_DISCOVERY = int(os.getenv("STREAM_PERSISTER_DISCOVERY", "30"))
+# Deliveries of a failing entry before it is moved to its dead letter stream
+STREAM_PERSISTER_MAX_DELIVERIES = int(os.getenv("STREAM_PERSISTER_MAX_DELIVERIES", "5"))
+CANDLE_PERSISTER = _env_bool("CANDLE_PERSISTER", False)
+CANDLE_PERSISTER_GROUP = os.getenv("CANDLE_PERSISTER_GROUP", "candle-persister")
+# At most 4681 entries, the parameter limit of one insert statement
+CANDLE_PERSISTER_BATCH_SIZE = min(int(os.getenv("CANDLE_PERSISTER_BATCH_SIZE", "1000")), 4681)
+CANDLE_PERSISTER_BATCH_MS = int(os.getenv("CANDLE_PERSISTER_BATCH_MS", "500"))
+TICK_PERSISTER = _env_bool("TICK_PERSISTER", False)
+TICK_PERSISTER_GROUP = os.getenv("TICK_PERSISTER_GROUP", "tick-persister")
+TICK_PERSISTER_BATCH_SIZE = int(os.getenv("TICK_PERSISTER_BATCH_SIZE", "20000"))
+TICK_PERSISTER_BATCH_MS = int(os.getenv("TICK_PERSISTER_BATCH_MS", "1000"))
+
+# Tick storage (see app/ticks.py), epoch millisecond chunks and compression
+TICKS_CHUNK_INTERVAL = os.getenv("TICKS_CHUNK_INTERVAL", "1 day")
+TICKS_COMPRESSION = _env_bool("TICKS_COMPRESSION", True)
+TICKS_COMPRESS_AFTER = os.getenv("TICKS_COMPRESS_AFTER", "2 days")
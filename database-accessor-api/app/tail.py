@@ -0,0 +1,183 @@
+# app/tail.py
+"""
+In-memory buffer of the newest aggregated bars per series.
+
+Chart loads ask for the latest few hundred bars of a (symbol_id, timeframe,
+session offset) series. The buffer keeps the newest CANDLE_TAIL_BARS bars of
+recently requested series so those requests are served from memory.
+
+A series remembers the data version it was loaded at. Before it is served,
+the symbol's change log since that version is read (two index lookups
+when nothing changed) and the buckets from the oldest changed one
+onwards are re-aggregated and spliced in. When deletes leave a full series
+with fewer bars than the buffer holds, it is reloaded with the tail query
+instead, so older bars move in. Ingestion runs the same refresh right after
+its commit, so buffered series stay warm without ever serving writes of
+other workers late. Series are evicted least recently used beyond
+CANDLE_TAIL_MAX_SERIES.
+"""
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from app import aggregates, settings, versions
+from app.aggregation import bucket_start, candles_query, tail_query, tail_scan_rows
+from app.cache import from_epoch_ms, to_epoch_ms
+from app.timeframes import Timeframe
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class TailSeries:
+    version: int
+    # Rows as (epoch ms, open, high, low, close, volume), oldest first
+    rows: tuple
+
+
+class TailBuffer:
+    def __init__(self, bars: int, max_series: int):
+        self.bars = bars
+        self.max_series = max_series
+        self.hits = 0
+        self.loads = 0
+        self.refreshes = 0
+        self._series: OrderedDict[tuple, TailSeries] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.bars > 0 and self.max_series > 0
+
+    def serves(self, limit: Optional[int], start_date: Optional[datetime],
+               end_date: Optional[datetime]) -> bool:
+        """Whether a request is for the newest bars within the buffer's depth."""
+        return self.enabled and limit is not None and limit <= self.bars \
+            and start_date is None and end_date is None
+
+    async def get_rows(self, session, symbol_id: int, timeframe: Timeframe,
+                       offset: int, limit: int) -> list:
+        """
+        Get the newest bars of a series, loading or refreshing it as needed
+
+        :param session: SQLAlchemy session
+        :param symbol_id: Market symbol_id
+        :param timeframe: Requested timeframe
+        :param offset: Session offset in minutes
+        :param limit: Number of bars, at most the buffer depth
+
+        :return: Rows as (epoch ms, open, high, low, close, volume) oldest first
+        :rtype: list[tuple]
+        """
+        key = (symbol_id, timeframe, offset)
+        series = self._series.get(key)
+        if series is None:
+            series = await self._load(session, symbol_id, timeframe, offset)
+        else:
+            self._series.move_to_end(key)
+            series = await self._refresh(session, symbol_id, timeframe, offset, series)
+            self.hits += 1
+        self._store(key, series)
+        return list(series.rows[-limit:]) if limit > 0 else []
+
+    async def warm(self, session, symbol_ids):
+        """
+        Refresh the buffered series of symbols after a write was committed
+
+        Failures are logged and the affected series dropped, the write
+        itself has already succeeded.
+        """
+        if not self.enabled:
+            return
+        wanted = set(symbol_ids)
+        for key in [key for key in self._series if key[0] in wanted]:
+            symbol_id, timeframe, offset = key
+            series = self._series.get(key)
+            if series is None:
+                continue
+            try:
+                self._store(key, await self._refresh(
+                    session, symbol_id, timeframe, offset, series))
+            except Exception as exc:
+                log.warning("Failed to refresh buffered bars of %s %s: %s",
+                            symbol_id, timeframe.label, exc)
+                self._series.pop(key, None)
+                await session.rollback()
+
+    def discard(self, symbol_id: int):
+        """Drop all buffered series of a symbol."""
+        for key in [key for key in self._series if key[0] == symbol_id]:
+            del self._series[key]
+
+    def stats(self) -> dict:
+        return {
+            "series": len(self._series),
+            "max_series": self.max_series,
+            "bars": self.bars,
+            "hits": self.hits,
+            "loads": self.loads,
+            "refreshes": self.refreshes,
+        }
+
+    def _store(self, key: tuple, series: TailSeries):
+        self._series[key] = series
+        while len(self._series) > self.max_series:
+            self._series.popitem(last=False)
+
+    async def _load(self, session, symbol_id: int, timeframe: Timeframe,
+                    offset: int) -> TailSeries:
+        # The version is read first, so writes racing the load are refreshed later
+        current = await versions.get_version(session, symbol_id)
+        source = aggregates.select_source(timeframe, offset)
+        result = await session.execute(
+            tail_query(timeframe, source, offset=offset, epoch_ms=True),
+            {
+                "symbol_id": symbol_id,
+                "scan_rows": tail_scan_rows(timeframe, source, self.bars),
+                "limit": self.bars,
+            })
+        self.loads += 1
+        rows = tuple(tuple(row) for row in reversed(result.fetchall()))
+        return TailSeries(current[0] if current else 0, rows)
+
+    async def _refresh(self, session, symbol_id: int, timeframe: Timeframe,
+                       offset: int, series: TailSeries) -> TailSeries:
+        state, changes = await versions.get_changes(session, symbol_id, series.version)
+        if state is None or state["version"] == series.version:
+            return series
+        if series.version < state["changes_floor"] \
+                or any(change.min_ts is None for change in changes):
+            return await self._load(session, symbol_id, timeframe, offset)
+
+        full = len(series.rows) >= self.bars
+        oldest = from_epoch_ms(series.rows[0][0]) if series.rows else None
+        # With a full buffer, writes before its oldest bucket can't change the
+        # newest bars; with a short history any write may add bars
+        starts = [
+            bucket_start(timeframe, change.min_ts, offset) for change in changes
+            if not full or bucket_start(timeframe, change.max_ts, offset) >= oldest
+        ]
+        if not starts:
+            return TailSeries(state["version"], series.rows)
+        if not full:
+            return await self._load(session, symbol_id, timeframe, offset)
+
+        start = max(min(starts), oldest)
+        source = aggregates.select_source(timeframe, offset)
+        result = await session.execute(
+            candles_query(timeframe, source, start, None, None, offset, epoch_ms=True),
+            {"symbol_id": symbol_id, "start_date": start})
+        self.refreshes += 1
+        start_ms = to_epoch_ms(start)
+        kept = tuple(row for row in series.rows if row[0] < start_ms)
+        rows = kept + tuple(tuple(row) for row in result.fetchall())
+        if full and len(rows) < self.bars:
+            # Bars were deleted (e.g. by a range delete of the newest bars): the
+            # spliced series of a full buffer is short although older history
+            # may exist, so older bars have to move into the buffer
+            return await self._load(session, symbol_id, timeframe, offset)
+        return TailSeries(state["version"], rows[-self.bars:])
+
+
+tail_buffer = TailBuffer(settings.CANDLE_TAIL_BARS, settings.CANDLE_TAIL_MAX_SERIES)
@@ -0,0 +1,386 @@
+# app/ticks.py
+"""
+Tick storage and tick-to-bar aggregation.
+
+Ticks are stored compactly in the ticks hypertable: epoch millisecond
+timestamps and bid/ask as integers scaled by PRICE_SCALE, the fixed price
+scale of cTrader (5 decimals). Chunks span TICKS_CHUNK_INTERVAL and are
+compressed, segmented by symbol_id, after TICKS_COMPRESS_AFTER.
+
+Live ticks are drained from the broker-service tick streams
+ticks:{account_id}:{symbol} by the tick persister (TICK_PERSISTER, see
+app/persister.py) and bulk loaded with COPY. Several ticks can share a
+millisecond, so ticks carry the id of their stream entry as seq and are
+merged from a staging table skipping (symbol_id, ts, seq) already stored: a
+batch redelivered after a failure between commit and acknowledgement is not
+stored twice. Ticks stored before seq existed have a seq of 0.
+
+Bars of any number of seconds are aggregated from the ticks on request, on
+the bid, the ask or the mid price, with the number of ticks as volume and the
+average spread. Buckets are aligned like candle buckets (see
+app/aggregation.py).
+"""
+import logging
+import re
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import text
+
+from app import settings
+from app.aggregation import BUCKET_ORIGIN
+from app.cache import EPOCH, to_epoch_ms
+from app.database import AsyncSessionLocal, engine
+from app.persister import (
+    StreamPersister, create_persister, decode_entry_id, decode_fields, market_id
+)
+from app.timeframes import parse_timeframe
+
+log = logging.getLogger(__name__)
+
+TICKS_TABLE = "ticks"
+TICK_COLUMNS = ["symbol_id", "ts", "bid", "ask", "seq"]
+PRICE_SCALE = 100_000
+# Stream entry ids ms-n are stored as seq = ms * ENTRY_SEQ_SCALE + n
+ENTRY_SEQ_SCALE = 100_000
+
+PRICE_EXPRESSIONS = {
+    "bid": "bid",
+    "ask": "ask",
+    "mid": "(bid + ask) / 2.0",
+}
+
+_SECONDS_PATTERNS = (re.compile(r"^(\d+)s$", re.IGNORECASE), re.compile(r"^S(\d+)$"))
+
+
+def parse_bar_interval(value: str) -> int:
+    """
+    Parse the width of tick bars
+
+    :param value: Seconds (e.g. 30, 30s, S30) or a timeframe label such as M1, 5m, H1
+
+    :return: Bar width in seconds
+    :rtype: int
+
+    :raises ValueError: If the interval cannot be parsed, is not positive or
+        is not a fixed width
+    """
+    text_value = str(value).strip()
+    if text_value.isdigit():
+        seconds = int(text_value)
+    else:
+        match = next(
+            (m for m in (p.match(text_value) for p in _SECONDS_PATTERNS) if m), None)
+        if match:
+            seconds = int(match.group(1))
+        else:
+            timeframe = parse_timeframe(text_value)
+            if timeframe.minutes is None:
+                raise ValueError(f"Tick bars need a fixed width, got {value}")
+            seconds = timeframe.minutes * 60
+    if seconds <= 0:
+        raise ValueError(f"Interval must be positive, got {value}")
+    return seconds
+
+
+async def setup_ticks_storage():
+    """Create the ticks hypertable and apply chunk and compression settings."""
+    async with engine.begin() as conn:
+        await conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {TICKS_TABLE} (
+                symbol_id INTEGER NOT NULL REFERENCES markets (symbol_id) ON DELETE CASCADE,
+                ts BIGINT NOT NULL,
+                bid BIGINT NOT NULL,
+                ask BIGINT NOT NULL,
+                seq BIGINT NOT NULL DEFAULT 0
+            )
+        """))
+        await conn.execute(text(f"""
+            ALTER TABLE {TICKS_TABLE} ADD COLUMN IF NOT EXISTS seq BIGINT NOT NULL DEFAULT 0
+        """))
+        await conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS {TICKS_TABLE}_symbol_id_ts_idx
+            ON {TICKS_TABLE} (symbol_id, ts)
+        """))
+        # Integer time needs a "now" in the same unit for the compression policy
+        await conn.execute(text("""
+            CREATE OR REPLACE FUNCTION ticks_now_ms() RETURNS BIGINT
+            LANGUAGE SQL STABLE AS $$ SELECT (extract(epoch FROM now()) * 1000)::BIGINT $$
+        """))
+        await conn.execute(text(f"""
+            SELECT create_hypertable(
+                '{TICKS_TABLE}', 'ts',
+                chunk_time_interval => {_interval_ms_sql("chunk_interval")},
+                create_default_indexes => false,
+                if_not_exists => true
+            )
+        """), {"chunk_interval": settings.TICKS_CHUNK_INTERVAL})
+        await conn.execute(text(
+            f"SELECT set_integer_now_func('{TICKS_TABLE}', 'ticks_now_ms', "
+            "replace_if_exists => true)"))
+        await conn.execute(text(f"""
+            SELECT set_chunk_time_interval('{TICKS_TABLE}', {_interval_ms_sql("chunk_interval")})
+        """), {"chunk_interval": settings.TICKS_CHUNK_INTERVAL})
+
+        if settings.TICKS_COMPRESSION:
+            await _apply_compression(conn)
+        else:
+            await conn.execute(text(
+                f"SELECT remove_compression_policy('{TICKS_TABLE}', if_exists => true)"))
+
+
+def _interval_ms_sql(param: str) -> str:
+    """SQL converting a Postgres interval parameter into milliseconds."""
+    return f"(extract(epoch FROM CAST(:{param} AS TEXT)::interval) * 1000)::BIGINT"
+
+
+async def _apply_compression(conn):
+    result = await conn.execute(text("""
+        SELECT compression_enabled FROM timescaledb_information.hypertables
+        WHERE hypertable_name = :table
+    """), {"table": TICKS_TABLE})
+    if not result.scalar():
+        await conn.execute(text(f"""
+            ALTER TABLE {TICKS_TABLE} SET (
+                timescaledb.compress,
+                timescaledb.compress_segmentby = 'symbol_id',
+                timescaledb.compress_orderby = 'ts'
+            )
+        """))
+
+    # Integer time policies keep compress_after as a number, so
+    # sync_interval_policy of app/timescale.py does not apply
+    result = await conn.execute(text(f"""
+        SELECT (config ->> 'compress_after')::BIGINT = {_interval_ms_sql("compress_after")}
+        FROM timescaledb_information.jobs
+        WHERE proc_name = 'policy_compression' AND hypertable_name = :table
+    """), {"compress_after": settings.TICKS_COMPRESS_AFTER, "table": TICKS_TABLE})
+    row = result.first()
+    if row is not None and row[0]:
+        return
+    if row is not None:
+        await conn.execute(text(
+            f"SELECT remove_compression_policy('{TICKS_TABLE}', if_exists => true)"))
+    await conn.execute(text(f"""
+        SELECT add_compression_policy(
+            '{TICKS_TABLE}', compress_after => {_interval_ms_sql("compress_after")}
+        )
+    """), {"compress_after": settings.TICKS_COMPRESS_AFTER})
+
+
+async def copy_ticks(session, records: list[tuple]) -> int:
+    """
+    Bulk load ticks in a single transaction
+
+    The records are copied into a private unlogged staging table with asyncpg's
+    binary COPY and merged into ticks, skipping ticks whose (symbol_id, ts,
+    seq) is already stored, like copy_candle_records. The table has no unique
+    index, as ticks stored before seq existed share seq 0.
+
+    :param session: SQLAlchemy session
+    :param records: Tuples ordered like TICK_COLUMNS
+
+    :return: Number of ticks added
+    :rtype: int
+    """
+    staging = f"ticks_staging_{uuid.uuid4().hex}"
+    columns = ", ".join(TICK_COLUMNS)
+    await session.execute(text(
+        f"CREATE UNLOGGED TABLE {staging} (LIKE {TICKS_TABLE} INCLUDING DEFAULTS)"))
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        staging, records=records, columns=TICK_COLUMNS)
+    result = await session.execute(text(f"""
+        INSERT INTO {TICKS_TABLE} ({columns})
+        SELECT {columns} FROM {staging} s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {TICKS_TABLE} t
+            WHERE t.symbol_id = s.symbol_id AND t.ts = s.ts AND t.seq = s.seq
+        )
+    """))
+    await session.execute(text(f"DROP TABLE {staging}"))
+    await session.commit()
+    return result.rowcount
+
+
+def _epoch_ms(value: Optional[datetime]) -> Optional[int]:
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return to_epoch_ms(value)
+
+
+def _ms_conditions(start_ms: Optional[int], end_ms: Optional[int]) -> str:
+    conditions = ""
+    if start_ms is not None:
+        conditions += " AND ts >= :start_ms"
+    if end_ms is not None:
+        conditions += " AND ts < :end_ms"
+    return conditions
+
+
+async def get_ticks(
+    session, symbol_id: int, start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None, limit: Optional[int] = None
+) -> list[dict]:
+    """
+    Get the ticks of a market, the newest ones when only a limit is given
+
+    :param session: SQLAlchemy session
+    :param symbol_id: Market symbol_id
+    :param start_date: Inclusive lower bound (optional)
+    :param end_date: Exclusive upper bound (optional)
+    :param limit: Maximum number of ticks (optional)
+
+    :return: Ticks with timestamp, bid and ask, oldest first
+    :rtype: list[dict]
+    """
+    start_ms, end_ms = _epoch_ms(start_date), _epoch_ms(end_date)
+    newest = limit is not None and start_ms is None
+    result = await session.execute(text(f"""
+        SELECT ts, bid, ask FROM {TICKS_TABLE}
+        WHERE symbol_id = :symbol_id{_ms_conditions(start_ms, end_ms)}
+        ORDER BY ts {"DESC" if newest else "ASC"}
+        {"LIMIT :limit" if limit is not None else ""}
+    """), {"symbol_id": symbol_id, "start_ms": start_ms, "end_ms": end_ms, "limit": limit})
+    rows = result.fetchall()
+    if newest:
+        rows.reverse()
+    return [
+        {
+            "timestamp": EPOCH + timedelta(milliseconds=row.ts),
+            "bid": row.bid / PRICE_SCALE,
+            "ask": row.ask / PRICE_SCALE,
+        }
+        for row in rows
+    ]
+
+
+async def stream_tick_rows(
+    session, symbol_id: int, start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None, batch_rows: int = 10000
+):
+    """
+    Stream the ticks of a market from a server-side cursor in batches, oldest first
+
+    :param session: SQLAlchemy session, open until the iterator is exhausted
+    :param symbol_id: Market symbol_id
+    :param start_date: Inclusive lower bound (optional)
+    :param end_date: Exclusive upper bound (optional)
+    :param batch_rows: Ticks fetched from the cursor per batch
+
+    :return: Async iterator of batches of (epoch ms, bid, ask) rows, prices
+        scaled by PRICE_SCALE
+    :rtype: AsyncIterator[list[Row]]
+    """
+    start_ms, end_ms = _epoch_ms(start_date), _epoch_ms(end_date)
+    result = await session.stream(text(f"""
+        SELECT ts, bid, ask FROM {TICKS_TABLE}
+        WHERE symbol_id = :symbol_id{_ms_conditions(start_ms, end_ms)}
+        ORDER BY ts
+    """), {"symbol_id": symbol_id, "start_ms": start_ms, "end_ms": end_ms})
+    async for rows in result.partitions(batch_rows):
+        yield rows
+
+
+async def get_tick_bars(
+    session, symbol_id: int, seconds: int, price: str = "bid",
+    start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+    limit: Optional[int] = None
+) -> list[dict]:
+    """
+    Aggregate the ticks of a market into bars
+
+    Without a start date the bars of the limit * seconds before the end date
+    (or now) are returned.
+
+    :param session: SQLAlchemy session
+    :param symbol_id: Market symbol_id
+    :param seconds: Bar width in seconds
+    :param price: Price the bars are built from: bid, ask or mid
+    :param start_date: Inclusive lower bound (optional)
+    :param end_date: Exclusive upper bound (optional)
+    :param limit: Maximum number of bars (optional)
+
+    :return: Bars with timestamp, open, high, low, close, volume (number of
+        ticks) and spread (average ask - bid), oldest first
+    :rtype: list[dict]
+    """
+    width = seconds * 1000
+    origin = to_epoch_ms(BUCKET_ORIGIN) % width
+    start_ms, end_ms = _epoch_ms(start_date), _epoch_ms(end_date)
+    newest = start_ms is None and limit is not None
+    if newest:
+        upper = end_ms if end_ms is not None \
+            else _epoch_ms(datetime.now(timezone.utc)) + width
+        start_ms = upper - (upper - origin) % width - limit * width
+    price_sql = PRICE_EXPRESSIONS[price]
+    result = await session.execute(text(f"""
+        SELECT
+            time_bucket(CAST(:width AS BIGINT), ts, CAST(:origin AS BIGINT)) AS bucket,
+            first({price_sql}, ts) AS open,
+            max({price_sql}) AS high,
+            min({price_sql}) AS low,
+            last({price_sql}, ts) AS close,
+            count(*) AS volume,
+            avg(ask - bid) AS spread
+        FROM {TICKS_TABLE}
+        WHERE symbol_id = :symbol_id{_ms_conditions(start_ms, end_ms)}
+        GROUP BY bucket
+        ORDER BY bucket
+        {"LIMIT :limit" if limit is not None and not newest else ""}
+    """), {
+        "symbol_id": symbol_id,
+        "width": width,
+        "origin": origin,
+        "start_ms": start_ms,
+        "end_ms": end_ms,
+        "limit": limit,
+    })
+    rows = result.fetchall()
+    if newest:
+        # The window may hold one partial bucket more than the limit
+        rows = rows[-limit:]
+    return [
+        {
+            "timestamp": EPOCH + timedelta(milliseconds=row.bucket),
+            "open": float(row.open) / PRICE_SCALE,
+            "high": float(row.high) / PRICE_SCALE,
+            "low": float(row.low) / PRICE_SCALE,
+            "close": float(row.close) / PRICE_SCALE,
+            "volume": row.volume,
+            "spread": float(row.spread) / PRICE_SCALE,
+        }
+        for row in rows
+    ]
+
+
+class TickPersister(StreamPersister):
+    pattern = "ticks:*"
+
+    def parse(self, stream: str, entry_id, fields: dict) -> Optional[tuple]:
+        symbol_id = market_id(stream)
+        if symbol_id is None:
+            return None
+        fields = decode_fields(fields)
+        milliseconds, sequence = decode_entry_id(entry_id)
+        return (
+            symbol_id,
+            int(fields["t"]),
+            round(float(fields["b"]) * PRICE_SCALE),
+            round(float(fields["a"]) * PRICE_SCALE),
+            milliseconds * ENTRY_SEQ_SCALE + sequence,
+        )
+
+    async def write(self, records: list) -> tuple[int, int]:
+        async with AsyncSessionLocal() as session:
+            added = await copy_ticks(session, records)
+        return len(records), added
+
+
+tick_persister = create_persister(
+    TickPersister, settings.TICK_PERSISTER, "tick", settings.TICK_PERSISTER_GROUP,
+    settings.TICK_PERSISTER_BATCH_SIZE, settings.TICK_PERSISTER_BATCH_MS)
@@ -0,0 +1,89 @@
+# app/timeframes.py
+import re
+from dataclasses import dataclass
+from typing import Optional, Union
+
+MINUTES_PER_UNIT = {
+    "minute": 1,
+    "hour": 60,
+    "day": 1440,
+    "week": 10080,
+}
+
+# Broker style labels (M15, H4, D1, W1, MN1) and short labels (15m, 4h, 1d, 1w, 1mo)
+_LABEL_PATTERNS = (
+    (re.compile(r"^MN(\d+)$"), "month"),
+    (re.compile(r"^M(\d+)$"), "minute"),
+    (re.compile(r"^H(\d+)$"), "hour"),
+    (re.compile(r"^D(\d+)$"), "day"),
+    (re.compile(r"^W(\d+)$"), "week"),
+    (re.compile(r"^(\d+)mo$", re.IGNORECASE), "month"),
+    (re.compile(r"^(\d+)m$"), "minute"),
+    (re.compile(r"^(\d+)h$", re.IGNORECASE), "hour"),
+    (re.compile(r"^(\d+)d$", re.IGNORECASE), "day"),
+    (re.compile(r"^(\d+)w$", re.IGNORECASE), "week"),
+)
+
+
+@dataclass(frozen=True)
+class Timeframe:
+    amount: int
+    unit: str
+
+    @property
+    def minutes(self) -> Optional[int]:
+        """Fixed bucket width in minutes, None for calendar months."""
+        if self.unit == "month":
+            return None
+        return self.amount * MINUTES_PER_UNIT[self.unit]
+
+    @property
+    def interval(self) -> str:
+        """Bucket width as a Postgres interval literal."""
+        return f"{self.amount} {self.unit}s"
+
+    @property
+    def max_minutes(self) -> int:
+        """Upper bound of the bucket width in minutes."""
+        if self.unit == "month":
+            return self.amount * 31 * 1440
+        return self.minutes
+
+    @property
+    def label(self) -> str:
+        prefix = {"minute": "M", "hour": "H", "day": "D", "week": "W", "month": "MN"}
+        return f"{prefix[self.unit]}{self.amount}"
+
+    def divides(self, minutes: int) -> bool:
+        """Whether buckets of the given width nest exactly inside this timeframe's buckets."""
+        if self.unit == "month":
+            return 1440 % minutes == 0
+        return self.minutes % minutes == 0
+
+
+def parse_timeframe(value: Union[int, str]) -> Timeframe:
+    """
+    Parse a timeframe given in minutes or as a label
+
+    :param value: Minutes (e.g. 240 or "240") or a label such as M15, H4, D1, W1, MN1, 4h, 1mo
+
+    :return: Parsed timeframe
+    :rtype: Timeframe
+
+    :raises ValueError: If the timeframe cannot be parsed or is not positive
+    """
+    text = str(value).strip()
+    if text.isdigit():
+        timeframe = Timeframe(int(text), "minute")
+    else:
+        for pattern, unit in _LABEL_PATTERNS:
+            match = pattern.match(text)
+            if match:
+                timeframe = Timeframe(int(match.group(1)), unit)
+                break
+        else:
+            raise ValueError(f"Invalid timeframe: {value}")
+
+    if timeframe.amount <= 0:
+        raise ValueError(f"Timeframe must be positive: {value}")
+    return timeframe
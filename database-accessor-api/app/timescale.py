@@ -0,0 +1,457 @@
+# app/timescale.py
+"""
+TimescaleDB storage management for the candles table.
+
+The accessor applies the configured chunk interval, compression and reorder
+policies on startup. Existing installations with a populated plain ``candles``
+table are converted with the online migration command:
+
+    python -m app.timescale migrate [--compress-now] [--drop-legacy]
+    python -m app.timescale report
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+from datetime import timedelta
+
+from sqlalchemy import text
+
+from app import settings
+from app.database import engine, AsyncSessionLocal
+
+log = logging.getLogger(__name__)
+
+CANDLES_TABLE = "candles"
+MIGRATION_TABLE = "candles_hypertable"
+LEGACY_TABLE = "candles_legacy"
+
+
+async def is_hypertable(conn, table: str = CANDLES_TABLE) -> bool:
+    """
+    Check whether a table has been converted into a hypertable
+
+    :param conn: SQLAlchemy connection
+    :param table: Table name
+
+    :rtype: bool
+    """
+    result = await conn.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM timescaledb_information.hypertables
+            WHERE hypertable_name = :table
+        )
+    """), {"table": table})
+    return bool(result.scalar())
+
+
+async def setup_candles_storage() -> bool:
+    """
+    Make sure candles is a hypertable and apply chunk, compression and reorder settings.
+
+    An empty plain table is converted in place. A populated plain table is left
+    untouched because converting it would lock it for the whole copy; use the
+    ``migrate`` command for that.
+
+    :return: True if the storage settings were applied
+    :rtype: bool
+    """
+    async with engine.begin() as conn:
+        if not await is_hypertable(conn):
+            result = await conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {CANDLES_TABLE})"))
+            if result.scalar():
+                log.warning(
+                    "candles is a plain table with data, run "
+                    "`python -m app.timescale migrate` to convert it"
+                )
+                return False
+            await create_candles_hypertable(conn, CANDLES_TABLE)
+
+        await apply_storage_settings(conn, CANDLES_TABLE)
+    return True
+
+
+async def create_candles_hypertable(conn, table: str):
+    # The (symbol_id, timestamp) primary key already serves every query, so
+    # the default time index would only add write amplification.
+    await conn.execute(text(f"""
+        SELECT create_hypertable(
+            '{table}', 'timestamp',
+            chunk_time_interval => CAST(:interval AS TEXT)::interval,
+            create_default_indexes => false,
+            if_not_exists => true
+        )
+    """), {"interval": settings.CANDLES_CHUNK_INTERVAL})
+
+
+async def _primary_key_index(conn, table: str) -> str:
+    result = await conn.execute(text(f"""
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = '{table}'::regclass AND contype = 'p'
+    """))
+    return result.scalar_one()
+
+
+async def apply_storage_settings(conn, table: str):
+    await conn.execute(
+        text(f"SELECT set_chunk_time_interval('{table}', CAST(:interval AS TEXT)::interval)"),
+        {"interval": settings.CANDLES_CHUNK_INTERVAL},
+    )
+
+    if settings.CANDLES_COMPRESSION:
+        result = await conn.execute(text("""
+            SELECT compression_enabled FROM timescaledb_information.hypertables
+            WHERE hypertable_name = :table
+        """), {"table": table})
+        if not result.scalar():
+            await conn.execute(text(f"""
+                ALTER TABLE {table} SET (
+                    timescaledb.compress,
+                    timescaledb.compress_segmentby = 'symbol_id',
+                    timescaledb.compress_orderby = 'timestamp'
+                )
+            """))
+        await sync_interval_policy(
+            conn, "policy_compression", table,
+            {"compress_after": settings.CANDLES_COMPRESS_AFTER},
+            add_sql=f"""
+                SELECT add_compression_policy(
+                    '{table}', compress_after => CAST(:compress_after AS TEXT)::interval
+                )
+            """,
+            remove_sql=f"SELECT remove_compression_policy('{table}', if_exists => true)",
+        )
+    else:
+        await conn.execute(
+            text(f"SELECT remove_compression_policy('{table}', if_exists => true)"))
+
+    if settings.CANDLES_REORDER_POLICY:
+        index_name = await _primary_key_index(conn, table)
+        await conn.execute(text(
+            f"SELECT add_reorder_policy('{table}', '{index_name}', if_not_exists => true)"))
+    else:
+        await conn.execute(text(f"SELECT remove_reorder_policy('{table}', if_exists => true)"))
+
+
+async def sync_interval_policy(
+    conn, proc_name: str, table: str, config: dict, add_sql: str, remove_sql: str
+):
+    """
+    Add a background policy or replace it if one of its configured intervals changed
+
+    :param conn: SQLAlchemy connection
+    :param proc_name: Job procedure name, e.g. policy_compression
+    :param table: Hypertable or continuous aggregate name
+    :param config: Desired intervals by key inside the job config, as Postgres
+        interval strings or None for unset
+    :param add_sql: Statement adding the policy, using the config keys as parameters
+    :param remove_sql: Statement removing the policy
+    """
+    matches = " AND ".join(
+        f"(config ->> '{key}')::interval IS NOT DISTINCT FROM CAST(:{key} AS TEXT)::interval"
+        for key in config
+    )
+    result = await conn.execute(text(f"""
+        SELECT {matches}
+        FROM timescaledb_information.jobs
+        WHERE proc_name = :proc_name AND hypertable_name = :table
+    """), {**config, "proc_name": proc_name, "table": table})
+    row = result.first()
+    if row is not None and row[0]:
+        return
+    if row is not None:
+        await conn.execute(text(remove_sql))
+    await conn.execute(text(add_sql), config)
+
+
+async def storage_report() -> dict:
+    """
+    Report size and compression state of the candles table
+
+    :return: Storage statistics
+    :rtype: dict
+    """
+    async with engine.connect() as conn:
+        if not await is_hypertable(conn):
+            result = await conn.execute(
+                text(f"SELECT pg_total_relation_size('{CANDLES_TABLE}')"))
+            return {"hypertable": False, "total_bytes": result.scalar()}
+
+        result = await conn.execute(text(f"SELECT hypertable_size('{CANDLES_TABLE}')"))
+        total_bytes = result.scalar()
+
+        result = await conn.execute(text("""
+            SELECT count(*) AS chunks, count(*) FILTER (WHERE is_compressed) AS compressed
+            FROM timescaledb_information.chunks
+            WHERE hypertable_name = :table
+        """), {"table": CANDLES_TABLE})
+        chunks = result.one()
+
+        result = await conn.execute(text(f"""
+            SELECT
+                sum(before_compression_total_bytes) AS before_bytes,
+                sum(after_compression_total_bytes) AS after_bytes
+            FROM hypertable_compression_stats('{CANDLES_TABLE}')
+        """))
+        compression = result.one()
+
+    before_bytes = compression.before_bytes or 0
+    after_bytes = compression.after_bytes or 0
+    return {
+        "hypertable": True,
+        "total_bytes": total_bytes,
+        "chunks": chunks.chunks,
+        "compressed_chunks": chunks.compressed,
+        "compression": {
+            "before_bytes": before_bytes,
+            "after_bytes": after_bytes,
+            "saved_bytes": before_bytes - after_bytes,
+            "ratio": round(before_bytes / after_bytes, 2) if after_bytes else None,
+        },
+    }
+
+
+async def sample_queries(samples: int) -> list[dict]:
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            text("SELECT symbol_id FROM markets ORDER BY symbol_id LIMIT :samples"),
+            {"samples": samples},
+        )
+        symbol_ids = result.scalars().all()
+
+    queries = []
+    for symbol_id in symbol_ids:
+        queries.append({"symbol_id": symbol_id, "timeframe": 60, "limit": 1000})
+        queries.append({"symbol_id": symbol_id, "timeframe": 240, "limit": None})
+    return queries
+
+
+async def measure_query_latency(queries: list[dict], runs: int = 3) -> dict:
+    """
+    Time the candle aggregation query for a set of sample requests
+
+    The SQL of GET /candles is run directly, the candle cache and tail buffer
+    would otherwise answer the repeated runs from memory.
+
+    :param queries: List of dicts with symbol_id, timeframe and limit
+    :param runs: Number of runs per query, the median is reported
+
+    :return: Median latency in milliseconds keyed by a query label
+    :rtype: dict
+    """
+    # Imported here, app.aggregates imports this module
+    from app import aggregates
+    from app.aggregation import candles_query, tail_query, tail_scan_rows
+    from app.timeframes import parse_timeframe
+
+    latencies = {}
+    for query in queries:
+        timeframe = parse_timeframe(query["timeframe"])
+        source = aggregates.select_source(timeframe, 0)
+        params = {"symbol_id": query["symbol_id"]}
+        if query["limit"] is not None:
+            sql = tail_query(timeframe, source)
+            params.update(limit=query["limit"],
+                          scan_rows=tail_scan_rows(timeframe, source, query["limit"]))
+        else:
+            sql = candles_query(timeframe, source)
+
+        timings = []
+        for _ in range(runs):
+            async with AsyncSessionLocal() as session:
+                started = time.perf_counter()
+                result = await session.execute(sql, params)
+                result.fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+
+        label = f"symbol={query['symbol_id']} timeframe={query['timeframe']} " \
+            f"limit={query['limit']}"
+        latencies[label] = round(statistics.median(timings), 2)
+    return latencies
+
+
+async def chunk_interval_step(conn) -> timedelta:
+    result = await conn.execute(
+        text("SELECT EXTRACT(EPOCH FROM CAST(:interval AS TEXT)::interval)"),
+        {"interval": settings.CANDLES_CHUNK_INTERVAL},
+    )
+    return timedelta(seconds=float(result.scalar()))
+
+
+async def migrate_candles(
+    drop_legacy: bool = False, compress_now: bool = False, samples: int = 3
+) -> dict:
+    """
+    Convert a populated plain candles table into a compressed hypertable online.
+
+    Rows are copied chunk by chunk into a new hypertable, each window in its own
+    transaction, while the old table keeps serving reads and writes. The final
+    swap locks out writers only while the last window is caught up and the
+    tables are renamed. Historical backfills should be paused while migrating;
+    appends at the head of the series are picked up by the catch-up step.
+    An interrupted migration resumes from the last copied window. The old table
+    is kept as candles_legacy until dropped; its foreign key blocks deleting
+    markets until then.
+
+    :param drop_legacy: Drop the old table after the swap
+    :param compress_now: Compress all chunks older than the compression threshold
+    :param samples: Number of markets to use for the latency comparison
+
+    :return: Migration report with rows copied, storage and latency changes
+    :rtype: dict
+    """
+    async with engine.connect() as conn:
+        if await is_hypertable(conn):
+            return {"status": "already_hypertable", "storage": await storage_report()}
+        result = await conn.execute(text(f"SELECT pg_total_relation_size('{CANDLES_TABLE}')"))
+        before_bytes = result.scalar()
+        result = await conn.execute(
+            text(f"SELECT min(timestamp), max(timestamp) FROM {CANDLES_TABLE}"))
+        first_ts, last_ts = result.one()
+        step = await chunk_interval_step(conn)
+        result = await conn.execute(text("SELECT to_regclass(:table) IS NOT NULL"),
+                                    {"table": MIGRATION_TABLE})
+        resume = bool(result.scalar())
+
+    queries = await sample_queries(samples)
+    before_latency = await measure_query_latency(queries)
+
+    async with engine.begin() as conn:
+        if resume:
+            result = await conn.execute(text(f"SELECT max(timestamp) FROM {MIGRATION_TABLE}"))
+            resume_ts = result.scalar()
+            if resume_ts is not None and first_ts is not None:
+                first_ts = max(first_ts, resume_ts - step)
+            log.info("Resuming candles migration from %s", first_ts)
+        else:
+            await conn.execute(text(f"""
+                CREATE TABLE {MIGRATION_TABLE}
+                (LIKE {CANDLES_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+            """))
+            await conn.execute(text(
+                f"ALTER TABLE {MIGRATION_TABLE} ADD PRIMARY KEY (symbol_id, timestamp)"))
+            await conn.execute(text(f"""
+                ALTER TABLE {MIGRATION_TABLE}
+                ADD FOREIGN KEY (symbol_id) REFERENCES markets (symbol_id)
+            """))
+            await create_candles_hypertable(conn, MIGRATION_TABLE)
+
+    copy_sql = text(f"""
+        INSERT INTO {MIGRATION_TABLE}
+        SELECT * FROM {CANDLES_TABLE}
+        WHERE timestamp >= :lower AND timestamp < :upper
+        ON CONFLICT DO NOTHING
+    """)
+    rows_copied = 0
+    window_start = first_ts
+    while first_ts is not None and window_start <= last_ts:
+        window_end = window_start + step
+        async with engine.begin() as conn:
+            result = await conn.execute(copy_sql, {"lower": window_start, "upper": window_end})
+            rows_copied += result.rowcount
+        log.info("Copied candles up to %s (%d rows)", window_end, rows_copied)
+        window_start = window_end
+
+    async with engine.begin() as conn:
+        await conn.execute(text(f"LOCK TABLE {CANDLES_TABLE} IN SHARE ROW EXCLUSIVE MODE"))
+        catch_up_from = (window_start - step) if first_ts is not None else None
+        result = await conn.execute(text(f"""
+            INSERT INTO {MIGRATION_TABLE}
+            SELECT * FROM {CANDLES_TABLE}
+            WHERE timestamp >= :lower OR CAST(:lower AS TIMESTAMP) IS NULL
+            ON CONFLICT DO NOTHING
+        """), {"lower": catch_up_from})
+        rows_copied += result.rowcount
+        await conn.execute(text(f"ALTER TABLE {CANDLES_TABLE} RENAME TO {LEGACY_TABLE}"))
+        await conn.execute(text(f"ALTER TABLE {MIGRATION_TABLE} RENAME TO {CANDLES_TABLE}"))
+        await apply_storage_settings(conn, CANDLES_TABLE)
+
+    compressed_chunks = await compress_chunks() if compress_now else 0
+
+    if drop_legacy:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP TABLE {LEGACY_TABLE}"))
+
+    storage = await storage_report()
+    after_latency = await measure_query_latency(queries)
+    return {
+        "status": "migrated",
+        "rows_copied": rows_copied,
+        "legacy_table": None if drop_legacy else LEGACY_TABLE,
+        "compressed_chunks": compressed_chunks,
+        "storage": {
+            "before_bytes": before_bytes,
+            "after_bytes": storage["total_bytes"],
+            "saved_bytes": before_bytes - storage["total_bytes"],
+            "compression": storage["compression"],
+        },
+        "latency_ms": {
+            query: {"before": before_latency[query], "after": after_latency.get(query)}
+            for query in before_latency
+        },
+    }
+
+
+async def compress_chunks() -> int:
+    """
+    Compress every chunk older than the compression threshold, one per transaction
+
+    :return: Number of chunks compressed
+    :rtype: int
+    """
+    async with engine.connect() as conn:
+        result = await conn.execute(text(f"""
+            SELECT show_chunks('{CANDLES_TABLE}',
+                               older_than => CAST(:after AS TEXT)::interval)::text
+        """), {"after": settings.CANDLES_COMPRESS_AFTER})
+        chunks = result.scalars().all()
+
+    for chunk in chunks:
+        async with engine.begin() as conn:
+            await conn.execute(
+                text("SELECT compress_chunk(CAST(:chunk AS TEXT)::regclass, "
+                     "if_not_compressed => true)"),
+                {"chunk": chunk},
+            )
+        log.info("Compressed %s", chunk)
+    return len(chunks)
+
+
+async def _run(args) -> dict:
+    try:
+        if args.command == "setup":
+            applied = await setup_candles_storage()
+            return {"applied": applied, "storage": await storage_report()}
+        if args.command == "migrate":
+            return await migrate_candles(
+                drop_legacy=args.drop_legacy,
+                compress_now=args.compress_now,
+                samples=args.samples,
+            )
+        return await storage_report()
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage TimescaleDB storage of candles")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("setup", help="Apply chunk, compression and reorder settings")
+    migrate = commands.add_parser("migrate", help="Convert a plain candles table online")
+    migrate.add_argument("--drop-legacy", action="store_true",
+                         help="Drop the old table after the swap")
+    migrate.add_argument("--compress-now", action="store_true",
+                         help="Compress eligible chunks right after the swap")
+    migrate.add_argument("--samples", type=int, default=3,
+                         help="Number of markets used to compare query latency")
+    commands.add_parser("report", help="Print storage and compression statistics")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=settings.LOG_LEVEL)
+    print(json.dumps(asyncio.run(_run(args)), indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# app/versions.py
+"""
+Per-symbol data versions and change log of candles.
+
+Every write to a symbol's candles sets a new version, drawn from a global
+sequence so a version is never reused, in the same transaction as the write.
+Candle responses carry an ETag derived from the version and the request, and
+a Last-Modified of the last write.
+
+The write also appends the written time range to candle_changes under the
+same sequence number, which lets clients fetch only the buckets changed
+since a version they have seen. Changes older than CANDLE_CHANGES_RETENTION
+are pruned; the newest pruned sequence of a symbol is kept as its
+changes_floor so clients behind it know to reload.
+"""
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from sqlalchemy import text
+
+from app import settings
+from app.database import engine
+
+log = logging.getLogger(__name__)
+
+VERSIONS_TABLE = "candle_versions"
+VERSIONS_SEQUENCE = "candle_versions_seq"
+CHANGES_TABLE = "candle_changes"
+
+
+async def setup_candle_versions():
+    """
+    Create the versions and changes tables and give every market without a
+    version one. Their history starts there, so it is also their changes_floor.
+    """
+    async with engine.begin() as conn:
+        await conn.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {VERSIONS_SEQUENCE}"))
+        await conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} (
+                symbol_id INTEGER PRIMARY KEY REFERENCES markets (symbol_id) ON DELETE CASCADE,
+                version BIGINT NOT NULL,
+                last_modified TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """))
+        await conn.execute(text(f"""
+            ALTER TABLE {VERSIONS_TABLE}
+            ADD COLUMN IF NOT EXISTS changes_floor BIGINT NOT NULL DEFAULT 0
+        """))
+        await conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (
+                seq BIGINT PRIMARY KEY,
+                symbol_id INTEGER NOT NULL REFERENCES markets (symbol_id) ON DELETE CASCADE,
+                min_ts TIMESTAMP,
+                max_ts TIMESTAMP,
+                changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """))
+        await conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS {CHANGES_TABLE}_symbol_id_seq_idx
+            ON {CHANGES_TABLE} (symbol_id, seq)
+        """))
+        # Versions set before the change log existed have no history to replay
+        await conn.execute(text(f"""
+            UPDATE {VERSIONS_TABLE} v SET changes_floor = version
+            WHERE changes_floor = 0
+                AND NOT EXISTS (SELECT 1 FROM {CHANGES_TABLE} c WHERE c.symbol_id = v.symbol_id)
+        """))
+        await conn.execute(text(f"""
+            INSERT INTO {VERSIONS_TABLE} (symbol_id, version, changes_floor)
+            SELECT symbol_id, version, version
+            FROM (SELECT symbol_id, nextval('{VERSIONS_SEQUENCE}') AS version FROM markets) m
+            ON CONFLICT (symbol_id) DO NOTHING
+        """))
+
+
+async def record_changes(session, changes: dict):
+    """
+    Set a new version for symbols and log the written ranges, to be called
+    inside the writing transaction
+
+    The version row is locked before the sequence is drawn, so concurrent
+    writes of a symbol take their versions in the order they commit and a
+    symbol's version never goes back.
+
+    :param session: SQLAlchemy session
+    :param changes: symbol_id to the (first, last) written timestamp, or to
+        None when all candles of the symbol were replaced
+    """
+    for symbol_id in sorted(changes):
+        first, last = changes[symbol_id] or (None, None)
+        # Waits for other writers of the symbol until they commit
+        await session.execute(text(f"""
+            INSERT INTO {VERSIONS_TABLE} (symbol_id, version)
+            VALUES (:symbol_id, 0)
+            ON CONFLICT (symbol_id) DO UPDATE SET version = {VERSIONS_TABLE}.version
+        """), {"symbol_id": symbol_id})
+        await session.execute(text(f"""
+            WITH bumped AS (
+                UPDATE {VERSIONS_TABLE}
+                SET version = nextval('{VERSIONS_SEQUENCE}'), last_modified = now()
+                WHERE symbol_id = :symbol_id
+                RETURNING version
+            )
+            INSERT INTO {CHANGES_TABLE} (seq, symbol_id, min_ts, max_ts)
+            SELECT version, :symbol_id, CAST(:first AS TIMESTAMP), CAST(:last AS TIMESTAMP)
+            FROM bumped
+        """), {"symbol_id": symbol_id, "first": first, "last": last})
+
+
+async def get_version(session, symbol_id: int) -> Optional[tuple[int, datetime]]:
+    """
+    Get the data version of a symbol
+
+    :return: Version and last modification time, None if the symbol has none
+    :rtype: Optional[tuple[int, datetime]]
+    """
+    result = await session.execute(text(f"""
+        SELECT version, last_modified FROM {VERSIONS_TABLE} WHERE symbol_id = :symbol_id
+    """), {"symbol_id": symbol_id})
+    row = result.first()
+    return (row.version, row.last_modified) if row else None
+
+
+async def get_changes(session, symbol_id: int, since: int) -> tuple[Optional[dict], list]:
+    """
+    Get the changes of a symbol after a version
+
+    :param session: SQLAlchemy session
+    :param symbol_id: Market symbol_id
+    :param since: Version the client has seen
+
+    :return: The symbol's version row (version, last_modified, changes_floor),
+        None if it has none, and the changes as (seq, min_ts, max_ts) oldest first
+    :rtype: tuple[Optional[dict], list]
+    """
+    result = await session.execute(text(f"""
+        SELECT version, last_modified, changes_floor FROM {VERSIONS_TABLE}
+        WHERE symbol_id = :symbol_id
+    """), {"symbol_id": symbol_id})
+    row = result.first()
+    if row is None:
+        return None, []
+
+    result = await session.execute(text(f"""
+        SELECT seq, min_ts, max_ts FROM {CHANGES_TABLE}
+        WHERE symbol_id = :symbol_id AND seq > :since AND seq <= :version
+        ORDER BY seq
+    """), {"symbol_id": symbol_id, "since": since, "version": row.version})
+    return dict(row._mapping), result.fetchall()
+
+
+async def version_at(session, symbol_id: int, timestamp: datetime) -> Optional[int]:
+    """
+    Get the newest change sequence of a symbol at a point in time
+
+    :return: The sequence, None if no retained change is that old
+    :rtype: Optional[int]
+    """
+    result = await session.execute(text(f"""
+        SELECT max(seq) FROM {CHANGES_TABLE}
+        WHERE symbol_id = :symbol_id AND changed_at <= :timestamp
+    """), {"symbol_id": symbol_id, "timestamp": timestamp})
+    return result.scalar()
+
+
+async def prune_changes() -> int:
+    """
+    Delete changes older than CANDLE_CHANGES_RETENTION and raise changes_floor
+
+    :return: Number of pruned changes
+    :rtype: int
+    """
+    async with engine.begin() as conn:
+        result = await conn.execute(text(f"""
+            WITH pruned AS (
+                DELETE FROM {CHANGES_TABLE}
+                WHERE changed_at < now() - CAST(:retention AS TEXT)::interval
+                RETURNING symbol_id, seq
+            ),
+            floors AS (
+                SELECT symbol_id, max(seq) AS seq, count(*) AS pruned
+                FROM pruned GROUP BY symbol_id
+            ),
+            updated AS (
+                UPDATE {VERSIONS_TABLE} v
+                SET changes_floor = GREATEST(v.changes_floor, floors.seq)
+                FROM floors
+                WHERE v.symbol_id = floors.symbol_id
+            )
+            SELECT COALESCE(sum(pruned), 0) FROM floors
+        """), {"retention": settings.CANDLE_CHANGES_RETENTION})
+        return int(result.scalar())
+
+
+async def run_pruning(interval: int):
+    """Prune the change log every interval seconds until cancelled."""
+    while True:
+        try:
+            pruned = await prune_changes()
+            if pruned:
+                log.info("Pruned %s candle changes", pruned)
+        except Exception as exc:
+            log.warning("Failed to prune candle changes: %s", exc)
+        await asyncio.sleep(interval)
+
+
+def make_etag(version: int, *variant) -> str:
+    """
+    Build a strong ETag from a data version and everything else that shapes
+    the representation, e.g. the query string and the media type
+    """
+    digest = hashlib.sha1(repr(variant).encode()).hexdigest()[:16]
+    return f'"{version}-{digest}"'
+
+
+def http_date(timestamp: datetime) -> str:
+    return format_datetime(timestamp.astimezone(timezone.utc), usegmt=True)
+
+
+def not_modified(headers, etag: str, last_modified: datetime) -> bool:
+    """
+    Evaluate If-None-Match, or If-Modified-Since when no If-None-Match is sent
+
+    :param headers: Request headers
+    :param etag: Current ETag
+    :param last_modified: Current last modification time
+
+    :rtype: bool
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
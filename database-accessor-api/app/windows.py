@@ -0,0 +1,310 @@
+# app/windows.py
+"""
+Rolling window indicators evaluated in Postgres over the aggregated candles.
+
+Long range indicators such as a moving average over years of bars only need
+a few columns back, not the candles. GET /candles/{symbol_id}/windows runs a
+whitelisted set of window functions inside the aggregation query and returns
+only their columns. Specs are given as ``function(source,window)``:
+
+- ``sma(source,n)``: average of the last n bars
+- ``min(source,n)`` / ``max(source,n)``: lowest / highest of the last n bars
+- ``std(source,n)``: sample standard deviation of the last n bars, like pandas
+- ``sum(source,n)``: sum of the last n bars
+- ``vwap(n)``: volume weighted typical price (high + low + close) / 3 of the
+  last n bars, ``vwap()`` is cumulative from the first returned bar
+- ``cum_return(source)``: source / source of the first returned bar - 1
+
+Sources are open, high, low, close and volume. Rolling values are null until
+n bars are available, like pandas' rolling. The scan starts far enough before
+the requested range for the longest window, found with a backward index scan
+like tail_query, so the first returned bars have complete windows as long as
+the history does.
+
+With the compact layout (see app/compact.py) the windows run on the stored
+min_move steps and the price valued columns are scaled back afterwards; the
+layout is told from the type of the stored columns like on other reads.
+"""
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import text
+
+from app import aggregates
+from app.aggregation import bucket_expression, tail_scan_rows, time_conditions
+from app.compact import candle_layout, price_decimals
+from app.timeframes import Timeframe
+
+ROLLING = ("sma", "min", "max", "std", "sum", "vwap")
+CUMULATIVE = ("cum_return", "vwap")
+SOURCES = ("open", "high", "low", "close", "volume")
+# Longest window accepted
+MAX_WINDOW = 10000
+# Specs accepted per request
+MAX_SPECS = 16
+
+_SPEC = re.compile(r"^\s*(\w+)\s*\(\s*([\w\s,]*)\)\s*$")
+_AGGREGATES = {"sma": "avg", "min": "min", "max": "max", "std": "stddev_samp", "sum": "sum"}
+
+
+@dataclass(frozen=True)
+class WindowSpec:
+    function: str
+    source: Optional[str] = None
+    window: Optional[int] = None
+
+    @property
+    def name(self) -> str:
+        """Output column name: function and arguments joined by _, e.g. sma_close_20."""
+        return "_".join(str(part) for part in (self.function, self.source, self.window)
+                        if part is not None)
+
+    @property
+    def price_valued(self) -> bool:
+        """Whether the values are prices, scaled with the compact layout."""
+        return self.function == "vwap" or (
+            self.function != "cum_return" and self.source != "volume")
+
+
+def parse_window_spec(value: str) -> WindowSpec:
+    """
+    Parse a window spec such as sma(close,20), vwap(20) or cum_return(close)
+
+    :raises ValueError: If the function, source or window is not allowed
+    """
+    match = _SPEC.match(value)
+    if match is None:
+        raise ValueError(f"Invalid window spec: {value}, expected function(source,window)")
+    function = match.group(1)
+    args = [arg.strip() for arg in match.group(2).split(",") if arg.strip()]
+
+    if function == "vwap":
+        if len(args) > 1:
+            raise ValueError("vwap takes an optional window only")
+        return WindowSpec(function, None, _window(args[0]) if args else None)
+    if function == "cum_return":
+        if len(args) != 1:
+            raise ValueError("cum_return takes a source only")
+        return WindowSpec(function, _source(args[0]))
+    if function not in ROLLING:
+        allowed = ", ".join(sorted(set(ROLLING + CUMULATIVE)))
+        raise ValueError(f"Unknown window function: {function}, expected one of {allowed}")
+    if len(args) != 2:
+        raise ValueError(f"{function} takes a source and a window")
+    return WindowSpec(function, _source(args[0]), _window(args[1]))
+
+
+def parse_window_specs(values: list[str]) -> list[WindowSpec]:
+    """
+    Parse window specs, each value may hold several specs separated by ;
+
+    :raises ValueError: If a spec is invalid, none or too many are given
+    """
+    specs = []
+    for value in values:
+        specs.extend(parse_window_spec(part) for part in value.split(";") if part.strip())
+    if not specs:
+        raise ValueError("No window spec given")
+    if len(specs) > MAX_SPECS:
+        raise ValueError(f"At most {MAX_SPECS} window specs per request")
+    # Duplicates would give duplicate columns
+    return list(dict.fromkeys(specs))
+
+
+def _source(value: str) -> str:
+    if value not in SOURCES:
+        raise ValueError(f"Unknown source: {value}, expected one of {', '.join(SOURCES)}")
+    return value
+
+
+def _window(value: str) -> int:
+    if not value.isdigit() or not 1 <= int(value) <= MAX_WINDOW:
+        raise ValueError(f"Window must be a whole number from 1 to {MAX_WINDOW}")
+    return int(value)
+
+
+def _rolling_expression(spec: WindowSpec) -> str:
+    frame = f"w{spec.window}"
+    if spec.function == "vwap":
+        value = (f"sum((high + low + close) / 3 * volume) OVER {frame}"
+                 f" / NULLIF(sum(volume) OVER {frame}, 0)")
+    else:
+        value = f"{_AGGREGATES[spec.function]}({spec.source}) OVER {frame}"
+    return f"CASE WHEN count(*) OVER {frame} >= {spec.window} THEN {value} END"
+
+
+def _cumulative_expression(spec: WindowSpec) -> str:
+    if spec.function == "vwap":
+        return ("sum((high + low + close) / 3 * volume) OVER running"
+                " / NULLIF(sum(volume) OVER running, 0)")
+    return f"{spec.source} / NULLIF(first_value({spec.source}) OVER running, 0) - 1"
+
+
+def is_rolling(spec: WindowSpec) -> bool:
+    return spec.window is not None
+
+
+def warmup_bars(specs: list[WindowSpec]) -> int:
+    """Bars needed before the first returned bar for complete windows."""
+    return max((spec.window - 1 for spec in specs if is_rolling(spec)), default=0)
+
+
+def window_query(
+    timeframe: Timeframe,
+    source: aggregates.CandleSource,
+    specs: list[WindowSpec],
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+):
+    """
+    Build the window query for one symbol
+
+    Binds :symbol_id, and :start_date, :end_date, :limit, :start_scan_rows and
+    :tail_scan_rows when used. Rows are ordered oldest first, the newest
+    :limit of the range when a limit is given.
+
+    :param timeframe: Requested timeframe
+    :param source: Relation to aggregate, raw candles or a continuous aggregate
+    :param specs: Validated window specs
+    :param start_date: Inclusive lower bound (optional)
+    :param end_date: Exclusive upper bound (optional)
+    :param limit: Maximum number of buckets (optional)
+    :param offset: Session offset in minutes
+
+    :return: SQLAlchemy text clause
+    """
+    bucket = bucket_expression(timeframe, offset)
+    warmup = warmup_bars(specs)
+    ctes = []
+    lower = ""
+    # Step back over the warmup bars with a backward index scan, widened to a
+    # whole bucket; without enough history the scan starts at the oldest row
+    edges = []
+    if start_date is not None:
+        if warmup:
+            edges.append(("start_edge", "timestamp < :start_date", ":start_scan_rows"))
+        else:
+            lower += " AND timestamp >= :start_date"
+    if limit is not None:
+        edges.append(("tail_edge", "timestamp < :end_date" if end_date is not None else "TRUE",
+                      ":tail_scan_rows"))
+    for name, condition, scan_rows in edges:
+        ctes.append(f"""
+        {name} AS (
+            SELECT timestamp
+            FROM {source.relation}
+            WHERE symbol_id = :symbol_id AND {condition}
+            ORDER BY timestamp DESC
+            OFFSET {scan_rows}
+            LIMIT 1
+        )""")
+        lower += f" AND timestamp >= COALESCE((SELECT {bucket} FROM {name}), '-infinity')"
+
+    windows = sorted({spec.window for spec in specs if is_rolling(spec)})
+    rolling = [f"{_rolling_expression(spec)} AS {spec.name}" for spec in specs
+               if is_rolling(spec)]
+    cumulative = [f"{_cumulative_expression(spec)} AS {spec.name}" for spec in specs
+                  if not is_rolling(spec)]
+    window_clause = ", ".join(
+        f"w{window} AS (ORDER BY timestamp ROWS BETWEEN {window - 1} PRECEDING AND CURRENT ROW)"
+        for window in windows)
+
+    # Prices are cast so the windows also work on the integer compact layout,
+    # steps tells whether they were stored as min_move steps
+    ctes.append(f"""
+        buckets AS (
+            SELECT
+                {bucket} AS timestamp,
+                pg_typeof(max(high)) IN ('integer'::regtype, 'bigint'::regtype) AS steps,
+                first(open, timestamp)::float8 AS open,
+                max(high)::float8 AS high,
+                min(low)::float8 AS low,
+                last(close, timestamp)::float8 AS close,
+                sum(volume)::float8 AS volume
+            FROM {source.relation}
+            WHERE symbol_id = :symbol_id{time_conditions(None, end_date)}{lower}
+            GROUP BY 1
+        )""")
+    ctes.append(f"""
+        rolling AS (
+            SELECT {", ".join(["*"] + rolling)}
+            FROM buckets
+            {f"WINDOW {window_clause}" if window_clause else ""}
+        )""")
+    ctes.append(f"""
+        selected AS (
+            SELECT *
+            FROM rolling
+            {"WHERE timestamp >= :start_date" if start_date is not None else ""}
+            {"ORDER BY timestamp DESC LIMIT :limit" if limit is not None else ""}
+        )""")
+
+    columns = ["timestamp", "steps"] \
+        + [spec.name for spec in specs if is_rolling(spec)] + cumulative
+    return text(f"""
+        WITH {",".join(ctes)}
+        SELECT {", ".join(columns)}
+        FROM selected
+        {"WINDOW running AS (ORDER BY timestamp)" if cumulative else ""}
+        ORDER BY timestamp
+    """)
+
+
+async def get_window_columns(
+    session, symbol_id: int, timeframe: Timeframe, specs: list[WindowSpec],
+    start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+    limit: Optional[int] = None, offset: int = 0
+) -> dict:
+    """
+    Evaluate window specs over the aggregated candles of one market
+
+    :param session: SQLAlchemy session
+    :param symbol_id: Market symbol_id
+    :param timeframe: Timeframe of the candles
+    :param specs: Validated window specs
+    :param start_date: Inclusive start of the returned range (optional)
+    :param end_date: Exclusive end of the returned range (optional)
+    :param limit: Return only the newest bars (optional)
+    :param offset: Session offset in minutes (optional)
+
+    :return: timestamp and one list per spec name, oldest first, None where
+        the window is incomplete
+    :rtype: dict[str, list]
+
+    :raises LookupError: If the market does not exist
+    """
+    # Raises for unknown markets, and gives the scale of compact prices
+    min_move = await candle_layout.min_move(session, symbol_id)
+
+    source = aggregates.select_source(timeframe, offset)
+    warmup = warmup_bars(specs)
+    params = {"symbol_id": symbol_id, "start_date": start_date, "end_date": end_date}
+    if start_date is not None and warmup:
+        params["start_scan_rows"] = tail_scan_rows(timeframe, source, warmup)
+    if limit is not None:
+        params["limit"] = limit
+        params["tail_scan_rows"] = tail_scan_rows(timeframe, source, limit + warmup)
+
+    sql = window_query(timeframe, source, specs, start_date, end_date, limit, offset)
+    result = await session.execute(sql, params)
+    rows = result.fetchall()
+
+    columns = {"timestamp": [row.timestamp for row in rows]}
+    # The layout is detected from the stored column types, not from
+    # candle_layout, so results are right straight after a migration
+    steps = bool(rows) and rows[0].steps
+    digits = price_decimals(min_move)
+    for spec in specs:
+        values = [row._mapping[spec.name] for row in rows]
+        if steps and spec.price_valued:
+            # Extremes are stored prices, averages are not rounded
+            exact = spec.function in ("min", "max")
+            values = [None if value is None
+                      else round(value * min_move, digits) if exact else value * min_move
+                      for value in values]
+        columns[spec.name] = values
+    return columns
@@ -0,0 +1,288 @@
+# app/writebuffer.py
+"""
+Write-behind buffer for small candle inserts.
+
+POST /candles with mode=buffered (or CANDLES_INGEST_MODE=buffered) queues the
+candles in memory and returns right away instead of paying a transaction and
+commit per request. Queued candles are grouped per market across requests, a
+later candle of the same market and timestamp replacing an earlier one, and
+written together once CANDLE_WRITE_BUFFER_ROWS candles are queued or
+CANDLE_WRITE_BUFFER_MS have passed since the first one: in one insert
+statement, or with COPY above the 4681 candles a statement can hold.
+
+Writes are like any other candle ingest, existing candles are kept and the
+change log, coverage index, caches and tail buffer are updated on flush, so
+queued candles are not visible to reads yet. When a flush fails, each market
+is written on its own so one bad candle does not hold back the others; the
+markets that still fail are queued again, newer candles winning, and retried.
+A market whose writes failed CANDLE_WRITE_BUFFER_ATTEMPTS times while other
+markets were written has its queued candles dropped and logged. Failures of
+every market are taken for the database and retried without a limit.
+Candles of markets deleted in the meantime are dropped.
+
+The buffer is per worker process and only as durable as the process: it is
+flushed on shutdown, but candles queued when a worker crashes are lost.
+Requests wait for a flush once CANDLE_WRITE_BUFFER_MAX_ROWS candles are
+queued, so a slow database pushes back on writers instead of growing the
+queue without bound.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import text
+
+from app import crud, settings
+from app.database import AsyncSessionLocal
+
+log = logging.getLogger(__name__)
+
+# Candles one insert statement can hold, larger flushes use COPY
+INSERT_ROWS = 4681
+# Seconds to wait before retrying a failed flush
+RETRY_DELAY = 5
+
+
+class CandleWriteBuffer:
+    def __init__(self, flush_rows: int, flush_ms: int, max_rows: int, max_attempts: int):
+        self.flush_rows = flush_rows
+        self.flush_ms = flush_ms
+        self.max_rows = max(max_rows, flush_rows)
+        self.max_attempts = max(max_attempts, 1)
+        self.queued = 0
+        self.accepted = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.added = 0
+        self.dropped = 0
+        self.failed_dropped = 0
+        self.failures = 0
+        self.waits = 0
+        self.max_queued = 0
+        self.flush_seconds = 0.0
+        self.last_flush_at: Optional[datetime] = None
+        self.running = False
+        # Queued candles by symbol_id, then by timestamp
+        self._pending: dict[int, dict[datetime, dict]] = {}
+        # Failed writes by symbol_id since its last successful one
+        self._attempts: dict[int, int] = {}
+        self._first_at: Optional[float] = None
+        self._wake = asyncio.Event()
+        self._space = asyncio.Condition()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = asyncio.Event()
+
+    async def add(self, symbol_id: int, candles: list[dict]) -> int:
+        """
+        Queue candles of a market
+
+        Waits for a flush while the buffer is full.
+
+        :param symbol_id: Market symbol_id
+        :param candles: Candles with timestamp, open, high, low, close and volume
+
+        :return: Number of candles queued after adding these
+        :rtype: int
+
+        :raises RuntimeError: If the buffer is not running
+        """
+        async with self._space:
+            if self.queued >= self.max_rows:
+                self.waits += 1
+                self._wake.set()
+                await self._space.wait_for(
+                    lambda: self.queued < self.max_rows or not self.running)
+        if not self.running:
+            raise RuntimeError("Candle write buffer is not running")
+
+        queue = self._pending.setdefault(symbol_id, {})
+        for candle in candles:
+            if candle["timestamp"] in queue:
+                self.coalesced += 1
+            queue[candle["timestamp"]] = {"symbol_id": symbol_id, **candle}
+        self.queued = sum(len(queue) for queue in self._pending.values())
+        self.accepted += len(candles)
+        self.max_queued = max(self.max_queued, self.queued)
+        if self._first_at is None:
+            self._first_at = time.monotonic()
+        self._wake.set()
+        return self.queued
+
+    async def run(self):
+        """Flush on size or time until stop() is called or cancelled, then flush the rest."""
+        self.running = True
+        try:
+            while not self._stopping.is_set():
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self._timeout())
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                if not self._due():
+                    continue
+                try:
+                    await self.flush()
+                except Exception as exc:
+                    log.warning("Failed to flush %s buffered candles, retrying in %ss: %s",
+                                self.queued, RETRY_DELAY, exc)
+                    try:
+                        await asyncio.wait_for(self._stopping.wait(), RETRY_DELAY)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            self.running = False
+            try:
+                await self.flush()
+            except Exception as exc:
+                log.error("Lost %s buffered candles on shutdown: %s", self.queued, exc)
+            async with self._space:
+                self._space.notify_all()
+
+    def stop(self):
+        """Flush the queued candles and stop."""
+        self._stopping.set()
+        self._wake.set()
+
+    def _timeout(self) -> Optional[float]:
+        if self._first_at is None:
+            return None
+        return max(self._first_at + self.flush_ms / 1000 - time.monotonic(), 0)
+
+    def _due(self) -> bool:
+        if self._first_at is None:
+            return False
+        return self.queued >= self.flush_rows or self._stopping.is_set() \
+            or time.monotonic() >= self._first_at + self.flush_ms / 1000
+
+    async def flush(self) -> int:
+        """
+        Write all queued candles
+
+        :return: Number of candles added
+        :rtype: int
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            self._first_at = None
+            self.queued = 0
+            started = time.perf_counter()
+            failed: dict[int, Exception] = {}
+            try:
+                added = await self._write(pending)
+                self._attempts.clear()
+            except Exception as exc:
+                self.failures += 1
+                if len(pending) > 1:
+                    log.warning("Failed to flush %s buffered candles of %s markets, "
+                                "writing them per market: %s",
+                                sum(len(queue) for queue in pending.values()), len(pending), exc)
+                    added, failed = await self._write_each(pending)
+                else:
+                    added, failed = 0, dict.fromkeys(pending, exc)
+                self._retry(pending, failed)
+            finally:
+                async with self._space:
+                    self._space.notify_all()
+
+            rows = sum(len(queue) for symbol_id, queue in pending.items()
+                       if symbol_id not in failed)
+            self.flush_seconds += time.perf_counter() - started
+            self.flushes += 1
+            self.flushed += rows
+            self.added += added
+            self.last_flush_at = datetime.now(timezone.utc)
+            if failed:
+                raise next(iter(failed.values()))
+            return added
+
+    async def _write_each(
+        self, pending: dict[int, dict[datetime, dict]]
+    ) -> tuple[int, dict[int, Exception]]:
+        """Write the markets one by one, returning the candles added and the failures."""
+        added = 0
+        failed = {}
+        for symbol_id, queue in pending.items():
+            try:
+                added += await self._write({symbol_id: queue})
+                self._attempts.pop(symbol_id, None)
+            except Exception as exc:
+                failed[symbol_id] = exc
+        return added, failed
+
+    def _retry(self, pending: dict[int, dict[datetime, dict]], failed: dict[int, Exception]):
+        """Queue the failed markets again, dropping those out of attempts."""
+        # Only count attempts when other markets could be written, if none
+        # could the database is the likely cause
+        counted = len(failed) < len(pending)
+        for symbol_id, exc in failed.items():
+            queue = pending[symbol_id]
+            attempts = self._attempts.get(symbol_id, 0) + counted
+            if attempts >= self.max_attempts:
+                log.error("Dropping %s buffered candles of market %s after %s failed "
+                          "writes: %s", len(queue), symbol_id, attempts, exc)
+                self.failed_dropped += len(queue)
+                self._attempts.pop(symbol_id, None)
+                continue
+            self._attempts[symbol_id] = attempts
+            # Candles queued during the write are newer
+            self._pending[symbol_id] = {**queue, **self._pending.get(symbol_id, {})}
+        self.queued = sum(len(queue) for queue in self._pending.values())
+        if self._pending:
+            self._first_at = self._first_at or time.monotonic()
+
+    async def _write(self, pending: dict[int, dict[datetime, dict]]) -> int:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                text("SELECT symbol_id FROM markets WHERE symbol_id = ANY(:symbol_ids)"),
+                {"symbol_ids": list(pending)})
+            existing = set(result.scalars().all())
+            for symbol_id in set(pending) - existing:
+                log.warning("Dropping %s buffered candles of deleted market %s",
+                            len(pending[symbol_id]), symbol_id)
+                self.dropped += len(pending.pop(symbol_id))
+
+            values = [candle for queue in pending.values() for candle in queue.values()]
+            if not values:
+                return 0
+            if len(values) <= INSERT_ROWS:
+                return await crud.insert_candle_records(session, values)
+            report = await crud.copy_candle_records(session, [
+                (value["symbol_id"], crud.naive_utc(value["timestamp"]), value["open"],
+                 value["high"], value["low"], value["close"], value["volume"])
+                for value in values
+            ])
+            return report["added_candles"]
+
+    def stats(self) -> dict:
+        """Queue depth, flush counters and write throughput."""
+        return {
+            "running": self.running,
+            "queued_candles": self.queued,
+            "queued_markets": len(self._pending),
+            "oldest_queued_ms": round((time.monotonic() - self._first_at) * 1000)
+            if self._first_at is not None else None,
+            "max_queued_candles": self.max_queued,
+            "accepted": self.accepted,
+            "coalesced": self.coalesced,
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "added": self.added,
+            "duplicates_skipped": self.flushed - self.added,
+            "dropped": self.dropped,
+            "failed_dropped": self.failed_dropped,
+            "failures": self.failures,
+            "full_waits": self.waits,
+            "rows_per_sec": round(self.flushed / self.flush_seconds)
+            if self.flush_seconds else None,
+            "last_flush_at": self.last_flush_at,
+        }
+
+
+candle_write_buffer = CandleWriteBuffer(
+    settings.CANDLE_WRITE_BUFFER_ROWS, settings.CANDLE_WRITE_BUFFER_MS,
+    settings.CANDLE_WRITE_BUFFER_MAX_ROWS, settings.CANDLE_WRITE_BUFFER_ATTEMPTS)
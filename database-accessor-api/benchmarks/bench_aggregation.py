@@ -0,0 +1,184 @@
+# benchmarks/bench_aggregation.py
+"""
+Compare the previous ROW_NUMBER() aggregation query with the time_bucket engine.
+
+Loads a synthetic 1-minute dataset into a scratch table and reports rows/sec
+for both queries per timeframe. Run from the database-accessor-api directory:
+
+    python -m benchmarks.bench_aggregation --rows 10000000 --symbols 5
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+from app.aggregates import CandleSource
+from app.aggregation import candles_query
+from app.database import engine
+from app.timeframes import parse_timeframe
+
+BENCH_TABLE = "bench_candles"
+DATA_START = datetime(2015, 1, 1)
+
+LEGACY_SQL = """
+    WITH RoundedCandles AS (
+        SELECT
+            date_trunc('day', timestamp) + INTERVAL '1 minute' * (
+                ((EXTRACT(HOUR FROM timestamp)::integer * 60)
+                    + EXTRACT(MINUTE FROM timestamp)::integer) -
+                ((EXTRACT(HOUR FROM timestamp)::integer * 60
+                    + EXTRACT(MINUTE FROM timestamp)::integer) % :timeframe)
+            ) AS rounded_timestamp,
+            open,
+            high,
+            low,
+            close,
+            volume,
+            ROW_NUMBER() OVER (
+                PARTITION BY symbol_id, date_trunc('day', timestamp) + INTERVAL '1 minute' * (
+                    ((EXTRACT(HOUR FROM timestamp)::integer * 60)
+                        + EXTRACT(MINUTE FROM timestamp)::integer) -
+                    ((EXTRACT(HOUR FROM timestamp)::integer * 60
+                        + EXTRACT(MINUTE FROM timestamp)::integer) % :timeframe)
+                )
+                ORDER BY timestamp ASC
+            ) AS rn_asc,
+            ROW_NUMBER() OVER (
+                PARTITION BY symbol_id, date_trunc('day', timestamp) + INTERVAL '1 minute' * (
+                    ((EXTRACT(HOUR FROM timestamp)::integer * 60)
+                        + EXTRACT(MINUTE FROM timestamp)::integer) -
+                    ((EXTRACT(HOUR FROM timestamp)::integer * 60
+                        + EXTRACT(MINUTE FROM timestamp)::integer) % :timeframe)
+                )
+                ORDER BY timestamp DESC
+            ) AS rn_desc
+        FROM {table}
+        WHERE symbol_id = :symbol_id
+    )
+    SELECT
+        rounded_timestamp AS timestamp,
+        MAX(open) FILTER (WHERE rn_asc = 1) AS open,
+        MAX(high) AS high,
+        MIN(low) AS low,
+        MAX(close) FILTER (WHERE rn_desc = 1) AS close,
+        SUM(volume) AS volume
+    FROM RoundedCandles
+    GROUP BY timestamp
+    ORDER BY timestamp ASC
+"""
+
+
+async def load_dataset(rows: int, symbols: int):
+    per_symbol = rows // symbols
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DROP TABLE IF EXISTS {BENCH_TABLE}"))
+        await conn.execute(text(f"""
+            CREATE TABLE {BENCH_TABLE} (
+                symbol_id INTEGER NOT NULL,
+                timestamp TIMESTAMP NOT NULL,
+                open FLOAT NOT NULL,
+                high FLOAT NOT NULL,
+                low FLOAT NOT NULL,
+                close FLOAT NOT NULL,
+                volume FLOAT NOT NULL,
+                PRIMARY KEY (symbol_id, timestamp)
+            )
+        """))
+        await conn.execute(text(f"""
+            SELECT create_hypertable('{BENCH_TABLE}', 'timestamp',
+                                     chunk_time_interval => INTERVAL '7 days',
+                                     create_default_indexes => false)
+        """))
+
+    for symbol_id in range(1, symbols + 1):
+        started = time.perf_counter()
+        async with engine.begin() as conn:
+            await conn.execute(text(f"""
+                INSERT INTO {BENCH_TABLE}
+                SELECT
+                    :symbol_id,
+                    CAST(:start AS TIMESTAMP) + n * INTERVAL '1 minute',
+                    p.open,
+                    p.open + random(),
+                    p.open - random(),
+                    p.open + random() - 0.5,
+                    random() * 100
+                FROM generate_series(0, :per_symbol - 1) AS n,
+                LATERAL (SELECT 100 + 10 * sin(n / 5000.0) + random() AS open) AS p
+            """), {"symbol_id": symbol_id, "start": DATA_START, "per_symbol": per_symbol})
+        print(f"loaded symbol {symbol_id}: {per_symbol} rows "
+              f"in {time.perf_counter() - started:.1f}s")
+
+    async with engine.begin() as conn:
+        await conn.execute(text(f"ANALYZE {BENCH_TABLE}"))
+    return per_symbol
+
+
+async def time_query(sql, params: dict, runs: int) -> tuple[float, int]:
+    timings = []
+    buckets = 0
+    for _ in range(runs):
+        async with engine.connect() as conn:
+            started = time.perf_counter()
+            result = await conn.execute(sql, params)
+            buckets = len(result.fetchall())
+            timings.append(time.perf_counter() - started)
+    return statistics.median(timings), buckets
+
+
+async def run(args) -> list[dict]:
+    try:
+        per_symbol = await load_dataset(args.rows, args.symbols)
+        source = CandleSource(BENCH_TABLE, 1)
+        legacy_sql = text(LEGACY_SQL.format(table=BENCH_TABLE))
+
+        results = []
+        for minutes in args.timeframes:
+            legacy_seconds, legacy_buckets = await time_query(
+                legacy_sql, {"symbol_id": 1, "timeframe": minutes}, args.runs)
+            bucket_seconds, bucket_buckets = await time_query(
+                candles_query(parse_timeframe(minutes), source), {"symbol_id": 1}, args.runs)
+            results.append({
+                "timeframe": minutes,
+                "rows_scanned": per_symbol,
+                "legacy": {
+                    "seconds": round(legacy_seconds, 3),
+                    "rows_per_sec": round(per_symbol / legacy_seconds),
+                    "buckets": legacy_buckets,
+                },
+                "time_bucket": {
+                    "seconds": round(bucket_seconds, 3),
+                    "rows_per_sec": round(per_symbol / bucket_seconds),
+                    "buckets": bucket_buckets,
+                },
+                "speedup": round(legacy_seconds / bucket_seconds, 2),
+            })
+        return results
+    finally:
+        if not args.keep:
+            async with engine.begin() as conn:
+                await conn.execute(text(f"DROP TABLE IF EXISTS {BENCH_TABLE}"))
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark candle aggregation queries")
+    parser.add_argument("--rows", type=int, default=10_000_000,
+                        help="Total number of synthetic 1-minute rows")
+    parser.add_argument("--symbols", type=int, default=5,
+                        help="Number of symbols the rows are spread over")
+    parser.add_argument("--timeframes", type=int, nargs="+", default=[5, 60, 240, 1440],
+                        help="Timeframes in minutes to aggregate")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per query, median is reported")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch table")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+# benchmarks/bench_compact.py
+"""
+Compare the float candle layout with the compact integer layout.
+
+Loads a synthetic 1-minute dataset with 5 decimal prices into a float8 scratch
+hypertable and a copy in min_move steps (see app/compact.py), compresses both
+and reports their size before and after compression, the aggregation scan
+speed per timeframe including the decoding of the compact rows, and the size
+and parse time of a cached block as the Redis cache stores it. Run from the
+database-accessor-api directory:
+
+    python -m benchmarks.bench_compact --rows 10000000 --symbols 5
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+from app.aggregates import CandleSource
+from app.aggregation import candles_query
+from app.compact import price_decimals
+from app.database import engine
+from app.timeframes import parse_timeframe
+
+FLOAT_TABLE = "bench_candles_float"
+COMPACT_TABLE = "bench_candles_compact"
+DATA_START = datetime(2015, 1, 1)
+MIN_MOVE = 0.00001
+
+
+def decode(rows) -> list[tuple]:
+    digits = price_decimals(MIN_MOVE)
+    return [
+        (timestamp, round(open_ * MIN_MOVE, digits), round(high * MIN_MOVE, digits),
+         round(low * MIN_MOVE, digits), round(close * MIN_MOVE, digits), float(volume))
+        for timestamp, open_, high, low, close, volume in rows
+    ]
+
+
+async def create_table(table: str, price_type: str, volume_type: str):
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        await conn.execute(text(f"""
+            CREATE TABLE {table} (
+                symbol_id INTEGER NOT NULL,
+                timestamp TIMESTAMP NOT NULL,
+                open {price_type} NOT NULL,
+                high {price_type} NOT NULL,
+                low {price_type} NOT NULL,
+                close {price_type} NOT NULL,
+                volume {volume_type} NOT NULL,
+                PRIMARY KEY (symbol_id, timestamp)
+            )
+        """))
+        await conn.execute(text(f"""
+            SELECT create_hypertable('{table}', 'timestamp',
+                                     chunk_time_interval => INTERVAL '7 days',
+                                     create_default_indexes => false)
+        """))
+        await conn.execute(text(f"""
+            ALTER TABLE {table} SET (
+                timescaledb.compress,
+                timescaledb.compress_segmentby = 'symbol_id',
+                timescaledb.compress_orderby = 'timestamp'
+            )
+        """))
+
+
+async def load_dataset(rows: int, symbols: int):
+    per_symbol = rows // symbols
+    await create_table(FLOAT_TABLE, "FLOAT", "FLOAT")
+    await create_table(COMPACT_TABLE, "INTEGER", "INTEGER")
+
+    for symbol_id in range(1, symbols + 1):
+        started = time.perf_counter()
+        async with engine.begin() as conn:
+            await conn.execute(text(f"""
+                INSERT INTO {FLOAT_TABLE}
+                SELECT
+                    :symbol_id,
+                    CAST(:start AS TIMESTAMP) + n * INTERVAL '1 minute',
+                    round(p.open::numeric, 5),
+                    round((p.open + random() * 0.001)::numeric, 5),
+                    round((p.open - random() * 0.001)::numeric, 5),
+                    round((p.open + random() * 0.001 - 0.0005)::numeric, 5),
+                    floor(random() * 1000)
+                FROM generate_series(0, :per_symbol - 1) AS n,
+                LATERAL (SELECT 1.1 + 0.05 * sin(n / 5000.0) + random() * 0.001 AS open) AS p
+            """), {"symbol_id": symbol_id, "start": DATA_START, "per_symbol": per_symbol})
+        print(f"loaded symbol {symbol_id}: {per_symbol} rows "
+              f"in {time.perf_counter() - started:.1f}s")
+
+    async with engine.begin() as conn:
+        await conn.execute(text(f"""
+            INSERT INTO {COMPACT_TABLE}
+            SELECT symbol_id, timestamp,
+                round(open / :min_move), round(high / :min_move),
+                round(low / :min_move), round(close / :min_move), volume
+            FROM {FLOAT_TABLE}
+        """), {"min_move": MIN_MOVE})
+        await conn.execute(text(f"ANALYZE {FLOAT_TABLE}"))
+        await conn.execute(text(f"ANALYZE {COMPACT_TABLE}"))
+    return per_symbol
+
+
+async def table_size(table: str) -> int:
+    async with engine.connect() as conn:
+        result = await conn.execute(text(f"SELECT hypertable_size('{table}')"))
+        return result.scalar()
+
+
+async def compress(table: str):
+    async with engine.begin() as conn:
+        await conn.execute(text(f"SELECT compress_chunk(c) FROM show_chunks('{table}') c"))
+
+
+async def time_scan(table: str, minutes: int, runs: int, decoded: bool) -> tuple[float, int]:
+    sql = candles_query(parse_timeframe(minutes), CandleSource(table, 1))
+    timings = []
+    buckets = 0
+    for _ in range(runs):
+        async with engine.connect() as conn:
+            started = time.perf_counter()
+            result = await conn.execute(sql, {"symbol_id": 1})
+            rows = result.fetchall()
+            if decoded:
+                rows = decode(rows)
+            buckets = len(rows)
+            timings.append(time.perf_counter() - started)
+    return statistics.median(timings), buckets
+
+
+async def cache_block(table: str, block_rows: int, runs: int, decoded: bool) -> dict:
+    sql = candles_query(parse_timeframe(1), CandleSource(table, 1), limit=block_rows,
+                        epoch_ms=True)
+    async with engine.connect() as conn:
+        result = await conn.execute(sql, {"symbol_id": 1, "limit": block_rows})
+        rows = [tuple(row) for row in result]
+    payload = json.dumps(rows)
+
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        rows = tuple(tuple(row) for row in json.loads(payload))
+        if decoded:
+            decode(rows)
+        timings.append(time.perf_counter() - started)
+    return {"bytes": len(payload), "load_ms": round(statistics.median(timings) * 1000, 2)}
+
+
+async def run(args) -> dict:
+    try:
+        per_symbol = await load_dataset(args.rows, args.symbols)
+        tables = {"float": (FLOAT_TABLE, False), "compact": (COMPACT_TABLE, True)}
+
+        storage = {name: {"before_bytes": await table_size(table)}
+                   for name, (table, _) in tables.items()}
+        for name, (table, _) in tables.items():
+            await compress(table)
+            storage[name]["after_bytes"] = await table_size(table)
+        storage["ratio"] = {
+            key: round(storage["float"][key] / storage["compact"][key], 2)
+            for key in ("before_bytes", "after_bytes")
+        }
+
+        scans = []
+        for minutes in args.timeframes:
+            entry = {"timeframe": minutes, "rows_scanned": per_symbol}
+            for name, (table, decoded) in tables.items():
+                seconds, buckets = await time_scan(table, minutes, args.runs, decoded)
+                entry[name] = {
+                    "seconds": round(seconds, 3),
+                    "rows_per_sec": round(per_symbol / seconds),
+                    "buckets": buckets,
+                }
+            entry["speedup"] = round(entry["float"]["seconds"] / entry["compact"]["seconds"], 2)
+            scans.append(entry)
+
+        cache = {
+            name: await cache_block(table, args.block_rows, args.runs, decoded)
+            for name, (table, decoded) in tables.items()
+        }
+        return {"storage": storage, "scans": scans, "cache_block": cache}
+    finally:
+        if not args.keep:
+            async with engine.begin() as conn:
+                await conn.execute(text(f"DROP TABLE IF EXISTS {FLOAT_TABLE}"))
+                await conn.execute(text(f"DROP TABLE IF EXISTS {COMPACT_TABLE}"))
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compact candle layout")
+    parser.add_argument("--rows", type=int, default=10_000_000,
+                        help="Total number of synthetic 1-minute rows")
+    parser.add_argument("--symbols", type=int, default=5,
+                        help="Number of symbols the rows are spread over")
+    parser.add_argument("--timeframes", type=int, nargs="+", default=[1, 60, 1440],
+                        help="Timeframes in minutes to aggregate")
+    parser.add_argument("--block-rows", type=int, default=10_000,
+                        help="Rows of the cached block compared")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per query, median is reported")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch tables")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,121 @@
-from fastapi import FastAPI, Depends, Query, HTTPException
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+from fastapi import FastAPI, Depends, Query, HTTPException, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from typing import List, Literal, Optional
+import time
+from datetime import datetime, timedelta
 
-from app.database import get_db
+from app.bars import bar_cache
+from app.cache import candle_cache
+from app.catalog import market_catalog
+from app.compact import EncodingError, candle_layout
+from app.persister import candle_persister
+from app.ticks import tick_persister
+from app.tail import tail_buffer
+from app.writebuffer import candle_write_buffer
+from app.jobs import jobs
+from app.database import AsyncSessionLocal, get_db
 from app.schemas import CandleBatchIn, MarketIn
-from app import crud
+from app.pagination import Direction, decode_cursor
+from app.timeframes import parse_timeframe
+from app import (
+    aggregates, bars, coverage, crud, decimation, encoders, ingest, profiling, retention, settings,
+    ticks, timescale, versions, windows
+)
 from __init__ import __version__
 
+logging.basicConfig(level=settings.LOG_LEVEL)
+log = logging.getLogger(__name__)
+
 print(f"Starting Database Accessor API version {__version__}")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application lifespan context for startup/shutdown tasks.
+
+    Applies the managed TimescaleDB storage settings for candles and ticks
+    (indexing the coverage of existing candles when its table is new), loads
+    the continuous aggregates used to route candle queries, the market
+    catalog and the candle layout (float or compact), and prunes the candle
+    change log, refreshes the catalog and layout and applies the candle
+    retention in the background. The live candle and tick
+    persisters run when enabled and write their last batch on shutdown, like
+    the write-behind buffer of buffered candle ingest.
+    Failures are logged but don't abort startup. Background jobs still
+    running are cancelled on shutdown.
+    """
+    if settings.DB_MANAGE_SCHEMA:
+        try:
+            await timescale.setup_candles_storage()
+            await aggregates.setup_continuous_aggregates()
+            await versions.setup_candle_versions()
+            await ticks.setup_ticks_storage()
+            if await coverage.setup_coverage():
+                jobs.submit("rebuild_coverage", {}, lambda job: coverage.rebuild(job=job))
+        except Exception as exc:
+            log.warning("Failed to set up candles storage: %s", exc)
+
+    try:
+        await aggregates.load_available_aggregates()
+    except Exception as exc:
+        log.warning("Failed to load continuous aggregates: %s", exc)
+
+    try:
+        await market_catalog.load()
+    except Exception as exc:
+        log.warning("Failed to load market catalog: %s", exc)
+
+    try:
+        await candle_layout.load()
+    except Exception as exc:
+        log.warning("Failed to detect the candle layout: %s", exc)
+
+    background = [
+        asyncio.create_task(versions.run_pruning(settings.CANDLE_CHANGES_PRUNE_INTERVAL)),
+        asyncio.create_task(market_catalog.run_refresh(settings.MARKET_CATALOG_REFRESH)),
+        asyncio.create_task(candle_layout.run_refresh(settings.MARKET_CATALOG_REFRESH)),
+    ]
+    if profiling.slow_queries.enabled:
+        background.append(asyncio.create_task(profiling.slow_queries.run()))
+    if settings.CANDLES_RETENTION or settings.CANDLES_AGGREGATE_RETENTION:
+        background.append(asyncio.create_task(
+            retention.run_retention(settings.RETENTION_INTERVAL)))
+
+    persisters = {
+        persister: asyncio.create_task(persister.run())
+        for persister in (candle_persister, tick_persister) if persister is not None
+    }
+    write_buffer = asyncio.create_task(candle_write_buffer.run())
+
+    yield
+
+    for persister, task in persisters.items():
+        persister.stop()
+        try:
+            await task
+        except Exception as exc:
+            log.warning("Persister of %s stopped with an error: %s", persister.pattern, exc)
+    candle_write_buffer.stop()
+    await write_buffer
+    for task in background:
+        task.cancel()
+    await jobs.shutdown()
+
+
 app = FastAPI(
     title="Database Accessor API",
     description="Database accessor API for algotrader",
-    version=__version__
+    version=__version__,
+    lifespan=lifespan,
 )
 
+app.middleware("http")(profiling.timing_middleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -29,6 +129,128 @@ async def root():
     return {"message": "Welcome to the Database Accessor API"}
 
 
+@app.get("/storage/candles")
+async def read_candles_storage():
+    return await timescale.storage_report()
+
+
+@app.post("/storage/retention", status_code=202)
+async def run_retention():
+    job = jobs.submit("retention", {}, lambda job: _retention_report())
+    return job.as_dict()
+
+
+async def _retention_report():
+    return {"dropped": await retention.apply_retention()}
+
+
+@app.get("/coverage")
+async def read_coverage_summaries(db: AsyncSession = Depends(get_db)):
+    return await coverage.get_summaries(db)
+
+
+@app.post("/coverage/rebuild", status_code=202)
+async def rebuild_coverage(
+    symbol_ids: Optional[List[str]] = Query(
+        None, description="Symbol ids, comma separated or repeated; all when omitted")
+):
+    try:
+        ids = [int(value) for item in symbol_ids or [] for value in item.split(",")
+               if value.strip()] or None
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    job = jobs.submit("rebuild_coverage", {"symbol_ids": ids},
+                      lambda job: coverage.rebuild(ids, job))
+    return job.as_dict()
+
+
+@app.get("/coverage/{symbol_id}")
+async def read_coverage(
+    symbol_id: int,
+    start_date: Optional[str] = Query(None, description="Only ranges ending at or after"),
+    end_date: Optional[str] = Query(None, description="Only ranges starting before"),
+    db: AsyncSession = Depends(get_db)
+):
+    try:
+        start_dt = datetime.fromisoformat(start_date) if start_date else None
+        end_dt = datetime.fromisoformat(end_date) if end_date else None
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return await coverage.get_coverage(db, symbol_id, start_dt, end_dt)
+
+
+@app.get("/coverage/{symbol_id}/gaps")
+async def read_coverage_gaps(
+    symbol_id: int,
+    min_gap: int = Query(1, ge=1, description="Shortest reported gap in minutes"),
+    start_date: Optional[str] = Query(None, description="Inclusive start of the window"),
+    end_date: Optional[str] = Query(None, description="Exclusive end of the window"),
+    db: AsyncSession = Depends(get_db)
+):
+    try:
+        start_dt = datetime.fromisoformat(start_date) if start_date else None
+        end_dt = datetime.fromisoformat(end_date) if end_date else None
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return await coverage.get_gaps(db, symbol_id, timedelta(minutes=min_gap), start_dt, end_dt)
+
+
+@app.get("/jobs")
+async def read_jobs():
+    return [job.as_dict() for job in jobs.list()]
+
+
+@app.get("/jobs/{job_id}")
+async def read_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.as_dict()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    return PlainTextResponse(
+        profiling.metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/slow-queries")
+async def read_slow_queries():
+    return {
+        "threshold_ms": settings.SLOW_QUERY_MS,
+        "total": profiling.slow_queries.total,
+        "queries": list(reversed(profiling.slow_queries.entries)),
+    }
+
+
+@app.get("/cache/stats")
+async def read_cache_stats():
+    return {**candle_cache.stats(), "tail": tail_buffer.stats(), "bars": bar_cache.stats()}
+
+
+@app.get("/persister/stats")
+async def read_persister_stats():
+    return {
+        name: await persister.stats() if persister is not None else {"running": False}
+        for name, persister in (("candles", candle_persister), ("ticks", tick_persister))
+    }
+
+
+@app.get("/ingest/buffer/stats")
+async def read_write_buffer_stats():
+    return candle_write_buffer.stats()
+
+
+@app.get("/markets/lookup")
+async def lookup_markets(
+    symbols: List[str] = Query(..., description="Market symbols, comma separated or repeated"),
+    exchange: Optional[str] = Query(None, description="Market exchange"),
+    db: AsyncSession = Depends(get_db)
+):
+    names = [value.strip() for item in symbols for value in item.split(",") if value.strip()]
+    return await crud.lookup_markets(db, names, exchange)
+
+
 @app.get("/markets/{symbol_id}")
 async def get_market(symbol_id: int, db: AsyncSession = Depends(get_db)):
     market = await crud.get_market_by_id(db, symbol_id)
@@ -54,42 +276,500 @@ async def create_market(market: MarketIn, db: AsyncSession = Depends(get_db)):
 
 
 @app.delete("/markets/{symbol_id}")
-async def delete_market(symbol_id: int, db: AsyncSession = Depends(get_db)):
+async def delete_market(
+    symbol_id: int,
+    response: Response,
+    background: bool = Query(
+        False, description="Delete the candles in batches as a job and return at once"),
+    db: AsyncSession = Depends(get_db)
+):
+    if background:
+        job = jobs.submit(
+            "delete_market", {"symbol_id": symbol_id},
+            lambda job: retention.delete_market_in_batches(symbol_id, job))
+        response.status_code = 202
+        return job.as_dict()
+
     deleted = await crud.delete_market(db, symbol_id)
     if deleted:
         return {"status": "deleted", "deleted_count": deleted}
     return {"status": "not found"}
 
 
+@app.get("/candles")
+async def read_aligned_candles(
+    symbol_ids: List[str] = Query(
+        ..., description="Symbol ids, comma separated or repeated"),
+    timeframe: str = Query(
+        ..., description="Timeframe in minutes or a label such as M15, H4, D1, W1, MN1"),
+    join: Literal["inner", "outer", "ffill"] = Query(
+        "outer", description="Alignment of the symbols on the timestamp axis"),
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, description="Latest timestamps of the axis"),
+    offset: int = Query(0, ge=0, description="Session offset in minutes"),
+    db: AsyncSession = Depends(get_db)
+):
+    try:
+        ids = [int(value) for item in symbol_ids for value in item.split(",") if value.strip()]
+        tf = parse_timeframe(timeframe)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    if not ids:
+        raise HTTPException(status_code=400, detail="No symbol_ids given")
+
+    try:
+        return await crud.get_aligned_candles(
+            db, ids, tf, join, start_date, end_date, limit, offset)
+    except LookupError as exc:
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
+
+
+def _conditional_headers(request: Request, version: Optional[tuple],
+                         media_type: Optional[str] = None) -> tuple[dict, bool]:
+    """
+    Validators of a response derived from a symbol's data version
+
+    :param request: The request, its query string shapes the representation
+    :param version: Version and last modification time of versions.get_version,
+        None when the data is not versioned
+    :param media_type: Negotiated media type of responses that vary on Accept
+
+    :return: Response headers and whether the request's validators match, to
+        answer with 304
+    :rtype: tuple[dict, bool]
+    """
+    headers = {"Vary": "Accept"} if media_type is not None else {}
+    if version is None:
+        return headers, False
+    variant = (str(request.query_params),) + ((media_type,) if media_type is not None else ())
+    etag = versions.make_etag(version[0], *variant)
+    headers.update({
+        "ETag": etag,
+        "X-Data-Version": str(version[0]),
+        "Last-Modified": versions.http_date(version[1]),
+        "Cache-Control": "no-cache",
+    })
+    return headers, versions.not_modified(request.headers, etag, version[1])
+
+
 @app.get("/candles/{symbol_id}")
 async def read_aggregated_candles(
     symbol_id: int,
-    timeframe: int = Query(..., description="Timeframe in minutes"),
+    request: Request,
+    timeframe: str = Query(
+        ..., description="Timeframe in minutes or a label such as M15, H4, D1, W1, MN1"),
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None),
     limit: Optional[int] = Query(None),
+    offset: int = Query(0, ge=0, description="Session offset in minutes"),
+    stream: bool = Query(False, description="Stream NDJSON or Arrow batches from a cursor"),
+    max_points: Optional[int] = Query(
+        None, ge=3, description="Decimate the candles to at most this many points"),
+    decimation_method: Literal["minmax", "lttb"] = Query(
+        "minmax", alias="decimation",
+        description="Per bucket envelope candles, or LTTB on the close"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Aggregated candles as JSON, or as binary columns when the Accept header
+    asks for application/vnd.apache.arrow.stream or application/x-npz.
+
+    With max_points, series longer than the budget are decimated server-side
+    (see app/decimation.py) and X-Source-Count carries the number of candles
+    before decimation.
+
+    Responses carry an ETag and Last-Modified from the symbol's data version;
+    a matching If-None-Match (or If-Modified-Since) is answered with 304
+    without running the aggregation.
+    """
+    try:
+        tf = parse_timeframe(timeframe)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+    if stream and max_points is not None:
+        raise HTTPException(status_code=400, detail="max_points cannot be streamed")
+
+    accept = request.headers.get("accept")
+    if stream:
+        media_type = encoders.negotiate_stream(accept)
+    else:
+        media_type = encoders.negotiate(accept) or encoders.JSON
+
+    # The version is read before the candles, so a concurrent write can only
+    # make the ETag older than the data, never newer
+    headers, not_modified = _conditional_headers(
+        request, await versions.get_version(db, symbol_id), media_type)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+
+    if stream:
+        # Release the request's connection before streaming on a session of its own
+        await db.close()
+        return StreamingResponse(
+            _stream_candles(media_type, symbol_id, tf, start_date, end_date, limit, offset),
+            media_type=media_type,
+            headers=headers,
+        )
+
+    if max_points is not None:
+        columns = await crud.get_candle_columns(
+            db, symbol_id, tf, start_date, end_date, limit, offset)
+        with profiling.stage("decimate"):
+            headers["X-Source-Count"] = str(len(columns["timestamp"]))
+            columns = decimation.decimate(columns, max_points, decimation_method)
+        with profiling.stage("encode"):
+            if media_type == encoders.JSON:
+                content = encoders.encode_json(decimation.columns_to_candles(columns))
+            else:
+                content = encoders.encode_columns(columns, media_type)
+        return Response(
+            content=content,
+            media_type=media_type,
+            headers={**headers, "X-Candle-Count": str(len(columns["timestamp"]))},
+        )
+
+    if media_type == encoders.JSON:
+        candles = await crud.get_candles(db, symbol_id, tf, start_date, end_date, limit, offset)
+        with profiling.stage("encode"):
+            content = encoders.encode_json(candles)
+        return Response(content=content, media_type=media_type, headers=headers)
+
+    columns = await crud.get_candle_columns(
+        db, symbol_id, tf, start_date, end_date, limit, offset)
+    with profiling.stage("encode"):
+        content = encoders.encode_columns(columns, media_type)
+    return Response(
+        content=content,
+        media_type=media_type,
+        headers={**headers, "X-Candle-Count": str(len(columns["timestamp"]))},
+    )
+
+
+@app.get("/bars/{symbol_id}")
+async def read_bars(
+    symbol_id: int,
+    request: Request,
+    bar_type: Literal["volume", "range", "renko", "heikin_ashi", "tick"] = Query(
+        ..., alias="type", description="Bar type"),
+    size: Optional[float] = Query(
+        None, gt=0, description="Volume, price range, brick size or ticks per bar"),
+    timeframe: str = Query("M1", description="Timeframe of the source candles"),
+    price: Literal["bid", "ask", "mid"] = Query("bid", description="Price of tick bars"),
+    start_date: Optional[str] = Query(None, description="Inclusive start of the source range"),
+    end_date: Optional[str] = Query(None, description="Exclusive end of the source range"),
+    limit: Optional[int] = Query(
+        None, ge=1, description="Return only the newest bars, the whole range is still built"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Volume, range, Renko, Heikin-Ashi or tick bars built server-side (see
+    app/bars.py). Bars built from candles carry an ETag from the symbol's
+    data version like the candle responses.
+
+    Bars depend on where the series starts, so all bars of the range are built
+    and limit only trims the response; without start_date that is the whole
+    history of the timeframe.
+    """
+    try:
+        spec = bars.parse_bar_spec(bar_type, size, timeframe, price)
+        start_dt = datetime.fromisoformat(start_date) if start_date else None
+        end_dt = datetime.fromisoformat(end_date) if end_date else None
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+    version = await versions.get_version(db, symbol_id) if spec.type != "tick" else None
+    headers, not_modified = _conditional_headers(request, version)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+
+    result = await bar_cache.get_bars(
+        db, symbol_id, spec, start_dt, end_dt, version[0] if version is not None else None)
+    built = result["bars"][-limit:] if limit is not None else result["bars"]
+    with profiling.stage("encode"):
+        content = encoders.encode_json({
+            "symbol_id": symbol_id,
+            "type": spec.type,
+            "size": spec.size,
+            "timeframe": spec.timeframe.label,
+            "source_rows": result["source_rows"],
+            "partial": result["partial"],
+            "bars": built,
+        })
+    return Response(content=content, media_type=encoders.JSON, headers=headers)
+
+
+@app.get("/candles/{symbol_id}/windows")
+async def read_candle_windows(
+    symbol_id: int,
+    request: Request,
+    timeframe: str = Query(
+        ..., description="Timeframe in minutes or a label such as M15, H4, D1, W1, MN1"),
+    columns: List[str] = Query(
+        ..., description="Window specs such as sma(close,20), max(high,50), vwap(20)"),
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0, description="Session offset in minutes"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Rolling window indicators evaluated in Postgres over the aggregated
+    candles (see app/windows.py), as a timestamp column and one column per
+    spec instead of the candles. Responses carry an ETag from the symbol's
+    data version like the candle responses.
+    """
+    try:
+        tf = parse_timeframe(timeframe)
+        specs = windows.parse_window_specs(columns)
+        start_dt = datetime.fromisoformat(start_date) if start_date else None
+        end_dt = datetime.fromisoformat(end_date) if end_date else None
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+    headers, not_modified = _conditional_headers(
+        request, await versions.get_version(db, symbol_id))
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+
+    try:
+        result = await windows.get_window_columns(
+            db, symbol_id, tf, specs, start_dt, end_dt, limit, offset)
+    except LookupError as exc:
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
+    with profiling.stage("encode"):
+        content = encoders.encode_json({
+            "symbol_id": symbol_id,
+            "timeframe": tf.label,
+            "columns": [spec.name for spec in specs],
+            **result,
+        })
+    return Response(content=content, media_type=encoders.JSON, headers=headers)
+
+
+@app.get("/candles/{symbol_id}/changes")
+async def read_candle_changes(
+    symbol_id: int,
+    timeframe: str = Query(
+        ..., description="Timeframe in minutes or a label such as M15, H4, D1, W1, MN1"),
+    since: Optional[int] = Query(
+        None, ge=0, description="Data version of the last sync (X-Data-Version, or version)"),
+    since_time: Optional[str] = Query(
+        None, description="Time of the last sync in ISO format, if no version is known"),
+    offset: int = Query(0, ge=0, description="Session offset in minutes"),
     db: AsyncSession = Depends(get_db)
 ):
-    return await crud.get_candles(db, symbol_id, timeframe, start_date, end_date, limit)
+    if since is None and since_time is None:
+        raise HTTPException(status_code=400, detail="since or since_time is required")
+    try:
+        return await crud.get_candle_changes(db, symbol_id, timeframe, since, since_time, offset)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+@app.get("/candles/{symbol_id}/page")
+async def read_candle_page(
+    symbol_id: int,
+    timeframe: str = Query(
+        ..., description="Timeframe in minutes or a label such as M15, H4, D1, W1, MN1"),
+    limit: int = Query(500, ge=1, le=10000, description="Candles per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor or prev_cursor of a page"),
+    direction: Direction = Query(
+        "backward", description="Direction of the first page, ignored with a cursor"),
+    offset: int = Query(0, ge=0, description="Session offset in minutes"),
+    db: AsyncSession = Depends(get_db)
+):
+    try:
+        tf = parse_timeframe(timeframe)
+        page_cursor = decode_cursor(cursor) if cursor else None
+        return await crud.get_candle_page(db, symbol_id, tf, limit, page_cursor, direction, offset)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+async def _stream_candles(media_type: str, *args):
+    # The request's session is closed once the endpoint returns, so the
+    # cursor gets its own session that lives as long as the response body.
+    async with AsyncSessionLocal() as session:
+        epoch_ms = media_type == encoders.ARROW_STREAM
+        batches = crud.stream_candle_rows(
+            session, *args, epoch_ms=epoch_ms, batch_rows=settings.CANDLES_STREAM_BATCH_ROWS)
+        if epoch_ms:
+            chunks = encoders.arrow_stream_chunks(
+                crud.rows_to_columns(rows) async for rows in batches)
+        else:
+            chunks = encoders.ndjson_chunks(batches)
+        async for chunk in chunks:
+            yield chunk
 
 
 @app.post("/candles")
-async def insert_candle_batch(data: CandleBatchIn, db: AsyncSession = Depends(get_db)):
+async def insert_candle_batch(
+    data: CandleBatchIn,
+    response: Response,
+    mode: Optional[Literal["insert", "copy", "buffered"]] = Query(
+        None, description="Ingest path, defaults to CANDLES_INGEST_MODE"),
+    db: AsyncSession = Depends(get_db)
+):
     candles = [candle.model_dump() for candle in data.candles]
+    mode = mode or settings.CANDLES_INGEST_MODE
+
+    if mode == "buffered":
+        # Unknown markets would fail the shared flush, so they are rejected here
+        if await crud.get_market_by_id(db, data.symbol_id) is None:
+            raise HTTPException(status_code=404, detail="Market not found")
+        try:
+            # Candles the compact layout cannot store would fail the flush
+            await candle_layout.encode_values(
+                db, [{"symbol_id": data.symbol_id, **candle} for candle in candles])
+        except EncodingError as exc:
+            raise HTTPException(status_code=400, detail={
+                "error": str(exc), "total_candles": len(candles), **exc.report}) from exc
+        try:
+            queued = await candle_write_buffer.add(data.symbol_id, candles)
+        except RuntimeError:
+            # Shutting down, write directly
+            mode = "insert"
+        else:
+            response.status_code = 202
+            return {
+                "status": "queued",
+                "mode": mode,
+                "total_candles": len(candles),
+                "queued_candles": queued,
+            }
+
+    if mode == "copy":
+        try:
+            report = await crud.copy_candles(db, data.symbol_id, candles)
+        except EncodingError as exc:
+            raise HTTPException(status_code=400, detail={
+                "error": str(exc), "total_candles": len(candles), **exc.report}) from exc
+        return {"status": "ok", "mode": mode, "total_candles": len(candles), **report}
+
     batch_size = 4000
     total_added = 0
+    started = time.perf_counter()
 
     for i in range(0, len(candles), batch_size):
         batch = candles[i:i + batch_size]
-        added_candles = await crud.insert_candles(db, data.symbol_id, batch)
+        try:
+            added_candles = await crud.insert_candles(db, data.symbol_id, batch)
+        except EncodingError as exc:
+            # Earlier batches are committed
+            raise HTTPException(status_code=400, detail={
+                "error": str(exc), "total_candles": len(candles), "rejected_from": i,
+                "added_candles": total_added, **exc.report}) from exc
 
         total_added += added_candles
 
-    return {"status": "ok", "added_candles": total_added, "total_candles": len(candles)}
+    elapsed = time.perf_counter() - started
+    return {
+        "status": "ok",
+        "mode": mode,
+        "added_candles": total_added,
+        "total_candles": len(candles),
+        "duplicates_skipped": len(candles) - total_added,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(len(candles) / elapsed) if elapsed else None,
+    }
+
+
+@app.post("/candles/{symbol_id}/stream")
+async def stream_candles(
+    symbol_id: int,
+    request: Request,
+    on_invalid: Literal["reject", "drop"] = Query(
+        "reject", description="Reject the upload at the first invalid row or drop invalid rows"),
+    chunk_rows: int = Query(settings.INGEST_CHUNK_ROWS, ge=1, le=1_000_000),
+    db: AsyncSession = Depends(get_db)
+):
+    """Ingest NDJSON, CSV or Arrow IPC streams without buffering the whole body."""
+    try:
+        ingest_format = ingest.detect_format(request.headers.get("content-type"))
+    except ingest.IngestError as exc:
+        raise HTTPException(status_code=415, detail=str(exc)) from exc
+
+    chunks = ingest.iter_chunks(request.stream(), ingest_format, chunk_rows)
+    try:
+        report = await ingest.ingest_stream(
+            db, symbol_id, chunks, drop_invalid=on_invalid == "drop")
+    except ingest.IngestError as exc:
+        raise HTTPException(status_code=422, detail={
+            "error": str(exc),
+            "row": exc.row,
+            "reason": exc.reason,
+            **(exc.report or {}),
+        }) from exc
+
+    return {"status": "ok", "format": ingest_format, **report}
 
 
 @app.delete("/candles/{symbol_id}")
-async def delete_candles(symbol_id: int, db: AsyncSession = Depends(get_db)):
-    deleted_count = await crud.delete_candles(db, symbol_id)
+async def delete_candles(
+    symbol_id: int,
+    response: Response,
+    start_date: Optional[str] = Query(None, description="Inclusive start of the range"),
+    end_date: Optional[str] = Query(None, description="Exclusive end of the range"),
+    background: bool = Query(
+        False, description="Delete in batches as a job and return at once"),
+    db: AsyncSession = Depends(get_db)
+):
+    if background:
+        try:
+            start_dt = datetime.fromisoformat(start_date) if start_date else None
+            end_dt = datetime.fromisoformat(end_date) if end_date else None
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+        job = jobs.submit(
+            "delete_candles",
+            {"symbol_id": symbol_id, "start_date": start_date, "end_date": end_date},
+            lambda job: retention.delete_candles_in_batches(symbol_id, start_dt, end_dt, job))
+        response.status_code = 202
+        return job.as_dict()
+
+    try:
+        deleted_count = await crud.delete_candles(db, symbol_id, start_date, end_date)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
 
     return {"status": "deleted", "deleted_count": deleted_count}
+
+
+@app.get("/ticks/{symbol_id}")
+async def read_ticks(
+    symbol_id: int,
+    start_date: Optional[str] = Query(None, description="Inclusive start of the range"),
+    end_date: Optional[str] = Query(None, description="Exclusive end of the range"),
+    limit: Optional[int] = Query(
+        None, ge=1, description="Maximum number of ticks, the newest without start_date"),
+    db: AsyncSession = Depends(get_db)
+):
+    try:
+        start_dt = datetime.fromisoformat(start_date) if start_date else None
+        end_dt = datetime.fromisoformat(end_date) if end_date else None
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return await ticks.get_ticks(db, symbol_id, start_dt, end_dt, limit)
+
+
+@app.get("/ticks/{symbol_id}/bars")
+async def read_tick_bars(
+    symbol_id: int,
+    interval: str = Query(
+        ..., description="Bar width in seconds (30, 30s, S30) or a label such as M1, 5m, H1"),
+    price: Literal["bid", "ask", "mid"] = Query("bid", description="Price the bars are built from"),
+    start_date: Optional[str] = Query(None, description="Inclusive start of the range"),
+    end_date: Optional[str] = Query(None, description="Exclusive end of the range"),
+    limit: Optional[int] = Query(
+        None, ge=1, description="Maximum number of bars, the newest without start_date"),
+    db: AsyncSession = Depends(get_db)
+):
+    try:
+        seconds = ticks.parse_bar_interval(interval)
+        start_dt = datetime.fromisoformat(start_date) if start_date else None
+        end_dt = datetime.fromisoformat(end_date) if end_date else None
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return await ticks.get_tick_bars(db, symbol_id, seconds, price, start_dt, end_dt, limit)
@@ -0,0 +1,151 @@
+import unittest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# app.database builds its engine on import, it never connects here
+os.environ.setdefault("DB_PORT", "5432")
+
+from datetime import datetime, timedelta
+
+from app.bars import (BarCache, HeikinAshiBars, RangeBars, RenkoBars, VolumeBars,
+                      parse_bar_spec)
+
+START = datetime(2024, 1, 1)
+
+
+def minute(index):
+    return START + timedelta(minutes=index)
+
+
+def feed_closes(builder, closes, volume=1.0):
+    for index, close in enumerate(closes):
+        builder.add(minute(index), close, close, close, close, volume)
+    return builder
+
+
+class TestRenkoBars(unittest.TestCase):
+    def test_bricks_in_trend(self):
+        renko = feed_closes(RenkoBars(1.0), [10, 10.5, 13.2])
+
+        self.assertEqual([(bar["open"], bar["close"]) for bar in renko.bars],
+                         [(10, 11), (11, 12), (12, 13)])
+        # The volume since the last brick goes to the first brick formed
+        self.assertEqual([bar["volume"] for bar in renko.bars], [3, 0, 0])
+        self.assertEqual(renko.bars[0]["timestamp"], minute(0))
+        self.assertEqual(renko.bars[1]["timestamp"], minute(2))
+        self.assertFalse(renko.finish())
+
+    def test_reversal_needs_two_bricks(self):
+        renko = feed_closes(RenkoBars(1.0), [10, 11, 10.5, 10])
+        # One brick back down from the top of the 10-11 brick is no reversal
+        self.assertEqual(len(renko.bars), 1)
+
+        renko.add(minute(4), 9, 9, 9, 9, 1.0)
+        self.assertEqual(len(renko.bars), 2)
+        self.assertEqual(renko.bars[-1]["open"], 10)
+        self.assertEqual(renko.bars[-1]["close"], 9)
+        self.assertEqual(renko.bars[-1]["high"], 10)
+        self.assertEqual(renko.bars[-1]["low"], 9)
+
+        # And back up again from the bottom of the 10-9 brick
+        renko.add(minute(5), 10, 10, 10, 10, 1.0)
+        self.assertEqual(len(renko.bars), 2)
+        renko.add(minute(6), 11, 11, 11, 11, 1.0)
+        self.assertEqual([(bar["open"], bar["close"]) for bar in renko.bars[2:]], [(10, 11)])
+
+    def test_brick_edges_do_not_drift(self):
+        renko = feed_closes(RenkoBars(0.1), [1.0, 2.0])
+
+        self.assertEqual(len(renko.bars), 10)
+        self.assertEqual(renko.bars[-1]["close"], 2.0)
+        self.assertEqual(renko.bars[6]["open"], 1.6)
+
+
+class TestHeikinAshiBars(unittest.TestCase):
+    def test_open_chains_previous_bar(self):
+        ha = HeikinAshiBars(None)
+        ha.add(minute(0), 10, 12, 9, 11, 5)
+        ha.add(minute(1), 11, 13, 10, 12, 6)
+        ha.add(minute(2), 12, 12, 8, 9, 7)
+
+        self.assertEqual([bar["open"] for bar in ha.bars], [10.5, 10.5, 11])
+        self.assertEqual([bar["close"] for bar in ha.bars], [10.5, 11.5, 10.25])
+        self.assertEqual(ha.bars[2]["high"], 12)
+        self.assertEqual(ha.bars[2]["low"], 8)
+        self.assertEqual([bar["volume"] for bar in ha.bars], [5, 6, 7])
+
+    def test_high_and_low_include_heikin_ashi_prices(self):
+        ha = HeikinAshiBars(None)
+        ha.add(minute(0), 10, 10, 10, 10, 1)
+        ha.add(minute(1), 20, 20, 20, 20, 1)
+
+        # The open of the second bar, 10, is below its low
+        self.assertEqual(ha.bars[1]["open"], 10)
+        self.assertEqual(ha.bars[1]["low"], 10)
+
+
+class TestMergedBars(unittest.TestCase):
+    def test_volume_bars(self):
+        volume = VolumeBars(3)
+        for index, amount in enumerate([1, 1, 2, 3, 1]):
+            volume.add(minute(index), 1, 2, 0, 1, amount)
+
+        self.assertEqual([bar["volume"] for bar in volume.bars], [4, 3])
+        self.assertEqual(volume.bars[0]["end"], minute(2))
+        self.assertTrue(volume.finish())
+        self.assertEqual(volume.bars[-1]["volume"], 1)
+
+    def test_range_bars(self):
+        range_bars = RangeBars(2)
+        range_bars.add(minute(0), 10, 11, 10, 11, 1)
+        range_bars.add(minute(1), 11, 11.5, 10.5, 11, 1)
+        range_bars.add(minute(2), 11, 12, 11, 12, 1)
+
+        self.assertEqual(len(range_bars.bars), 1)
+        bar = range_bars.bars[0]
+        self.assertEqual((bar["open"], bar["high"], bar["low"], bar["close"]), (10, 12, 10, 12))
+        self.assertFalse(range_bars.finish())
+
+
+class TestParseBarSpec(unittest.TestCase):
+    def test_valid_specs(self):
+        self.assertIsNone(parse_bar_spec("heikin_ashi", 5).size)
+        spec = parse_bar_spec("tick", 100, price="mid")
+        self.assertEqual(spec.price, "mid")
+        # The price only applies to tick bars
+        self.assertEqual(parse_bar_spec("renko", 0.5, price="ask").price, "bid")
+
+    def test_invalid_specs(self):
+        for args in [("kagi", 1), ("renko", None), ("volume", 0), ("tick", 2.5)]:
+            with self.subTest(args=args), self.assertRaises(ValueError):
+                parse_bar_spec(*args)
+        with self.assertRaises(ValueError):
+            parse_bar_spec("tick", 10, price="last")
+
+
+class TestBarCache(unittest.TestCase):
+    def result(self, bars):
+        return {"bars": [{}] * bars}
+
+    def test_evicts_by_bars(self):
+        cache = BarCache(max_entries=10, max_bars=5)
+        cache._put("a", 1, self.result(2))
+        cache._put("b", 1, self.result(2))
+        cache._put("c", 1, self.result(2))
+
+        self.assertEqual(list(cache._entries), ["b", "c"])
+        self.assertEqual(cache.bars, 4)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_skips_oversized_results(self):
+        cache = BarCache(max_entries=10, max_bars=5)
+        cache._put("a", 1, self.result(2))
+        cache._put("a", 2, self.result(6))
+
+        self.assertEqual(len(cache._entries), 0)
+        self.assertEqual(cache.bars, 0)
+        self.assertEqual(cache.oversized, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# app.database builds its engine on import, it never connects here
+os.environ.setdefault("DB_PORT", "5432")
+
+import numpy as np
+import numpy.testing as npt
+
+from app.decimation import decimate, lttb_indexes, minmax
+
+
+def make_columns(close):
+    close = np.asarray(close, dtype=np.float64)
+    length = len(close)
+    return {
+        "timestamp": np.arange(length, dtype=np.int64) * 60_000,
+        "open": close - 0.5,
+        "high": close + 1,
+        "low": close - 1,
+        "close": close,
+        "volume": np.ones(length),
+    }
+
+
+class TestMinmax(unittest.TestCase):
+    def test_bucket_boundaries(self):
+        # 10 bars in 3 buckets start at bars 0, 3 and 6
+        columns = make_columns(np.arange(10))
+        result = minmax(columns, 3)
+
+        npt.assert_array_equal(result["timestamp"], [0, 3 * 60_000, 6 * 60_000])
+        npt.assert_array_equal(result["open"], [-0.5, 2.5, 5.5])
+        npt.assert_array_equal(result["close"], [2, 5, 9])
+        npt.assert_array_equal(result["volume"], [3, 3, 4])
+
+    def test_envelope_is_kept(self):
+        close = [5, 9, 1, 4, 4, 4, 7, 0, 3]
+        columns = make_columns(close)
+        result = minmax(columns, 3)
+
+        npt.assert_array_equal(result["high"], [10, 5, 8])
+        npt.assert_array_equal(result["low"], [0, 3, -1])
+        self.assertEqual(result["high"].max(), columns["high"].max())
+        self.assertEqual(result["low"].min(), columns["low"].min())
+        self.assertEqual(result["volume"].sum(), columns["volume"].sum())
+
+
+class TestLttb(unittest.TestCase):
+    def test_keeps_first_and_last_bar(self):
+        columns = make_columns(np.sin(np.arange(100) / 5))
+        indexes = lttb_indexes(columns, 10)
+
+        self.assertEqual(len(indexes), 10)
+        self.assertEqual(indexes[0], 0)
+        self.assertEqual(indexes[-1], 99)
+        self.assertTrue(np.all(np.diff(indexes) > 0))
+
+    def test_one_bar_per_inner_bucket(self):
+        # 10 inner bars in 4 buckets: [1, 3), [3, 6), [6, 8), [8, 11)
+        columns = make_columns(np.zeros(12))
+        indexes = lttb_indexes(columns, 6)
+
+        for index, (start, end) in zip(indexes[1:-1], [(1, 3), (3, 6), (6, 8), (8, 11)]):
+            self.assertTrue(start <= index < end)
+
+    def test_keeps_spike(self):
+        close = np.zeros(30)
+        close[13] = 50
+        indexes = lttb_indexes(make_columns(close), 5)
+
+        self.assertIn(13, indexes)
+
+
+class TestDecimate(unittest.TestCase):
+    def test_series_within_budget_unchanged(self):
+        columns = make_columns(np.arange(5))
+        self.assertIs(decimate(columns, 5), columns)
+
+    def test_lttb_selects_original_bars(self):
+        columns = make_columns(np.cos(np.arange(50) / 3))
+        result = decimate(columns, 8, "lttb")
+        indexes = lttb_indexes(columns, 8)
+
+        for name, values in columns.items():
+            npt.assert_array_equal(result[name], values[indexes])
+
+    def test_invalid_arguments(self):
+        columns = make_columns(np.arange(10))
+        with self.assertRaises(ValueError):
+            decimate(columns, 5, "average")
+        with self.assertRaises(ValueError):
+            decimate(columns, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
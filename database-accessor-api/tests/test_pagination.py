@@ -0,0 +1,47 @@
+import unittest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import base64
+from datetime import datetime, timezone
+
+from app.pagination import PageCursor, decode_cursor, encode_cursor
+
+
+class TestCursor(unittest.TestCase):
+    def test_round_trip(self):
+        for cursor in [
+            PageCursor("backward", datetime(2024, 3, 1, 12, 30), "H1"),
+            PageCursor("forward", datetime(2024, 3, 1, tzinfo=timezone.utc), "D1", offset=-120),
+        ]:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(decode_cursor(encode_cursor(cursor)), cursor)
+
+    def test_url_safe_without_padding(self):
+        value = encode_cursor(PageCursor("forward", datetime(2024, 3, 1), "M15", offset=30))
+
+        self.assertNotIn("=", value)
+        self.assertTrue(set(value) <= set(
+            "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"))
+
+    def test_rejects_malformed(self):
+        def encode(raw: bytes) -> str:
+            return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+        for value in [
+            "",
+            "not a cursor!",
+            encode(b"[1, 2]"),
+            encode(b'{"d": "backward", "b": "2024-03-01T00:00:00", "tf": "H1"}'),
+            encode(b'{"d": "sideways", "b": "2024-03-01T00:00:00", "tf": "H1", "o": 0}'),
+            encode(b'{"d": "forward", "b": "yesterday", "tf": "H1", "o": 0}'),
+            encode(b'{"d": "forward", "b": "2024-03-01T00:00:00", "tf": "H1", "o": "x"}'),
+            encode(b"\xff\xfe"),
+        ]:
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                decode_cursor(value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# app.database builds its engine on import, it never connects here
+os.environ.setdefault("DB_PORT", "5432")
+
+from app.windows import (MAX_SPECS, MAX_WINDOW, WindowSpec, parse_window_spec,
+                         parse_window_specs, warmup_bars)
+
+
+class TestParseWindowSpec(unittest.TestCase):
+    def test_rolling_spec(self):
+        spec = parse_window_spec(" sma( close , 20 ) ")
+
+        self.assertEqual(spec, WindowSpec("sma", "close", 20))
+        self.assertEqual(spec.name, "sma_close_20")
+
+    def test_vwap_window_is_optional(self):
+        self.assertEqual(parse_window_spec("vwap(14)").name, "vwap_14")
+        self.assertEqual(parse_window_spec("vwap()").name, "vwap")
+
+    def test_cum_return(self):
+        spec = parse_window_spec("cum_return(close)")
+
+        self.assertEqual(spec.name, "cum_return_close")
+        self.assertIsNone(spec.window)
+
+    def test_rejects_outside_whitelist(self):
+        for value in ["median(close,5)", "sma(close)", "sma(close,5,2)", "sma(spread,5)",
+                      "sma(close,0)", f"sma(close,{MAX_WINDOW + 1})", "sma(close,-1)",
+                      "sma(close,5);drop", "vwap(close,5)", "cum_return(close,5)",
+                      "sma(close,5) OVER ()", "sma"]:
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                parse_window_spec(value)
+
+    def test_price_valued(self):
+        self.assertTrue(parse_window_spec("max(high,5)").price_valued)
+        self.assertTrue(parse_window_spec("vwap()").price_valued)
+        self.assertFalse(parse_window_spec("sum(volume,5)").price_valued)
+        self.assertFalse(parse_window_spec("cum_return(close)").price_valued)
+
+
+class TestParseWindowSpecs(unittest.TestCase):
+    def test_splits_and_deduplicates(self):
+        specs = parse_window_specs(["sma(close,20);std(close,20)", "sma(close,20)", " ; "])
+
+        self.assertEqual([spec.name for spec in specs], ["sma_close_20", "std_close_20"])
+
+    def test_rejects_none_or_too_many(self):
+        with self.assertRaises(ValueError):
+            parse_window_specs([" "])
+        with self.assertRaises(ValueError):
+            parse_window_specs([f"sma(close,{window})" for window in range(1, MAX_SPECS + 2)])
+
+    def test_warmup_bars(self):
+        specs = parse_window_specs(["sma(close,20);vwap();max(high,50)"])
+
+        self.assertEqual(warmup_bars(specs), 49)
+        self.assertEqual(warmup_bars(parse_window_specs(["cum_return(open)"])), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
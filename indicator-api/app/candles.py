@@ -1,18 +1,46 @@
 import asyncio
+import io
+import re
+import threading
+from collections import OrderedDict
 from os import getenv
-from typing import Dict, Iterable
+from typing import Callable, Dict, Iterable
 
+import numpy as np
 import pandas as pd
 import requests
 from dotenv import load_dotenv
 from logger import logger
 
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
 load_dotenv()
 log = logger(__name__)
 
 DB_ACCESSOR_API_HOST = getenv("DB_ACCESSOR_API_HOST", "database-accessor-api")
 DB_ACCESSOR_API_PORT = getenv("DB_ACCESSOR_API_PORT", 8000)
 
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+NPZ = "application/x-npz"
+# Binary columnar candles when the accessor supports them, JSON otherwise
+CANDLES_ACCEPT = ", ".join(
+    ([ARROW_STREAM] if pa is not None else [])
+    + [f"{NPZ};q=0.9", "application/json;q=0.5"]
+)
+
+# Last response per request, revalidated with If-None-Match
+CANDLES_CACHE_SIZE = int(getenv("CANDLES_CACHE_SIZE", 32))
+_candles_cache: OrderedDict[tuple, tuple[str, pd.DataFrame]] = OrderedDict()
+_candles_cache_lock = threading.Lock()
+
+# Indicators that support it are evaluated by the accessor in SQL when the
+# range spans more bars than this, 0 always downloads the candles
+SQL_PUSHDOWN_MIN_BARS = int(getenv("SQL_PUSHDOWN_MIN_BARS", 50000))
+_WINDOW_SPEC = re.compile(r"^\s*(\w+)\s*\(([^)]*)\)\s*$")
+
 
 def get_candles_sync(
     symbol_ids_mapping: Dict[str, int],
@@ -20,20 +48,35 @@ def get_candles_sync(
     start_date: str | None,
     end_date: str | None,
     limit: int | None,
+    join: str = "outer",
 ) -> pd.DataFrame:
-    """Synchronous wrapper around the async get_candles function."""
-    all_dataframes = []
+    """Fetch several symbols aligned on one timestamp axis with a single request.
 
-    for symbol, symbol_id in symbol_ids_mapping.items():
-        df = _fetch_candles_sync(
-            symbol_id, timeframe, start_date, end_date, limit
-        )
-
-        df.columns = pd.MultiIndex.from_product([df.columns, [symbol]])
-        all_dataframes.append(df)
+    Columns are a MultiIndex of (field, symbol) using the mapping's symbol names.
+    'join' is passed to the accessor: inner, outer or ffill.
+    """
+    base_url = f"http://{DB_ACCESSOR_API_HOST}:{DB_ACCESSOR_API_PORT}/candles"
+    params = _build_params(timeframe, start_date, end_date, limit)
+    params["symbol_ids"] = ",".join(str(s) for s in symbol_ids_mapping.values())
+    params["join"] = join
+    names = {symbol_id: symbol for symbol, symbol_id in symbol_ids_mapping.items()}
+    try:
+        response = requests.get(base_url, params=params, timeout=30)
+        response.raise_for_status()
+        data = response.json()
 
-    combined_df = pd.concat(all_dataframes, axis=1)
-    return combined_df
+        index = pd.DatetimeIndex(pd.to_datetime(data["timestamp"]), name="timestamp")
+        columns = {
+            (field, names[market["symbol_id"]]): market[field]
+            for field in ("open", "high", "low", "close", "volume")
+            for market in data["symbols"]
+        }
+        df = pd.DataFrame(columns, index=index, dtype=float)
+        df.columns = pd.MultiIndex.from_tuples(df.columns)
+        return df
+    except Exception as e:
+        log.error(f"Error in get_candles_sync for symbols {list(symbol_ids_mapping)}: {e}")
+        return pd.DataFrame()
 
 
 async def get_candles(
@@ -95,21 +138,191 @@ def _fetch_candles_sync(
     """
     base_url = f"http://{DB_ACCESSOR_API_HOST}:{DB_ACCESSOR_API_PORT}/candles/{symbol_id}"
     params = _build_params(timeframe, start_date, end_date, limit)
+    key = (symbol_id, tuple(sorted(params.items())))
     try:
-        response = requests.get(base_url, params=params, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-
-        df = pd.DataFrame(data)
-        if not df.empty and "timestamp" in df.columns:
-            df["timestamp"] = pd.to_datetime(df["timestamp"])  # type: ignore[index]
-            df.set_index("timestamp", inplace=True)
-        return df
+        return _conditional_get(
+            key, base_url, params, {"Accept": CANDLES_ACCEPT}, _decode_candles, timeout=30)
     except Exception as e:
         log.error(f"Error in _fetch_candles_sync for symbol {symbol_id}: {e}")
         return pd.DataFrame()
 
 
+async def get_bars(
+    symbol_id: int,
+    bar_type: str,
+    size: float | None = None,
+    timeframe: str | int = "M1",
+    start_date: str | None = None,
+    end_date: str | None = None,
+    limit: int | None = None,
+    price: str = "bid",
+) -> pd.DataFrame:
+    """Fetch volume, range, renko, heikin_ashi or tick bars built by the accessor.
+
+    The DataFrame is indexed by the bar's first timestamp and has the bar's last
+    one as column 'end'.
+    """
+    return await asyncio.to_thread(
+        _fetch_bars_sync, symbol_id, bar_type, size, timeframe, start_date, end_date, limit, price
+    )
+
+
+def _fetch_bars_sync(
+    symbol_id: int,
+    bar_type: str,
+    size: float | None,
+    timeframe: str | int,
+    start_date: str | None,
+    end_date: str | None,
+    limit: int | None,
+    price: str,
+) -> pd.DataFrame:
+    base_url = f"http://{DB_ACCESSOR_API_HOST}:{DB_ACCESSOR_API_PORT}/bars/{symbol_id}"
+    params = _build_params(timeframe, start_date, end_date, limit)  # type: ignore[arg-type]
+    params["type"] = bar_type
+    params["price"] = price
+    if size is not None:
+        params["size"] = size
+    key = ("bars", symbol_id, tuple(sorted(params.items())))
+    try:
+        return _conditional_get(key, base_url, params, {}, _decode_bars, timeout=60)
+    except Exception as e:
+        log.error(f"Error in _fetch_bars_sync for symbol {symbol_id}: {e}")
+        return pd.DataFrame()
+
+
+async def get_window_columns(
+    symbol_id: int,
+    specs: Dict[str, str],
+    timeframe: int,
+    start_date: str | None,
+    end_date: str | None,
+    limit: int | None,
+) -> pd.DataFrame | None:
+    """Evaluate window specs such as 'sma(close,20)' in the accessor's database.
+
+    'specs' maps output column names to specs. The DataFrame is indexed by
+    timestamp with one column per output, or None if the accessor could not
+    evaluate the specs so the caller can fall back to downloading candles.
+    """
+    return await asyncio.to_thread(
+        _fetch_window_columns_sync, symbol_id, specs, timeframe, start_date, end_date, limit
+    )
+
+
+def _fetch_window_columns_sync(
+    symbol_id: int,
+    specs: Dict[str, str],
+    timeframe: int,
+    start_date: str | None,
+    end_date: str | None,
+    limit: int | None,
+) -> pd.DataFrame | None:
+    base_url = (
+        f"http://{DB_ACCESSOR_API_HOST}:{DB_ACCESSOR_API_PORT}/candles/{symbol_id}/windows"
+    )
+    params = _build_params(timeframe, start_date, end_date, limit)
+    params["columns"] = ";".join(dict.fromkeys(specs.values()))
+    key = ("windows", symbol_id, tuple(sorted(params.items())))
+
+    def decode(response: requests.Response) -> pd.DataFrame:
+        data = response.json()
+        index = pd.DatetimeIndex(pd.to_datetime(data["timestamp"]), name="timestamp")
+        # Matched by name: the accessor drops specs that parse the same, so its
+        # columns do not follow the specs sent one to one
+        return pd.DataFrame(
+            {output: data[window_column(spec)] for output, spec in specs.items()},
+            index=index, dtype=float,
+        )
+
+    try:
+        return _conditional_get(key, base_url, params, {}, decode, timeout=60)
+    except Exception as e:
+        log.warning(f"Window columns unavailable for symbol {symbol_id}, using candles: {e}")
+        return None
+
+
+def window_column(spec: str) -> str:
+    """Name of the accessor's column of a window spec, e.g. sma_close_20 for 'sma(close, 20)'.
+
+    Raises ValueError for specs not shaped like function(arguments).
+    """
+    match = _WINDOW_SPEC.match(spec)
+    if match is None:
+        raise ValueError(f"Invalid window spec: {spec}")
+    args = [arg.strip() for arg in match.group(2).split(",") if arg.strip()]
+    return "_".join([match.group(1), *args])
+
+
+def _conditional_get(
+    key: tuple,
+    url: str,
+    params: dict,
+    headers: dict,
+    decode: Callable[[requests.Response], pd.DataFrame],
+    timeout: float,
+) -> pd.DataFrame:
+    """GET a DataFrame, revalidating the cached one of 'key' with If-None-Match.
+
+    A 304 returns a copy of the cached DataFrame and marks it recently used,
+    otherwise the response is decoded and stored when it carries an ETag.
+    Request and decoding errors are raised to the caller.
+    """
+    with _candles_cache_lock:
+        cached = _candles_cache.get(key)
+    if cached is not None:
+        headers = {**headers, "If-None-Match": cached[0]}
+    response = requests.get(url, params=params, headers=headers, timeout=timeout)
+    if response.status_code == 304 and cached is not None:
+        with _candles_cache_lock:
+            if key in _candles_cache:
+                _candles_cache.move_to_end(key)
+        return cached[1].copy()
+    response.raise_for_status()
+    df = decode(response)
+
+    etag = response.headers.get("ETag")
+    if etag and CANDLES_CACHE_SIZE > 0:
+        with _candles_cache_lock:
+            _candles_cache[key] = (etag, df.copy())
+            _candles_cache.move_to_end(key)
+            while len(_candles_cache) > CANDLES_CACHE_SIZE:
+                _candles_cache.popitem(last=False)
+    return df
+
+
+def _decode_bars(response: requests.Response) -> pd.DataFrame:
+    """Build a DataFrame indexed by the bars' first timestamp from a bars response."""
+    df = pd.DataFrame(response.json()["bars"])
+    if not df.empty:
+        df["timestamp"] = pd.to_datetime(df["timestamp"])
+        df["end"] = pd.to_datetime(df["end"])
+        df.set_index("timestamp", inplace=True)
+    return df
+
+
+def _decode_candles(response: requests.Response) -> pd.DataFrame:
+    """Build a timestamp indexed DataFrame from a JSON, npz or Arrow response."""
+    content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+
+    if content_type == ARROW_STREAM and pa is not None:
+        table = pa.ipc.open_stream(response.content).read_all()
+        df = table.to_pandas(split_blocks=True, self_destruct=True)
+    elif content_type == NPZ:
+        with np.load(io.BytesIO(response.content)) as arrays:
+            columns = {name: arrays[name] for name in arrays.files}
+        columns["timestamp"] = pd.to_datetime(columns["timestamp"], unit="ms")
+        df = pd.DataFrame(columns, copy=False)
+    else:
+        df = pd.DataFrame(response.json())
+        if df.empty or "timestamp" not in df.columns:
+            return df
+        df["timestamp"] = pd.to_datetime(df["timestamp"])  # type: ignore[index]
+
+    df.set_index("timestamp", inplace=True)
+    return df
+
+
 def _build_params(
     timeframe: int,
     start_date: str | None,
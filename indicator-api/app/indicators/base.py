@@ -17,6 +17,12 @@ class Indicator(Protocol):
     parameters for its configuration. Optional convenience:
     A module-level ``METADATA`` dict containing a ``parameters`` mapping
     with possible defaults (already used across the project).
+
+    Indicators made of simple rolling windows may also expose a static
+    ``pushdown`` method taking the same keyword parameters and returning a
+    mapping of output column to accessor window spec (e.g.
+    ``{'sma': 'sma(close,20)'}``), or None when the parameters cannot be
+    evaluated that way. See ``pushdown_specs``.
     """
 
     @staticmethod
@@ -132,7 +138,37 @@ def execute_indicator(
     return run_fn(data=data, **forwarded)
 
 
+def pushdown_specs(indicator: Any, **params: Any) -> Dict[str, str] | None:
+    """Window specs the accessor can evaluate in SQL instead of ``run``.
+
+    Parameters are filtered to the ``pushdown`` signature, missing required
+    ones filled from ``METADATA`` defaults like ``execute_indicator`` does.
+
+    Returns
+    -------
+    dict[str, str] | None
+        Output column to window spec, or None when the indicator has no
+        ``pushdown`` method or cannot push these parameters down.
+    """
+    indicator_cls = indicator if inspect.isclass(indicator) else indicator.__class__
+    pushdown_fn = getattr(indicator_cls, 'pushdown', None)
+    if pushdown_fn is None:
+        return None
+
+    meta_params: Dict[str, Any] = _load_metadata(indicator_cls).get('parameters', {})
+    forwarded: Dict[str, Any] = {}
+    for name, param in inspect.signature(pushdown_fn).parameters.items():
+        if name in params:
+            forwarded[name] = params[name]
+        elif param.default is inspect._empty:
+            if 'default' not in meta_params.get(name, {}):
+                return None
+            forwarded[name] = meta_params[name]['default']
+    return pushdown_fn(**forwarded)
+
+
 __all__ = [
     'Indicator',
     'execute_indicator',
+    'pushdown_specs',
 ]
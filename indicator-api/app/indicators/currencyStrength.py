@@ -78,7 +78,8 @@ class CURRENCY_STRENGTH:
     def run(data: pd.DataFrame, timeframe: int, start_date: str, end_date: str, limit: int) -> pd.DataFrame:
         symbol_ids_mapping = get_symbol_mapping(METADATA['inputs'])
 
-        _data = get_candles_sync(symbol_ids_mapping, timeframe, start_date, end_date, limit)
+        _data = get_candles_sync(
+            symbol_ids_mapping, timeframe, start_date, end_date, limit, join='inner')
         _data = _data['close'].dropna()
 
         def get_val(prev_val, curr_val):
@@ -37,6 +37,13 @@ class SMA:
 
         return sma
 
+    @staticmethod
+    def pushdown(source: str = 'close', window: int = 20) -> dict[str, str] | None:
+        """Rolling mean evaluated by the accessor, see pushdown_specs."""
+        if not isinstance(window, int) or window < 1:
+            return None
+        return {'sma': f'sma({source},{window})'}
+
     @staticmethod
     def run_multi(data: pd.DataFrame, source: str = 'close', window: int | list[int] = 20):
         window = [window] if isinstance(window, int) else window
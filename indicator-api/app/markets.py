@@ -69,38 +69,21 @@ def get_symbol_mapping(symbols: list[str]) -> Dict[str, int]:
 
 
 def get_symbol_id_sync(symbols: list[str]) -> dict[str, int]:
-    """Blocking fetch for multiple symbols' IDs. Returns {symbol: symbol_id|None} mapping.
-    Runs multiple requests in parallel using asyncio and threads.
-    """
-    mapping: dict[str, int] = {}
-    missing: list[str] = []
-    for sym in symbols:
-        _, sid = _fetch_symbol_id_sync(sym)
-        if sid is not None:
-            mapping[sym] = sid
-        else:
-            missing.append(sym)
-    if missing:
-        log.info("Symbols not found (skipped): %s", missing)
-    return mapping
+    """Blocking fetch of multiple symbols' IDs in one request to the market catalog.
 
-
-def _fetch_symbol_id_sync(symbol: str) -> tuple[str, int | None]:
-    """Blocking fetch for a single symbol's ID. Returns (symbol, symbol_id|None)."""
-    base_url = f"http://{DB_ACCESSOR_API_HOST}:{DB_ACCESSOR_API_PORT}/markets"
+    Returns a {symbol: symbol_id} mapping of the symbols found.
+    """
+    base_url = f"http://{DB_ACCESSOR_API_HOST}:{DB_ACCESSOR_API_PORT}/markets/lookup"
 
     try:
-        params = {"symbol": symbol}
-        resp = requests.get(base_url, params=params, timeout=10)
+        resp = requests.get(base_url, params={"symbols": ",".join(symbols)}, timeout=10)
         resp.raise_for_status()
-        markets = resp.json()
-        if markets:
-            symbol_id = markets[0]["symbol_id"]
-            log.debug("Found ID %s for symbol %s", symbol_id, symbol)
-            return symbol, symbol_id
-        else:
-            log.debug("No market found for symbol: %s", symbol)
-            return symbol, None
+        result = resp.json()
     except Exception as e:  # broad catch acceptable for I/O boundary
-        log.warning("Error fetching symbol ID for %s: %s", symbol, e)
-        return symbol, None
+        log.warning("Error fetching symbol IDs for %s: %s", symbols, e)
+        return {}
+
+    mapping = {symbol: market["symbol_id"] for symbol, market in result["markets"].items()}
+    if result["missing"]:
+        log.info("Symbols not found (skipped): %s", result["missing"])
+    return mapping
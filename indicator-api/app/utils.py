@@ -120,6 +120,31 @@ def adjust_fetch_bounds(
     return fetch_start, fetch_limit, orig_start, orig_limit
 
 
+def estimate_bars(
+    *,
+    start_date: str | None,
+    end_date: str | None,
+    limit: int | None,
+    timeframe: int,
+    warmup: int,
+) -> int | None:
+    """Estimate how many bars a request downloads, warmup included.
+
+    Returns None when the range is unbounded (no start_date and no limit),
+    i.e. the whole history is fetched.
+    """
+    if limit is not None:
+        return limit + warmup
+    if not start_date:
+        return None
+    try:
+        start = _pd.to_datetime(start_date, utc=True)
+        end = _pd.to_datetime(end_date, utc=True) if end_date else _pd.Timestamp.now(tz='UTC')
+    except Exception:
+        return None
+    return max(0, int((end - start) / timedelta(minutes=timeframe))) + warmup
+
+
 def trim_indicator_output(
     df: pd.DataFrame,
     *,
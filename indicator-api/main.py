@@ -4,18 +4,19 @@ from fastapi import FastAPI, Query, Body
 from fastapi.middleware.cors import CORSMiddleware
 from logger import logger, LOG_LEVEL_UVICORN
 from app.schemas import IndicatorParameters
-from app.candles import get_candles
+from app.candles import get_candles, get_window_columns, SQL_PUSHDOWN_MIN_BARS
 from app.utils import (
     prepare_parameters,
     format_indicator_response,
     estimate_warmup,
+    estimate_bars,
     adjust_fetch_bounds,
     trim_indicator_output,
 )
 from app.markets import load_symbols
 import app.markets as markets
 from app import get_available_indicators, get_indicator_by_id, get_indicator_metadata
-from app.indicators.base import execute_indicator
+from app.indicators.base import execute_indicator, pushdown_specs
 import uvicorn
 import os
 
@@ -93,6 +94,31 @@ async def run_indicator(
 
     # Determine warmup period to fetch extra history so user limit/start_date are honored.
     warmup = estimate_warmup(metadata, parameters)
+    indicator_cls = get_indicator_by_id(indicator_id)
+
+    # Large ranges of simple rolling indicators are evaluated by the accessor in SQL,
+    # which returns the indicator columns only instead of every candle
+    specs = pushdown_specs(indicator_cls, **parameters) if SQL_PUSHDOWN_MIN_BARS > 0 else None
+    if specs:
+        bars = estimate_bars(start_date=start_date, end_date=end_date, limit=limit,
+                             timeframe=timeframe, warmup=warmup)
+        if bars is None or bars >= SQL_PUSHDOWN_MIN_BARS:
+            log.info(f"Evaluating {specs} in SQL for about {bars or 'all'} bars")
+            indicator_raw = await get_window_columns(
+                symbol_id=symbol_id,
+                specs=specs,
+                timeframe=timeframe,
+                start_date=start_date,
+                end_date=end_date,
+                limit=limit,
+            )
+            if indicator_raw is not None:
+                indicator_data = trim_indicator_output(
+                    indicator_raw,
+                    original_start_date=start_date,
+                    original_limit=limit,
+                )
+                return format_indicator_response(indicator_data, metadata)
 
     fetch_start, fetch_limit, orig_start, orig_limit = adjust_fetch_bounds(
         start_date=start_date,
@@ -116,7 +142,6 @@ async def run_indicator(
 
     log.debug(f"Fetched candles:\n{candles}")
 
-    indicator_cls = get_indicator_by_id(indicator_id)
     indicator_raw = execute_indicator(
         indicator_cls,
         candles,
@@ -0,0 +1,58 @@
+import unittest
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.utils import estimate_bars
+
+
+class TestEstimateBars(unittest.TestCase):
+    def test_limit_includes_warmup(self):
+        self.assertEqual(
+            estimate_bars(start_date="2024-01-01", end_date=None, limit=500, timeframe=60,
+                          warmup=20),
+            520,
+        )
+
+    def test_date_range(self):
+        self.assertEqual(
+            estimate_bars(start_date="2024-01-01", end_date="2024-01-02", limit=None,
+                          timeframe=60, warmup=10),
+            34,
+        )
+        self.assertEqual(
+            estimate_bars(start_date="2024-01-01T00:00:00Z", end_date="2024-01-01T01:30:00Z",
+                          limit=None, timeframe=1, warmup=0),
+            90,
+        )
+
+    def test_partial_bar_is_not_counted(self):
+        self.assertEqual(
+            estimate_bars(start_date="2024-01-01T00:00", end_date="2024-01-01T00:59",
+                          limit=None, timeframe=15, warmup=0),
+            3,
+        )
+
+    def test_end_before_start(self):
+        self.assertEqual(
+            estimate_bars(start_date="2024-01-02", end_date="2024-01-01", limit=None,
+                          timeframe=60, warmup=5),
+            5,
+        )
+
+    def test_unbounded_or_invalid_range(self):
+        self.assertIsNone(
+            estimate_bars(start_date=None, end_date="2024-01-01", limit=None, timeframe=60,
+                          warmup=5))
+        self.assertIsNone(
+            estimate_bars(start_date="not a date", end_date=None, limit=None, timeframe=60,
+                          warmup=5))
+
+    def test_open_end_runs_to_now(self):
+        bars = estimate_bars(start_date="2024-01-01", end_date=None, limit=None,
+                             timeframe=1440, warmup=0)
+        self.assertGreater(bars, 365)
+
+
+if __name__ == '__main__':
+    unittest.main()
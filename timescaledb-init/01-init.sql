@@ -30,3 +30,53 @@ CREATE TABLE IF NOT EXISTS candles (
     FOREIGN KEY (symbol_id) REFERENCES markets (symbol_id),
     PRIMARY KEY (symbol_id, timestamp)
 );
+
+-- Store candles as a hypertable; compression and reorder policies are
+-- applied by the database-accessor-api on startup
+SELECT create_hypertable(
+    'candles', 'timestamp',
+    chunk_time_interval => INTERVAL '7 days',
+    create_default_indexes => false,
+    if_not_exists => true
+);
+
+-- Per-symbol data versions for conditional GETs and delta sync of candles
+CREATE SEQUENCE IF NOT EXISTS candle_versions_seq;
+
+CREATE TABLE IF NOT EXISTS candle_versions (
+    symbol_id INTEGER PRIMARY KEY REFERENCES markets (symbol_id) ON DELETE CASCADE,
+    version BIGINT NOT NULL,
+    last_modified TIMESTAMPTZ NOT NULL DEFAULT now(),
+    changes_floor BIGINT NOT NULL DEFAULT 0
+);
+
+-- Written time range per version, for delta sync of candles
+CREATE TABLE IF NOT EXISTS candle_changes (
+    seq BIGINT PRIMARY KEY,
+    symbol_id INTEGER NOT NULL REFERENCES markets (symbol_id) ON DELETE CASCADE,
+    min_ts TIMESTAMP,
+    max_ts TIMESTAMP,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS candle_changes_symbol_id_seq_idx ON candle_changes (symbol_id, seq);
+
+-- Contiguous ranges of every symbol's candles, for gap detection without scanning candles
+CREATE TABLE IF NOT EXISTS candle_coverage (
+    symbol_id INTEGER NOT NULL REFERENCES markets (symbol_id) ON DELETE CASCADE,
+    range_start TIMESTAMP NOT NULL,
+    range_end TIMESTAMP NOT NULL,
+    row_count BIGINT NOT NULL,
+    PRIMARY KEY (symbol_id, range_start)
+);
+
+-- Ticks with epoch millisecond timestamps and bid/ask scaled by 100000, turned into a
+-- compressed hypertable by the accessor on startup
+CREATE TABLE IF NOT EXISTS ticks (
+    symbol_id INTEGER NOT NULL REFERENCES markets (symbol_id) ON DELETE CASCADE,
+    ts BIGINT NOT NULL,
+    bid BIGINT NOT NULL,
+    ask BIGINT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ticks_symbol_id_ts_idx ON ticks (symbol_id, ts);